@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import logging
+
+from manifestcache import CACHE_FOLDER
+
+#------------------------------------------------------------------------------
+# AppliedScriptsCache
+#------------------------------------------------------------------------------
+# Remembers the scripts applied to a schema on one database, along with the
+# highest version_tracking id read (the watermark) and how many rows were at
+# or below it. Later runs read only the rows above the watermark, checking in
+# the same query that the count and highest id at or below it are unchanged.
+# If they are not (rows deleted, the schema dropped and created again, ids
+# handed out of order by concurrent deployers) the cache is rebuilt from the
+# whole table.
+#
+# Version folders found to be fully applied are remembered with their
+# modification time so later plans can skip them without listing them.
+#------------------------------------------------------------------------------
+CACHE_FORMAT = 1
+
+
+class AppliedScriptsCache(object):
+    log = logging.getLogger('appliedcache.AppliedScriptsCache')
+
+    def __init__(self, path, rescan = False):
+        self.__path = path
+        self.__data = self.__empty() if rescan else self.__load()
+        self.__dirty = rescan
+
+
+    @staticmethod
+    def for_target(schema, target, rescan = False, cacheFolder = CACHE_FOLDER):
+        """The cache of schema on the database target (e.g. user@host)"""
+        key = hashlib.sha1(target.lower().encode('utf-8')).hexdigest()[:12]
+        return AppliedScriptsCache(os.path.join(cacheFolder, '{0}.{1}.applied.json'.format(schema, key)), rescan)
+
+
+    @property
+    def watermark(self):
+        return self.__data['watermark']
+
+
+    @property
+    def scripts(self):
+        """(version, script) of every cached applied script"""
+        return frozenset(tuple(s) for s in self.__data['scripts'])
+
+
+    @property
+    def complete_folders(self):
+        return dict(self.__data['complete'])
+
+
+    def matches(self, count, maxId):
+        """True if count rows with ids up to maxId at or below the watermark is what was cached"""
+        return count == len(self.__data['scripts']) and maxId == self.__data['watermark']
+
+
+    def add(self, rows):
+        """Adds (id, version, script) rows read from above the watermark"""
+        for id, version, script in rows:
+            self.__data['scripts'].append([version, script])
+            self.__data['watermark'] = max(self.__data['watermark'] or 0, id)
+        if rows:
+            self.__dirty = True
+
+
+    def rebuild(self, rows):
+        """Replaces everything cached with (id, version, script) rows read from the whole table"""
+        self.__data = self.__empty()
+        self.add(rows)
+        self.__data['watermark'] = self.__data['watermark'] or 0
+        self.__dirty = True
+
+
+    def set_complete_folders(self, folders):
+        if folders != self.__data['complete']:
+            self.__data['complete'] = dict(folders)
+            self.__dirty = True
+
+
+    def save(self):
+        if not self.__dirty:
+            return
+
+        folder = os.path.dirname(self.__path)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        temp = '{0}.{1}.tmp'.format(self.__path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(dict(self.__data, format = CACHE_FORMAT), f)
+        os.replace(temp, self.__path)
+        self.__dirty = False
+        AppliedScriptsCache.log.debug('applied scripts cache saved to "{0}" (watermark {1}).'.format(self.__path, self.watermark))
+
+
+    def __empty(self):
+        return {'watermark': None, 'scripts': [], 'complete': {}}
+
+
+    def __load(self):
+        try:
+            with open(self.__path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return self.__empty()
+        except ValueError:
+            AppliedScriptsCache.log.warning('ignoring unreadable applied scripts cache "{0}".'.format(self.__path))
+            return self.__empty()
+
+        if data.get('format') != CACHE_FORMAT:
+            return self.__empty()
+        return {'watermark': data.get('watermark'), 'scripts': data.get('scripts', []), 'complete': data.get('complete', {})}
@@ -0,0 +1,223 @@
+import os
+import io
+import mmap
+import time
+import tarfile
+import zipfile
+import functools
+import threading
+import logging
+
+#------------------------------------------------------------------------------
+# Release archives
+#------------------------------------------------------------------------------
+# Reads schema folders straight out of a zip or tar release archive instead
+# of a copy unpacked under the current folder. The members are indexed once
+# when the archive is opened and bodies are only read when asked for:
+#   - zip: from the archive through its central directory.
+#   - uncompressed tar: the archive is memory mapped and a body is the slice
+#     of the map at the member's data offset.
+#   - compressed tar (.tar.gz, .tgz, .tar.bz2, .tar.xz): these cannot be
+#     read from the middle, so the archive is streamed through once when
+#     opened and the bodies of its files are kept in memory.
+# open_binary returns a file reading a member a buffer at a time, for csv
+# loads that should not be read into memory whole (only compressed tars,
+# which are in memory already, are not streamed).
+#
+# Paths are asked for as they would be under the current folder (e.g.
+# ./foo/versions/0.1/a.sql) so scripts are tracked under the same names
+# however they are read. If everything in the archive is under one folder
+# that is not a schema (release-1.2/ say) that folder is skipped over.
+#------------------------------------------------------------------------------
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class ArchiveException(Exception):
+    pass
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+@functools.lru_cache(maxsize = None)
+def open_archive(path):
+    """Returns the archive at path, opening and indexing it the first time it is asked for"""
+    return ReleaseArchive(path)
+
+
+def member_key(path):
+    """The name of a member from a path as it would be under the current folder"""
+    parts = [p for p in path.replace(os.sep, '/').split('/') if p and p != '.']
+    return '/'.join(parts)
+
+
+class ReleaseArchive(object):
+    log = logging.getLogger('archivesource.ReleaseArchive')
+
+    def __init__(self, path):
+        self.__path = path
+        self.__stamp = os.stat(path).st_mtime_ns
+        self.__lock = threading.Lock()
+        self.__zip = None
+        self.__map = None
+        self.__members = {}
+        self.__folders = {'': {}}
+
+        started = time.perf_counter()
+        if zipfile.is_zipfile(path):
+            entries = self.__index_zip()
+        elif tarfile.is_tarfile(path):
+            entries = self.__index_tar()
+        else:
+            raise ArchiveException('"{0}" is not a zip or tar archive.'.format(path))
+
+        entries = [(member_key(name), size, mtime, locator) for name, size, mtime, locator in entries]
+        prefix = self.__top_folder([key for key, size, mtime, locator in entries])
+        for key, size, mtime, locator in entries:
+            self.__add(key[len(prefix):], size, mtime, locator)
+        ReleaseArchive.log.info('indexed {0} file(s) of "{1}" in {2:.2f}s.'.format(len(self.__members), path, time.perf_counter() - started))
+
+
+    @property
+    def stamp(self):
+        """The modification time of the archive, standing in for that of every folder in it"""
+        return self.__stamp
+
+
+    def is_folder(self, path):
+        return member_key(path) in self.__folders
+
+
+    def is_file(self, path):
+        return member_key(path) in self.__members
+
+
+    def list_folder(self, path):
+        """Returns [name, is folder, size, mtime] for every entry in path not starting with an underscore"""
+
+        key = member_key(path)
+        if not key in self.__folders:
+            raise FileNotFoundError(path)
+        entries = []
+        for name, isFolder in self.__folders[key].items():
+            if name.startswith('_'):
+                continue
+            size, mtime = (0, self.__stamp) if isFolder else self.__members[key + '/' + name if key else name][:2]
+            entries.append([name, isFolder, size, mtime])
+        return sorted(entries)
+
+
+    def get_folders_in(self, path):
+        return [name for name, isFolder, size, mtime in self.list_folder(path) if isFolder]
+
+
+    def get_files_in(self, path):
+        return [name for name, isFolder, size, mtime in self.list_folder(path) if not isFolder]
+
+
+    def get_file_info(self, path):
+        """Returns the (size, mtime) of a file"""
+        return self.__member(path)[:2]
+
+
+    def save(self):
+        pass
+
+
+    def read_bytes(self, path):
+        size, mtime, locator = self.__member(path)
+        if isinstance(locator, bytes):
+            return locator
+        if isinstance(locator, zipfile.ZipInfo):
+            with self.__lock:
+                return self.__zip.read(locator)
+        return self.__map[locator:locator + size]
+
+
+    def open_binary(self, path):
+        """Returns a binary file reading a member a buffer at a time"""
+
+        size, mtime, locator = self.__member(path)
+        if isinstance(locator, bytes):
+            return io.BytesIO(locator)
+        if isinstance(locator, zipfile.ZipInfo):
+            return self.__zip.open(locator)
+        return io.BufferedReader(MappedMember(self.__map, locator, size))
+
+
+    def read_text(self, path):
+        return self.read_bytes(path).decode('utf-8', errors = 'replace')
+
+
+    def close(self):
+        if self.__zip:
+            self.__zip.close()
+        if self.__map:
+            self.__map.close()
+
+
+    def __member(self, path):
+        member = self.__members.get(member_key(path))
+        if member is None:
+            raise FileNotFoundError('"{0}" is not in "{1}".'.format(path, self.__path))
+        return member
+
+
+    def __index_zip(self):
+        self.__zip = zipfile.ZipFile(self.__path)
+        return [(info.filename, info.file_size, int(time.mktime(info.date_time + (0, 0, -1)) * 1e9), info)
+            for info in self.__zip.infolist() if not info.is_dir()]
+
+
+    def __index_tar(self):
+        try:
+            with tarfile.open(self.__path, 'r:') as tar:
+                entries = [(m.name, m.size, int(m.mtime * 1e9), m.offset_data) for m in tar if m.isfile()]
+        except tarfile.ReadError:
+            ReleaseArchive.log.debug('"{0}" is compressed so its files are read into memory.'.format(self.__path))
+            with tarfile.open(self.__path, 'r|*') as tar:
+                return [(m.name, m.size, int(m.mtime * 1e9), tar.extractfile(m).read()) for m in tar if m.isfile()]
+
+        if entries:
+            with open(self.__path, 'rb') as f:
+                self.__map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        return entries
+
+
+    def __top_folder(self, keys):
+        """Returns the one folder everything is under, with a trailing /, if it is not a schema"""
+
+        tops = set(key.split('/', 1)[0] for key in keys)
+        if len(tops) != 1 or not all('/' in key for key in keys):
+            return ''
+        top = tops.pop()
+        if any(key == top + '/create.user.sql' or key.startswith((top + '/versions/', top + '/baseline/')) for key in keys):
+            return ''
+        return top + '/'
+
+
+    def __add(self, key, size, mtime, locator):
+        self.__members[key] = (size, mtime, locator)
+        parts = key.split('/')
+        for i in range(len(parts)):
+            folder = '/'.join(parts[:i])
+            self.__folders.setdefault(folder, {})[parts[i]] = i < len(parts) - 1
+
+
+class MappedMember(io.RawIOBase):
+    """A member of a memory mapped tar, read from the map without copying the whole of it"""
+
+    def __init__(self, mapped, offset, size):
+        self.__map = mapped
+        self.__position = offset
+        self.__end = offset + size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), self.__end - self.__position))
+        buffer[:count] = self.__map[self.__position:self.__position + count]
+        self.__position += count
+        return count
@@ -0,0 +1,187 @@
+"""Measures the cost of a sync against fake sqlplus and cx_Oracle stand ins.
+
+A synthetic schema tree shaped like foo/ is generated in a temporary folder
+and synced twice for each engine: "cold" applies every script to an empty
+database, "warm" runs again when there is nothing left to apply. "bundle"
+then applies a bundle of the same scripts to an empty database. For each run
+the wall time, sqlplus processes started, connections opened and database
+round trips are recorded, in total and per applied script, and written as
+json.
+
+usage: python benchmark.py [--versions=<count>] [--scripts=<count>] [--script-size=<bytes>]
+                           [--latency=<ms>] [--connect-latency=<ms>] [--startup=<ms>]
+                           [--engines=sqlplus,native] [--output=<file>]
+"""
+import fake_cx_oracle
+database = fake_cx_oracle.install()
+
+import os
+import sys
+import json
+import time
+import getopt
+import logging
+import datetime
+import platform
+import tempfile
+
+from contextlib import contextmanager, redirect_stdout
+
+import dbsync
+import sqlplusscriptrunner as runner
+
+FAKE_SQLPLUS = (sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_sqlplus.py'))
+SCHEMA = 'bench'
+
+DEFAULTS = {
+    'versions': 10,
+    'scripts': 10,
+    'script_size': 2048,
+    'latency': 1.0,
+    'connect_latency': 20.0,
+    'startup': 50.0,
+    'engines': runner.ENGINES,
+    'output': None }
+
+
+def generate_schema_tree(root, schema, versions, scriptsPerVersion, scriptSize):
+    """Writes <root>/<schema> with a create.user.sql, a baseline and versions 0.1 .. 0.<versions>"""
+
+    schemaFolder = os.path.join(root, schema)
+    os.makedirs(os.path.join(schemaFolder, 'baseline'))
+    write_script(os.path.join(schemaFolder, 'create.user.sql'), 'create user {0} identified by {0};\n'.format(schema), 0)
+    write_script(os.path.join(schemaFolder, 'baseline', 'all objects.sql'), 'create table base (id number);\n', scriptSize)
+
+    for v in range(1, versions + 1):
+        folder = os.path.join(schemaFolder, 'versions', '0.{0}'.format(v))
+        os.makedirs(folder)
+        for s in range(1, scriptsPerVersion + 1):
+            write_script(os.path.join(folder, 'script {0:04}.sql'.format(s)), 'create table t_{0}_{1} (id number);\n'.format(v, s), scriptSize)
+
+
+def write_script(path, statement, size):
+    padding = max(0, size - len(statement))
+    with open(path, 'w') as f:
+        f.write(statement)
+        while padding > 0:
+            line = '-- padding to make the script the size asked for\n'[:padding]
+            f.write(line)
+            padding -= len(line)
+
+
+@contextmanager
+def in_folder(root):
+    """Runs dbsync from root with anything it prints kept out of the json results"""
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        with redirect_stdout(sys.stderr):
+            yield
+    finally:
+        os.chdir(cwd)
+
+
+def run_sync(root, engine, spawnLog, action = dbsync.sync_db, argv = ['--schema={0}'.format(SCHEMA), 'sync']):
+    database.reset_counters()
+    open(spawnLog, 'w').close()
+    applied = len(database.tracking.get(SCHEMA.upper(), []))
+
+    with in_folder(root):
+        sqlRunner = runner.OracleSqlRunner('bench', 'bench', 'fake', FAKE_SQLPLUS, engine = engine, output = runner.OutputSettings(200, None, None))
+        argReader = dbsync.ArgumentsReader(['--loglevel=WARN'] + argv)
+        started = time.perf_counter()
+        try:
+            action(argReader, sqlRunner)
+        finally:
+            sqlRunner.close()
+        seconds = time.perf_counter() - started
+        spawnSeconds = sqlRunner.metrics.summary()['spawn_seconds']
+
+    with open(spawnLog) as f:
+        spawns = len(f.readlines())
+
+    scripts = len(database.tracking.get(SCHEMA.upper(), [])) - applied
+    per = max(scripts, 1)
+    return {
+        'seconds': round(seconds, 4),
+        'scripts_applied': scripts,
+        'process_spawns': spawns,
+        'spawn_seconds': spawnSeconds,
+        'connections': database.connections,
+        'round_trips': database.round_trips,
+        'per_applied_script': {
+            'seconds': round(seconds / per, 6),
+            'process_spawns': round(spawns / per, 3),
+            'spawn_seconds': round(spawnSeconds / per, 6),
+            'connections': round(database.connections / per, 3),
+            'round_trips': round(database.round_trips / per, 3) } }
+
+
+def run_benchmark(settings):
+    database.latency = settings['latency'] / 1000
+    database.connect_latency = settings['connect_latency'] / 1000
+    results = []
+
+    with tempfile.TemporaryDirectory() as root:
+        spawnLog = os.path.join(root, 'sqlplus processes.log')
+        os.environ['FAKE_SQLPLUS_LOG'] = spawnLog
+        os.environ['FAKE_SQLPLUS_STARTUP_SECONDS'] = str(settings['startup'] / 1000)
+        generate_schema_tree(root, SCHEMA, settings['versions'], settings['scripts'], settings['script_size'])
+
+        bundlePath = os.path.join(root, 'bench.bundle.json')
+        with in_folder(root):
+            dbsync.bundle_db(dbsync.ArgumentsReader(['--schema={0}'.format(SCHEMA), '--bundle={0}'.format(bundlePath), '--loglevel=WARN', 'bundle']), None)
+
+        for engine in settings['engines']:
+            for scenario in ('cold', 'warm', 'bundle'):
+                if scenario != 'warm':
+                    database.users.discard(SCHEMA.upper())
+                    database.tracking.pop(SCHEMA.upper(), None)
+                if scenario == 'bundle':
+                    result = run_sync(root, engine, spawnLog, dbsync.apply_bundle, ['--bundle={0}'.format(bundlePath), 'apply'])
+                else:
+                    result = run_sync(root, engine, spawnLog)
+                result.update({'scenario': scenario, 'engine': engine})
+                results.append(result)
+
+    return {
+        'started': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'settings': dict(settings, engines = list(settings['engines'])),
+        'results': results }
+
+
+def read_settings(argv):
+    settings = dict(DEFAULTS)
+    opts, args = getopt.getopt(argv, 'h', ['versions=', 'scripts=', 'script-size=', 'latency=', 'connect-latency=', 'startup=', 'engines=', 'output=', 'help'])
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+        name = opt.lstrip('-').replace('-', '_')
+        if name == 'engines':
+            settings[name] = tuple(e.strip() for e in arg.split(','))
+        elif name == 'output':
+            settings[name] = arg
+        elif name in ('versions', 'scripts', 'script_size'):
+            settings[name] = int(arg)
+        else:
+            settings[name] = float(arg)
+    return settings
+
+
+def main(argv):
+    logging.basicConfig(level = logging.WARN)
+    settings = read_settings(argv)
+    report = json.dumps(run_benchmark(settings), indent = 2)
+
+    if settings['output']:
+        with open(settings['output'], 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,161 @@
+import re
+import json
+import hashlib
+import datetime
+import logging
+
+from collections import namedtuple
+
+from metrics import write_atomically
+from csvloader import is_csv_load
+
+#------------------------------------------------------------------------------
+# Migration bundles
+#------------------------------------------------------------------------------
+# A bundle is a single json file holding everything needed to bring schemas
+# up to a target version: for each schema its create.user.sql, its baseline
+# scripts and the scripts of every version up to the target, in the order
+# they are to be run, with the sha256 of each. Applying a bundle reads
+# nothing else from disk.
+#
+# A bundle holds every script up to the target, not just those some database
+# is missing, so one bundle can be applied anywhere. Scripts already recorded
+# in version_tracking are skipped when it is applied.
+#
+# Every script of a schema is streamed, one after the other, into a single
+# sqlplus session and the scripts of each version that completed are
+# recorded in one write at the end of the version, even if a later script of
+# the version fails.
+#------------------------------------------------------------------------------
+BUNDLE_FORMAT = 1
+INCLUDE = re.compile(r'^\s*@', re.MULTILINE)
+
+BundledScript = namedtuple('BundledScript', ['path', 'checksum', 'body'])
+BundledVersion = namedtuple('BundledVersion', ['version', 'scripts'])
+SchemaBundle = namedtuple('SchemaBundle', ['schema', 'create_user', 'baseline', 'versions'])
+
+
+class BundleException(Exception):
+    pass
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def bundle_script(path, readBytes = read_file):
+    if is_csv_load(path):
+        raise BundleException('"{0}" is a csv load which bundles do not support.'.format(path))
+    data = readBytes(path)
+    try:
+        body = data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise BundleException('"{0}" is not utf-8 so cannot be bundled.'.format(path))
+    if INCLUDE.search(body):
+        raise BundleException('"{0}" runs other scripts with @ or @@ which bundles do not support.'.format(path))
+    return BundledScript(path, hashlib.sha256(data).hexdigest(), body)
+
+
+def build_schema_bundle(schema, createUserPath, baselinePaths, steps, readBytes = read_file):
+    """Bundles the scripts of a schema, steps are the planned scripts in the order to run them"""
+
+    versions = []
+    for step in steps:
+        version = str(step.version)
+        if not versions or versions[-1].version != version:
+            versions.append(BundledVersion(version, []))
+        versions[-1].scripts.append(bundle_script(step.path, readBytes))
+
+    createUser = bundle_script(createUserPath, readBytes) if createUserPath else None
+    return SchemaBundle(schema, createUser, [bundle_script(p, readBytes) for p in baselinePaths], versions)
+
+
+def write_bundle(path, schemaBundles, targetVersion = None):
+    document = {
+        'format': BUNDLE_FORMAT,
+        'created': datetime.datetime.now().isoformat(),
+        'target_version': str(targetVersion) if targetVersion else None,
+        'schemas': [{
+            'schema': b.schema,
+            'create_user': b.create_user._asdict() if b.create_user else None,
+            'baseline': [s._asdict() for s in b.baseline],
+            'versions': [{'version': v.version, 'scripts': [s._asdict() for s in v.scripts]} for v in b.versions]
+        } for b in schemaBundles]}
+    write_atomically(path, json.dumps(document, indent = 1))
+
+
+def read_bundle(path):
+    """Reads the schemas of a bundle, checking every script against its checksum"""
+
+    with open(path, encoding = 'utf-8') as f:
+        document = json.load(f)
+    if document.get('format') != BUNDLE_FORMAT:
+        raise BundleException('"{0}" is not a bundle this version of dbsync can apply (format {1}).'.format(path, document.get('format')))
+
+    return [SchemaBundle(
+        s['schema'],
+        read_script(s['create_user']) if s['create_user'] else None,
+        [read_script(b) for b in s['baseline']],
+        [BundledVersion(v['version'], [read_script(b) for b in v['scripts']]) for v in s['versions']]
+    ) for s in document['schemas']]
+
+
+def read_script(entry):
+    script = BundledScript(entry['path'], entry['checksum'], entry['body'])
+    if hashlib.sha256(script.body.encode('utf-8')).hexdigest() != script.checksum:
+        raise BundleException('the body of "{0}" does not match its checksum, the bundle is damaged.'.format(script.path))
+    return script
+
+
+#------------------------------------------------------------------------------
+# BundleApplier
+#------------------------------------------------------------------------------
+class BundleApplier(object):
+    log = logging.getLogger('bundle.BundleApplier')
+
+    def __init__(self, db, sqlRunner):
+        self.__db = db
+        self.__sqlRunner = sqlRunner
+
+
+    def apply(self, schemaBundle):
+        self.__sqlRunner.open_session()
+        try:
+            if not self.__db.snapshot.schema_exists:
+                self.create_schema(schemaBundle)
+            else:
+                BundleApplier.log.info('schema "{0}" already exists.'.format(schemaBundle.schema))
+            self.__db.make_sure_tracking_is_up_to_date()
+
+            applied = self.__db.get_applied_scripts()
+            for version in schemaBundle.versions:
+                pending = [s for s in version.scripts if (version.version, s.path) not in applied]
+                if pending:
+                    self.apply_version(schemaBundle.schema, version.version, pending)
+                else:
+                    BundleApplier.log.debug('every script of version "{0}" already applied.'.format(version.version))
+        finally:
+            self.__sqlRunner.close_session()
+        return True
+
+
+    def create_schema(self, schemaBundle):
+        if schemaBundle.create_user:
+            BundleApplier.log.info('Running schema creation script for schema: "{0}".'.format(schemaBundle.schema))
+            self.__sqlRunner.run_sql_text(schemaBundle.create_user.path, schemaBundle.create_user.body)
+
+        for script in schemaBundle.baseline:
+            self.__sqlRunner.run_sql_text(script.path, script.body, schemaBundle.schema)
+
+
+    def apply_version(self, schema, version, scripts):
+        BundleApplier.log.info('applying {0} script(s) for version "{1}".'.format(len(scripts), version))
+        try:
+            for script in scripts:
+                with self.__sqlRunner.metrics.script(schema, version, script.path) as scriptMetrics:
+                    self.__sqlRunner.run_sql_text(script.path, script.body, schema)
+                    scriptMetrics.succeeded = True
+                self.__db.record_script_as_run(script.path, version, scriptMetrics.milliseconds, script.checksum)
+        finally:
+            self.__db.flush_tracking()
@@ -0,0 +1,140 @@
+import os
+import json
+import mmap
+import hashlib
+import logging
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+#------------------------------------------------------------------------------
+# Script checksums
+#------------------------------------------------------------------------------
+# A sha256 of each script's bytes is recorded in version_tracking when the
+# script is applied so later edits to applied scripts can be found. Large
+# files are memory mapped rather than read into memory, smaller ones are
+# read in chunks.
+#
+# ChecksumCache keeps the hash of every file along with the size and
+# modification time it had when hashed so unchanged files are not read again.
+#------------------------------------------------------------------------------
+MMAP_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+DEFAULT_HASH_WORKERS = 8
+CACHE_FORMAT = 1
+
+VerifyResult = namedtuple('VerifyResult', ['drifted', 'missing', 'unknown'])
+
+
+def hash_file(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+                checksum.update(mapped)
+        else:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def stat_file(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ChecksumCache(object):
+    log = logging.getLogger('checksums.ChecksumCache')
+
+    def __init__(self, path):
+        self.__path = path
+        self.__entries = self.__load()
+        self.__dirty = False
+
+
+    @staticmethod
+    def for_schema(schema, cacheFolder):
+        return ChecksumCache(os.path.join(cacheFolder, '{0}.checksums.json'.format(schema)))
+
+
+    def get(self, path, size, mtime):
+        entry = self.__entries.get(path)
+        if entry and entry[0] == size and entry[1] == mtime:
+            return entry[2]
+        return None
+
+
+    def put(self, path, size, mtime, checksum):
+        self.__entries[path] = [size, mtime, checksum]
+        self.__dirty = True
+
+
+    def save(self):
+        if not self.__dirty:
+            return
+
+        folder = os.path.dirname(self.__path)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        temp = '{0}.{1}.tmp'.format(self.__path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump({'format': CACHE_FORMAT, 'files': self.__entries}, f)
+        os.replace(temp, self.__path)
+        self.__dirty = False
+
+
+    def __load(self):
+        try:
+            with open(self.__path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            ChecksumCache.log.warning('ignoring unreadable checksum cache "{0}".'.format(self.__path))
+            return {}
+
+        if data.get('format') != CACHE_FORMAT:
+            return {}
+        return data.get('files', {})
+
+
+def hash_files(paths, cache = None, statFile = stat_file, workers = DEFAULT_HASH_WORKERS, hashFile = None):
+    """Returns a dictionary of path to checksum, hashing files on a pool of threads"""
+
+    def checksum_of(path):
+        size, mtime = statFile(path)
+        checksum = cache.get(path, size, mtime) if cache else None
+        if checksum is None:
+            checksum = (hashFile or hash_file)(path)
+            if cache:
+                cache.put(path, size, mtime, checksum)
+        return path, checksum
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        return dict(executor.map(checksum_of, paths))
+
+
+def compare(sourceChecksums, trackedScripts):
+    """Compares checksums of the source, keyed by (version, script), with the
+        (version, script, checksum) rows of the tracking table.
+
+        drifted: applied scripts that have changed since they were applied.
+        missing: applied scripts no longer in the source.
+        unknown: applied scripts with no checksum recorded."""
+
+    drifted, missing, unknown = [], [], []
+    for version, script, checksum in trackedScripts:
+        key = (version, script)
+        if key not in sourceChecksums:
+            missing.append(key)
+        elif not checksum:
+            unknown.append(key)
+        elif checksum != sourceChecksums[key]:
+            drifted.append(key)
+
+    return VerifyResult(sorted(drifted), sorted(missing), sorted(unknown))
@@ -0,0 +1,163 @@
+import os
+import io
+import re
+import csv
+import configparser
+import logging
+
+from collections import namedtuple
+
+#------------------------------------------------------------------------------
+# CSV loads
+#------------------------------------------------------------------------------
+# A .csv file in a version folder (or the baseline) is loaded by dbsync
+# itself rather than run through sqlplus. How each file is loaded is set in
+# a _load.ini in the same folder, with a section named after the file:
+#
+#   [countries.csv]
+#   table = countries
+#   columns = code, name
+#   batch_size = 5000
+#   direct_path = yes
+#
+# table defaults to the file name without .csv and columns to the header
+# row of the file. Set header = no if the file has no header row, columns
+# must then be given. Anything set under [DEFAULT] applies to every file.
+#
+# The file is read a batch at a time and each batch inserted in a single
+# executemany, so only one batch is ever held in memory. Empty fields are
+# inserted as nulls. Without direct_path the whole file is loaded in one
+# transaction. With direct_path every insert has an APPEND_VALUES hint and,
+# as a direct path insert must be committed before the table is touched
+# again, every batch is committed on its own: a load that fails part way
+# leaves the batches before the failure behind.
+#
+# For loads kept in a release archive _load.ini is read through readText and
+# the csv file is streamed from the binary file openBinary returns for it,
+# so it too is read a batch at a time.
+#------------------------------------------------------------------------------
+LOAD_SETTINGS_FILE = '_load.ini'
+CSV_EXTENSION = '.csv'
+DEFAULT_BATCH_SIZE = 1000
+IDENTIFIER = re.compile(r'^[A-Za-z][A-Za-z0-9_$#]*(\.[A-Za-z][A-Za-z0-9_$#]*)?$')
+
+CsvLoad = namedtuple('CsvLoad', ['path', 'table', 'columns', 'header', 'batch_size', 'direct_path'])
+
+
+class CsvLoadException(Exception):
+    pass
+
+
+def is_csv_load(path):
+    return path.lower().endswith(CSV_EXTENSION)
+
+
+def read_load(path, readText = None):
+    """Returns how the csv file at path is to be loaded, from the _load.ini next to it"""
+
+    folder, name = os.path.split(path)
+    settings = configparser.ConfigParser()
+    try:
+        if readText:
+            try:
+                settings.read_string(readText(os.path.join(folder, LOAD_SETTINGS_FILE)))
+            except FileNotFoundError:
+                pass
+        else:
+            settings.read(os.path.join(folder, LOAD_SETTINGS_FILE))
+        section = settings[name] if settings.has_section(name) else settings[configparser.DEFAULTSECT]
+        table = section.get('table', os.path.splitext(name)[0])
+        columns = [c.strip() for c in section.get('columns', '').split(',') if c.strip()]
+        header = section.getboolean('header', True)
+        batchSize = section.getint('batch_size', DEFAULT_BATCH_SIZE)
+        directPath = section.getboolean('direct_path', False)
+    except (configparser.Error, ValueError) as ex:
+        raise CsvLoadException('cannot read the load settings of "{0}": {1}'.format(path, ex))
+
+    if batchSize < 1:
+        raise CsvLoadException('the batch_size of "{0}" must be at least 1.'.format(path))
+    if not header and not columns:
+        raise CsvLoadException('"{0}" has no header row so its columns must be set in {1}.'.format(path, LOAD_SETTINGS_FILE))
+    for identifier in [table] + columns:
+        check_identifier(path, identifier)
+
+    return CsvLoad(path, table, columns or None, header, batchSize, directPath)
+
+
+def check_identifier(path, identifier):
+    if not IDENTIFIER.match(identifier):
+        raise CsvLoadException('"{0}" is not a table or column name dbsync can load "{1}" into.'.format(identifier, path))
+
+
+def insert_statement(load, columns):
+    hint = '/*+ APPEND_VALUES */ ' if load.direct_path else ''
+    return 'insert {0}into {1} ({2}) values ({3})'.format(hint, load.table, ', '.join(columns), ', '.join(':{0}'.format(i + 1) for i in range(len(columns))))
+
+
+#------------------------------------------------------------------------------
+# CsvReader
+#------------------------------------------------------------------------------
+# Reads a csv file a batch of rows at a time. The columns are known once the
+# header has been read, which happens when the reader is opened.
+#------------------------------------------------------------------------------
+class CsvReader(object):
+    log = logging.getLogger('csvloader.CsvReader')
+
+    def __init__(self, load, openBinary = None):
+        self.__load = load
+        if openBinary:
+            self.__file = io.TextIOWrapper(openBinary(load.path), encoding = 'utf-8-sig', newline = '')
+        else:
+            self.__file = open(load.path, newline = '', encoding = 'utf-8-sig')
+        self.__reader = csv.reader(self.__file)
+        self.columns = load.columns
+        try:
+            if load.header:
+                header = [c.strip() for c in next(self.__reader, [])]
+                self.columns = self.columns or header
+                for column in self.columns:
+                    check_identifier(load.path, column)
+            if not self.columns:
+                raise CsvLoadException('"{0}" is empty.'.format(load.path))
+        except Exception:
+            self.close()
+            raise
+
+
+    @property
+    def statement(self):
+        return insert_statement(self.__load, self.columns)
+
+
+    @property
+    def direct_path(self):
+        return self.__load.direct_path
+
+
+    def batches(self):
+        """Yields lists of up to batch_size rows, with empty fields as None"""
+
+        batch = []
+        for row in self.__reader:
+            if not row:
+                continue
+            if len(row) != len(self.columns):
+                raise CsvLoadException('"{0}" line {1} has {2} field(s), not {3}.'.format(self.__load.path, self.__reader.line_num, len(row), len(self.columns)))
+            batch.append(tuple(field if field != '' else None for field in row))
+            if len(batch) == self.__load.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+    def close(self):
+        self.__file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
@@ -2,12 +2,32 @@ import sys
 import os
 import getopt
 import datetime
-import cx_Oracle
+import fnmatch
+import functools
+import itertools
+import time
+import threading
 import logging
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 from distutils.version import StrictVersion
 
 import sqlplusscriptrunner as runner
+import drivers
+import scheduler
+import checksums
+import watcher
+import bundle
+import csvloader
+import snapshotcache
+import archivesource
+import sqlplusengine
+from metrics import RunMetrics
+from profiler import StatementProfile, DEFAULT_TOP
+from manifestcache import ManifestCache, CACHE_FOLDER, RACY_SECONDS
+from appliedcache import AppliedScriptsCache
 
 # directory structure
 # <root folder> SchemaName
@@ -20,9 +40,48 @@ import sqlplusscriptrunner as runner
 # when moving up to a particular version will run all scripts that have not already been applied until all scripts for 
 # the desired version are applied.
 
-GET_ALL_USERS = """
-    select username 
+# everything needed to know where a schema is up to, apart from the scripts
+# applied, in one round trip: a row for the user if it exists, one for each
+# column of its tracking table and one for the tracking sequence.
+GET_SCHEMA_STATE = """
+    select 'user', username, null
     from dba_users
+    where username = upper(:owner)
+    union all
+    select 'column', column_name, null
+    from all_tab_columns
+    where owner = upper(:owner)
+    and table_name = 'VERSION_TRACKING'
+    union all
+    select 'sequence', sequence_name, cache_size
+    from all_sequences
+    where sequence_owner = upper(:owner)
+    and sequence_name = 'VERSION_TRACKING_ID_SEQ'
+"""
+
+GET_APPLIED_SCRIPTS = """
+    select version, script
+    from version_tracking
+"""
+
+GET_APPLIED_SCRIPTS_WITH_IDS = """
+    select id, version, script
+    from version_tracking
+"""
+
+# the rows above a cached watermark and, in a row with an id of
+# WATERMARK_ROW_ID, the count and highest id of the rows at or below it to
+# check the cache against.
+WATERMARK_ROW_ID = -1
+
+GET_APPLIED_SCRIPTS_SINCE = """
+    select id, version, script
+    from version_tracking
+    where id > :watermark
+    union all
+    select -1, to_char(count(*)), to_char(max(id))
+    from version_tracking
+    where id <= :watermark
 """
 
 CREATE_TRACKING_TABLE_SQL = """
@@ -31,6 +90,8 @@ CREATE_TRACKING_TABLE_SQL = """
         version    varchar2(15)                            not null,
         script     varchar2(256)                           not null,
         applied_on timestamp     default current_timestamp not null,
+        checksum   varchar2(64),
+        duration_ms number,
         constraint version_tracking_pk primary key (id) enable validate)
 """
 
@@ -39,36 +100,275 @@ CREATE_TRACKING_TABLE_SEQ = """
     start with 1
     increment by 1
     minvalue 1
-    nocache 
+    cache 20
     nocycle 
     noorder
 """
 
+# sequences created before ids were cached are altered to cache this many.
+TRACKING_SEQUENCE_CACHE = 20
+
+ALTER_TRACKING_SEQUENCE_CACHE = """
+    alter sequence version_tracking_id_seq cache {0}
+""".format(TRACKING_SEQUENCE_CACHE)
+
 INSERT_SCRIPT_INFO = """
-    insert into version_tracking (id, version, script)
-    values (version_tracking_id_seq.nextval, :version, :script)
+    insert into version_tracking (id, version, script, checksum, duration_ms)
+    values (version_tracking_id_seq.nextval, :version, :script, :checksum, :duration_ms)
 """    
+
+# columns added to version_tracking since it was first created, these are
+# added to the tracking tables of existing schemas.
+TRACKING_TABLE_COLUMNS = (
+    ('CHECKSUM', 'varchar2(64)'),
+    ('DURATION_MS', 'number'),
+)
+
+GET_TRACKED_CHECKSUMS = """
+    select version, script, checksum
+    from version_tracking
+"""
+
+# the statements of checkpointed scripts that have completed, see
+# Db.run_checkpointed.
+GET_CHECKPOINT_TABLE = """
+    select table_name
+    from all_tables
+    where owner = upper(:owner)
+    and table_name = 'VERSION_CHECKPOINTS'
+"""
+
+CREATE_CHECKPOINT_TABLE_SQL = """
+    create table version_checkpoints (
+        script          varchar2(256)                           not null,
+        statement_no    number                                  not null,
+        statement_hash  varchar2(64)                            not null,
+        script_checksum varchar2(64)                            not null,
+        completed_on    timestamp     default current_timestamp not null,
+        constraint version_checkpoints_pk primary key (script, statement_no) enable validate)
+"""
+
+GET_CHECKPOINTS = """
+    select statement_no, statement_hash, script_checksum
+    from version_checkpoints
+    where script = :script
+    order by statement_no
+"""
+
+INSERT_CHECKPOINT = """
+    insert into {0}.version_checkpoints (script, statement_no, statement_hash, script_checksum)
+    values (:script, :statement_no, :statement_hash, :script_checksum)
+"""
+
+DELETE_CHECKPOINTS = """
+    delete from version_checkpoints
+    where script = :script
+"""
+
+ORACLE_DIALECT = drivers.Dialect(
+    schema_state = GET_SCHEMA_STATE,
+    applied_scripts = GET_APPLIED_SCRIPTS,
+    applied_scripts_with_ids = GET_APPLIED_SCRIPTS_WITH_IDS,
+    applied_scripts_since = GET_APPLIED_SCRIPTS_SINCE,
+    tracked_checksums = GET_TRACKED_CHECKSUMS,
+    create_tracking_table = (CREATE_TRACKING_TABLE_SQL, CREATE_TRACKING_TABLE_SEQ),
+    insert_script_info = INSERT_SCRIPT_INFO,
+    tracking_table_columns = TRACKING_TABLE_COLUMNS,
+    add_tracking_column = 'alter table version_tracking add ({0} {1})',
+    alter_sequence_cache = ALTER_TRACKING_SEQUENCE_CACHE,
+    checkpoint_table = GET_CHECKPOINT_TABLE,
+    create_checkpoint_table = (CREATE_CHECKPOINT_TABLE_SQL,),
+    checkpoints = GET_CHECKPOINTS,
+    insert_checkpoint = INSERT_CHECKPOINT,
+    delete_checkpoints = DELETE_CHECKPOINTS)
+
+
+def dialect_of(sqlRunner):
+    """The sql to keep track of scripts with, runners without a dialect of their own run Oracle's"""
+    dialect = getattr(sqlRunner, 'dialect', None)
+    return dialect if isinstance(dialect, drivers.Dialect) else ORACLE_DIALECT
         
 username = 'system'
 password = 'password1234'
 server = 'localhost:1521/XE'    
 
+DEFAULT_WORKERS = 4
+DEFAULT_TARGET_WORKERS = 4
+
+# a database to sync, given as user/password@host
+Target = namedtuple('Target', ['username', 'password', 'host'])
+
+
+class TargetException(Exception):
+    pass
+
+
+def parse_target(text):
+    credentials, at, host = text.strip().rpartition('@')
+    username, slash, password = credentials.partition('/')
+    if not (at and slash and username and host):
+        raise TargetException('"{0}" is not a target of the form user/password@host.'.format(text.strip()))
+    return Target(username, password, host)
+
+
+def default_target(driver):
+    """The target used when none is given: the database set above for Oracle,
+        every schema in memory for SQLite"""
+    return Target('dbsync', '', ':memory:') if driver == drivers.SQLITE else Target(username, password, server)
+
+
+def read_targets_file(path):
+    """Reads a target a line from path, ignoring blank lines and lines starting with #"""
+    with open(path) as f:
+        return [parse_target(line) for line in f if line.strip() and not line.strip().startswith('#')]
+
 class ArgumentsReader(object):
     log = logging.getLogger(__name__ + '.ArgumentsReader')
 
     SYNC = "sync"
     DROP = "drop"
-    COMMANDS = (SYNC, DROP)
+    PLAN = "plan"
+    VERIFY = "verify"
+    BUNDLE = "bundle"
+    APPLY = "apply"
+    WATCH = "watch"
+    RESET = "reset"
+    COMMANDS = (SYNC, DROP, PLAN, VERIFY, BUNDLE, APPLY, WATCH, RESET)
     COMMAND_HELP = """
 ---------------
 db syncher help
 ---------------
-syntax: dbsync.py --schema=<schema> [--version=<version>] <command>
+syntax: dbsync.py --schema=<schema> [--schema=<schema> ...] [--version=<version>] [--poolsize=<size>] <command>
+        dbsync.py --all-schemas [--workers=<count>] <command>
+        dbsync.py --bundle=<file> [--schema=<schema> ...] apply
+        dbsync.py --target=<user/password@host> [--target=...] [--targets-file=<file>] --schema=<schema> sync
 
 arguments
 ---------
 --schema   | -s
-    The schema you wish to apply.
+    The schema you wish to apply. May be given more than once and may use
+    wildcards (e.g. --schema=tenant_*) to match schema folders.
+
+--all-schemas | -a
+    Apply every schema folder under the current folder.
+
+--workers  | -w
+    The most schemas to sync at the same time.
+    default: 4
+
+--target   | -t
+    A database to sync, as user/password@host. May be given more than once
+    to sync every target given; the schema folders are read once and each
+    target is synced on its own with its own connections, a failure on one
+    not stopping the others. Only the sync command takes more than one
+    target.
+    default: the database set in dbsync.py
+
+--targets-file=<file>
+    Read targets from this file, one user/password@host a line. Blank lines
+    and lines starting with # are ignored. Keeps passwords off the command
+    line.
+
+--target-workers=<count>
+    The most targets to sync at the same time.
+    default: 4
+
+--driver=<driver>
+    The kind of database synced: "oracle" or "sqlite". With sqlite the host
+    of a target is a folder to keep a database file for each schema in, or
+    ":memory:" (the default) to sync in memory, for checking scripts
+    without an Oracle database.
+    default: oracle
+
+--engine   | -e
+    How scripts are run: "sqlplus" runs them through sqlplus, "native"
+    parses them and runs each statement directly through cx_Oracle.
+    default: sqlplus
+
+--script-logs=<folder>
+    Write the output of every script to its own log file in this folder.
+
+--heartbeat=<seconds>
+    How often to log that a long running script is still running.
+    default: 60
+
+--metrics-json=<file>
+    Write the time taken, queries run and connections opened by every
+    script, and by the run as a whole, to this file as json.
+
+--metrics-prom=<file>
+    Write the same metrics as a Prometheus textfile, for the node exporter's
+    textfile collector.
+
+--profile
+    Time every statement of every script run and print the slowest ones at
+    the end of the run.
+
+--profile-json=<file>
+    Profile as --profile does and write the time of every statement, with
+    its file, line and rows processed, to this file as json.
+
+--profile-top=<count>
+    How many of the slowest statements to print when profiling.
+    default: 20
+
+--bundle    | -b
+    The bundle file written by the bundle command and read by the apply
+    command.
+
+--source=<archive>
+    Read the schema folders from a zip or tar archive (.zip, .tar, .tar.gz,
+    .tgz, .tar.bz2, .tar.xz) rather than the current folder, without
+    unpacking it. The archive may hold the schema folders or a single
+    folder holding them. Scripts are run from memory, so scripts run by
+    sqlplus that include others with @ or @@ still read those from disk;
+    use --engine=native to read them from the archive too. Not used by
+    the watch command.
+
+--rescan
+    Ignore the cached listing of the schema folders and the cached list of
+    scripts applied to the database, and read both again.
+
+--parallel | -j
+    The most scripts of one version to run at the same time. Only scripts
+    that declare their dependencies with a "-- depends on:" comment are run
+    in parallel, all others run one at a time in alphabetical order.
+    default: 4
+
+--ddl-lock-timeout=<seconds>
+    How long a statement waits for a lock held by another session on an
+    object it changes (ddl_lock_timeout) before failing with ORA-00054.
+    default: not set, so a busy object fails the script at once.
+
+--lock-retries=<count>
+    How many times to run a script again, from its start, after it failed
+    because an object was locked (ORA-00054, ORA-00060, ORA-04021...). The
+    wait between attempts starts at 5s and doubles up to 60s. Scripts that
+    declare their dependencies carry on running while one waits. Only use
+    with scripts that can be run again after failing part way.
+    default: 0
+
+--checkpoint-kb=<size>
+    Run scripts of at least this many kilobytes statement by statement,
+    recording each statement that completes in version_checkpoints. A
+    script that failed part way then carries on from the statement that
+    failed the next time it is run, rather than from its start. Each
+    statement is committed as it completes, so these scripts run with the
+    native engine whichever engine is chosen. A script that has changed
+    since it failed is not carried on with.
+    default: not set, so every script runs from its start.
+
+--snapshot-max-mb=<size>
+    The most space the schema snapshots kept by the reset command may take
+    up in .dbsynccache/snapshots. The least recently used are removed first.
+    default: 2048
+
+--snapshot-export=<command>
+--snapshot-import=<command>
+    Commands that save a schema to, and load it from, a snapshot instead of
+    the driver's own (exp and imp for Oracle). {connect}, {user},
+    {password}, {host}, {schema}, {file} and {folder} are replaced with
+    the target, the schema and where the snapshot goes. Both must be given.
 
 --version  | -v
     The target version to bring database up to.
@@ -77,20 +377,63 @@ arguments
 --loglevel | -l
     The required log level (DEBUG, INFO, WARN, ERROR)
 
+--poolsize | -p
+    The most database connections to keep open at once.
+    default: 4
+
 
 command 
     --sync (default): syncronises the schema with source control
     --drop: drops the schema.
+    --plan: lists the scripts a sync would apply without applying them.
+    --verify: compares the checksums of applied scripts with the source and
+        lists scripts changed or removed since they were applied.
+    --bundle: writes every script up to the target version into the single
+        file given by --bundle.
+    --apply: applies a bundle without reading the schema folders. Only the
+        schemas given by --schema are applied if any are given.
+    --watch: syncs, then keeps watching the versions folders of the schemas
+        and applies scripts as they are added, until stopped with Ctrl+C.
+        One session is kept open throughout and the applied scripts are
+        kept in memory, so only the new scripts are read and run.
+    --reset: drops the schemas and syncs them again. If a snapshot of the
+        same scripts up to the target version, or an earlier one, was saved
+        by an earlier reset it is restored and only the scripts after it
+        are run. The schema is then saved as a snapshot for the next reset.
 
 """
 
     def __init__(self, argv):
         ArgumentsReader.log.debug('argv: {0}'.format(argv))
-        schema = ''
+        schemas = []
+        allSchemas = False
         targetVersion = None
         logLevel = 'INFO'
+        poolSize = runner.DEFAULT_POOL_SIZE
+        workers = DEFAULT_WORKERS
+        maxParallel = scheduler.DEFAULT_MAX_PARALLEL
+        rescan = False
+        engine = runner.SQLPLUS_ENGINE
+        scriptLogFolder = runner.DEFAULT_OUTPUT.log_folder
+        heartbeatSeconds = runner.DEFAULT_OUTPUT.heartbeat_seconds
+        metricsJson = None
+        metricsProm = None
+        profile = False
+        profileJson = None
+        profileTop = DEFAULT_TOP
+        bundlePath = None
+        targets = []
+        targetWorkers = DEFAULT_TARGET_WORKERS
+        driver = drivers.ORACLE
+        ddlLockTimeout = None
+        lockRetries = 0
+        checkpointBytes = None
+        snapshotMaxBytes = snapshotcache.DEFAULT_MAX_BYTES
+        snapshotExport = None
+        snapshotImport = None
+        sourceArchive = None
         try:
-            opts, args = getopt.getopt(argv, 'hs:v:l:', ['schema=', 'version=', 'loglevel=', 'help'])
+            opts, args = getopt.getopt(argv, 'hs:av:l:p:w:j:e:b:t:', ['schema=', 'all-schemas', 'version=', 'loglevel=', 'poolsize=', 'workers=', 'parallel=', 'rescan', 'engine=', 'script-logs=', 'heartbeat=', 'metrics-json=', 'metrics-prom=', 'profile', 'profile-json=', 'profile-top=', 'bundle=', 'target=', 'targets-file=', 'target-workers=', 'driver=', 'ddl-lock-timeout=', 'lock-retries=', 'checkpoint-kb=', 'snapshot-max-mb=', 'snapshot-export=', 'snapshot-import=', 'source=', 'help'])
         except getopt.GetoptError:
             self.print_help_and_exit()
             
@@ -100,11 +443,73 @@ command
             if opt in ('-h', '--help'):
                 self.print_help_and_exit()
             elif opt in ('-s', '--schema'):
-                schema = arg
+                schemas.append(arg)
+            elif opt in ('-a', '--all-schemas'):
+                allSchemas = True
             elif opt in ('-v', '--version'):
                 targetVersion = arg
             elif opt in ('-l', '--loglevel'):
                 logLevel = arg
+            elif opt in ('-p', '--poolsize'):
+                poolSize = self.__to_positive_int(opt, arg)
+            elif opt in ('-w', '--workers'):
+                workers = self.__to_positive_int(opt, arg)
+            elif opt in ('-j', '--parallel'):
+                maxParallel = self.__to_positive_int(opt, arg)
+            elif opt == '--rescan':
+                rescan = True
+            elif opt in ('-e', '--engine'):
+                engine = arg.casefold()
+                if not engine in runner.ENGINES:
+                    ArgumentsReader.log.error('engine "{0}" not one of: {1}'.format(arg, runner.ENGINES))
+                    self.print_help_and_exit()
+            elif opt == '--script-logs':
+                scriptLogFolder = arg
+            elif opt == '--heartbeat':
+                heartbeatSeconds = self.__to_positive_int(opt, arg)
+            elif opt == '--metrics-json':
+                metricsJson = arg
+            elif opt == '--metrics-prom':
+                metricsProm = arg
+            elif opt == '--profile':
+                profile = True
+            elif opt == '--profile-json':
+                profile = True
+                profileJson = arg
+            elif opt == '--profile-top':
+                profileTop = self.__to_positive_int(opt, arg)
+            elif opt in ('-b', '--bundle'):
+                bundlePath = arg
+            elif opt in ('-t', '--target', '--targets-file'):
+                try:
+                    targets.extend(read_targets_file(arg) if opt == '--targets-file' else [parse_target(arg)])
+                except (TargetException, OSError) as ex:
+                    ArgumentsReader.log.error(str(ex))
+                    self.print_help_and_exit()
+            elif opt == '--target-workers':
+                targetWorkers = self.__to_positive_int(opt, arg)
+            elif opt == '--driver':
+                driver = arg.casefold()
+                if not driver in drivers.DRIVERS:
+                    ArgumentsReader.log.error('driver "{0}" not one of: {1}'.format(arg, sorted(drivers.DRIVERS)))
+                    self.print_help_and_exit()
+            elif opt == '--ddl-lock-timeout':
+                ddlLockTimeout = self.__to_positive_int(opt, arg)
+            elif opt == '--lock-retries':
+                lockRetries = self.__to_positive_int(opt, arg)
+            elif opt == '--checkpoint-kb':
+                checkpointBytes = self.__to_positive_int(opt, arg) * 1024
+            elif opt == '--snapshot-max-mb':
+                snapshotMaxBytes = self.__to_positive_int(opt, arg) * 1024 ** 2
+            elif opt == '--snapshot-export':
+                snapshotExport = arg
+            elif opt == '--snapshot-import':
+                snapshotImport = arg
+            elif opt == '--source':
+                if not archivesource.is_archive(arg):
+                    ArgumentsReader.log.error('--source must be a zip or tar archive, got: "{0}"'.format(arg))
+                    self.print_help_and_exit()
+                sourceArchive = arg
         
         if len(args) > 0:
             self.__command = args[0].casefold()
@@ -116,13 +521,44 @@ command
             ArgumentsReader.log.warn('command:"{0}" not one of the valid commands: {1}'.format(self.__command, ArgumentsReader.COMMANDS))
             self.print_help_and_exit()
             
-        if not schema:
+        if not schemas and not allSchemas and self.__command != ArgumentsReader.APPLY:
             ArgumentsReader.log.error('no schema provided')
             self.print_help_and_exit()
+
+        if not bundlePath and self.__command in (ArgumentsReader.BUNDLE, ArgumentsReader.APPLY):
+            ArgumentsReader.log.error('no bundle file provided')
+            self.print_help_and_exit()
+
+        targets = [t for i, t in enumerate(targets) if t not in targets[:i]]
+        if len(targets) > 1 and self.__command != ArgumentsReader.SYNC:
+            ArgumentsReader.log.error('only the sync command can be run against more than one target')
+            self.print_help_and_exit()
             
-        self.__schema = schema
+        self.__schemaPatterns = ['*'] if allSchemas else schemas
         self.__targetVersion = StrictVersion(targetVersion) if targetVersion else None
         self.__logLevel = getattr(logging, logLevel.upper())
+        self.__poolSize = poolSize
+        self.__workers = workers
+        self.__maxParallel = maxParallel
+        self.__rescan = rescan
+        self.__engine = engine
+        self.__output = runner.OutputSettings(runner.DEFAULT_OUTPUT.tail_lines, scriptLogFolder, heartbeatSeconds)
+        self.__metricsJson = metricsJson
+        self.__metricsProm = metricsProm
+        self.__profile = profile
+        self.__profileJson = profileJson
+        self.__profileTop = profileTop
+        self.__bundlePath = bundlePath
+        self.__targets = targets
+        self.__targetWorkers = targetWorkers
+        self.__driver = driver
+        self.__ddlLockTimeout = ddlLockTimeout
+        self.__lockRetry = scheduler.lock_retry_policy(lockRetries) if lockRetries else None
+        self.__checkpointBytes = checkpointBytes
+        self.__snapshotMaxBytes = snapshotMaxBytes
+        self.__snapshotExport = snapshotExport
+        self.__snapshotImport = snapshotImport
+        self.__source = sourceArchive
         
         
     def get_command(self):
@@ -130,7 +566,23 @@ command
     
 
     def get_schema(self):
-        return self.__schema
+        return self.get_schemas()[0]
+
+
+    def get_schemas(self, root = '.'):
+        """Returns the schemas asked for, with any wildcards matched against
+            the schema folders under root"""
+
+        schemas = []
+        for pattern in self.__schemaPatterns:
+            if any(c in pattern for c in '*?['):
+                matches = fnmatch.filter(find_schema_folders(root, archivesource.open_archive(self.__source) if self.__source else None), pattern)
+                if not matches:
+                    ArgumentsReader.log.warning('no schema folders match "{0}".'.format(pattern))
+                schemas.extend(m for m in matches if m not in schemas)
+            elif pattern not in schemas:
+                schemas.append(pattern)
+        return schemas
 
 
     def get_target_version(self):
@@ -142,6 +594,136 @@ command
         return self.__logLevel
 
 
+    @property
+    def pool_size(self):
+        return self.__poolSize
+
+
+    @property
+    def workers(self):
+        return self.__workers
+
+
+    @property
+    def max_parallel(self):
+        return self.__maxParallel
+
+
+    @property
+    def rescan(self):
+        return self.__rescan
+
+
+    @property
+    def ddl_lock_timeout(self):
+        return self.__ddlLockTimeout
+
+
+    @property
+    def lock_retry(self):
+        return self.__lockRetry
+
+
+    @property
+    def engine(self):
+        return self.__engine
+
+
+    @property
+    def output(self):
+        return self.__output
+
+
+    @property
+    def metrics_json(self):
+        return self.__metricsJson
+
+
+    @property
+    def metrics_prom(self):
+        return self.__metricsProm
+
+
+    @property
+    def profile(self):
+        return self.__profile
+
+
+    @property
+    def profile_json(self):
+        return self.__profileJson
+
+
+    @property
+    def profile_top(self):
+        return self.__profileTop
+
+
+    @property
+    def bundle_path(self):
+        return self.__bundlePath
+
+
+    @property
+    def targets(self):
+        return list(self.__targets)
+
+
+    @property
+    def target(self):
+        """The first target given, or the default target of the driver"""
+        return (self.__targets or [default_target(self.__driver)])[0]
+
+
+    @property
+    def target_workers(self):
+        return self.__targetWorkers
+
+
+    @property
+    def driver(self):
+        return self.__driver
+
+
+    @property
+    def checkpoint_bytes(self):
+        """Scripts this size or larger are run with checkpoints, None to run none with them"""
+        return self.__checkpointBytes
+
+
+    @property
+    def snapshot_max_bytes(self):
+        return self.__snapshotMaxBytes
+
+
+    @property
+    def snapshot_export(self):
+        return self.__snapshotExport
+
+
+    @property
+    def snapshot_import(self):
+        return self.__snapshotImport
+
+
+    @property
+    def source(self):
+        """The archive the schema folders are read from, or None to read the current folder"""
+        return self.__source
+
+
+    def selects_schema(self, schema):
+        """True if schema matches one of the schemas asked for, or none were asked for"""
+        return not self.__schemaPatterns or any(fnmatch.fnmatch(schema, p) for p in self.__schemaPatterns)
+
+
+    def __to_positive_int(self, opt, arg):
+        if not arg.isdigit() or int(arg) < 1:
+            ArgumentsReader.log.error('{0} must be a whole number greater than zero, got: "{1}"'.format(opt, arg))
+            self.print_help_and_exit()
+        return int(arg)
+
+
     def print_help_and_exit(self):    
         print(ArgumentsReader.COMMAND_HELP)
         sys.exit()
@@ -160,20 +742,81 @@ command
 # Provides the source for the db
 # methods:
 # get_all_version_folders
+# get_all_files_in
+# get_file_info
+# get_script_dependencies
+# get_folder_stamp
 # schema_folder_exists
+# get_create_user_script
+# get_baseline_scripts
+# hash_script
+# read_bytes
+# script_reader: where Db reads the bodies of scripts from, None if it runs
+#     them from disk.
 #------------------------------------------------------------------------------
+@functools.lru_cache(maxsize = None)
+def parse_version(version):
+    return StrictVersion(version)
+
+
+def get_all_scripts_in(path):
+    return sorted([os.path.join(path, p) for p in os.listdir(path) if not p.startswith('_') and os.path.isfile(os.path.join(path, p))])
+
+
+def get_baseline_scripts(schema):
+    baselineFolder = os.path.join('.', schema, 'baseline')
+    return get_all_scripts_in(baselineFolder) if os.path.isdir(baselineFolder) else []
+
+
+def find_schema_folders(root = '.', archive = None):
+    """Returns the folders under root that hold a create.user.sql or a versions folder"""
+    if archive:
+        return sorted([p for p in archive.get_folders_in(root) if not p.startswith('.')
+            and (archive.is_file(os.path.join(root, p, 'create.user.sql')) or archive.is_folder(os.path.join(root, p, 'versions')))])
+    return sorted([p for p in os.listdir(root) if not p.startswith(('_', '.')) 
+        and (os.path.isfile(os.path.join(root, p, 'create.user.sql')) or os.path.isdir(os.path.join(root, p, 'versions')))])
+
+
 class SourceOperations(object):
     log = logging.getLogger('dbsync.SourceOperations')
 
-    def __init__(self, schema):
+    def __init__(self, schema, manifestCache = None):
         self.__schema = schema
+        self.__manifestCache = manifestCache
+
+    @property
+    def schema(self):
+        return self.__schema
+
+    @property
+    def script_reader(self):
+        return None
         
     def get_all_version_folders(self):
         root = self.get_path_to_versions_folder()
-        folders = self.get_all_folders_in(root)
-        sortedFolders = sorted(folders, key = lambda a: StrictVersion(a))
-        SourceOperations.log.info('version folders: "{0}"'.format(sortedFolders))
-        return [(os.path.join(root, f), StrictVersion(f)) for f in sortedFolders]
+        versions = sorted((parse_version(f), f) for f in self.get_all_folders_in(root))
+        SourceOperations.log.info('version folders: "{0}"'.format([f for v, f in versions]))
+        return [(os.path.join(root, f), v) for v, f in versions]
+
+    def get_all_files_in(self, path):
+        if self.__manifestCache:
+            return [os.path.join(path, f) for f in self.__manifestCache.get_files_in(path)]
+        return get_all_scripts_in(path)
+
+    def get_file_info(self, path):
+        """Returns (size, mtime) of a script. The file is always looked at again
+            as editing a script does not change its folder, so the listing in
+            the manifest cache can be out of date."""
+        return checksums.stat_file(path)
+
+    def get_script_dependencies(self, path):
+        return scheduler.read_script_dependencies(path)
+
+    def get_folder_stamp(self, path):
+        """Returns the modification time of a folder, or None if it changed too
+            recently to tell whether it will change again in the same tick"""
+        mtime = os.stat(path).st_mtime_ns
+        return mtime if time.time() - mtime / 1e9 > RACY_SECONDS else None
 
 
     def get_path_to_versions_folder(self):
@@ -187,43 +830,365 @@ class SourceOperations(object):
         return True
         
     def get_all_folders_in(self, path):
+        if self.__manifestCache:
+            return self.__manifestCache.get_folders_in(path)
         return [p for p in os.listdir(path) if not p.startswith('_') and os.path.isdir(os.path.join(path, p))]
 
+    def get_create_user_script(self):
+        path = os.path.join('.', self.__schema, 'create.user.sql')
+        return path if os.path.exists(path) else None
+
+    def get_baseline_scripts(self):
+        return get_baseline_scripts(self.__schema)
+
+    def hash_script(self, path):
+        return checksums.hash_file(path)
+
+    def read_bytes(self, path):
+        return bundle.read_file(path)
+
+    def save_manifest(self):
+        if self.__manifestCache:
+            self.__manifestCache.save()
+
+
+#------------------------------------------------------------------------------
+# ArchiveSourceOperations
+#------------------------------------------------------------------------------
+# The source of a schema in a release archive (see archivesource). The
+# archive lists its folders as the manifest cache does for the current
+# folder, and the bodies of scripts are read from it rather than from disk.
+# Every folder in the archive has the archive's modification time.
+#------------------------------------------------------------------------------
+class ArchiveSourceOperations(SourceOperations):
+    def __init__(self, schema, archive):
+        super().__init__(schema, archive)
+        self.__archive = archive
+
+    @property
+    def script_reader(self):
+        return self
+
+    def get_script_dependencies(self, path):
+        return scheduler.script_dependencies(self.read_script(path).splitlines())
+
+    def get_file_info(self, path):
+        return self.__archive.get_file_info(path)
+
+    def get_folder_stamp(self, path):
+        return self.__archive.stamp
+
+    def get_create_user_script(self):
+        path = os.path.join('.', self.schema, 'create.user.sql')
+        return path if self.__archive.is_file(path) else None
+
+    def get_baseline_scripts(self):
+        folder = os.path.join('.', self.schema, 'baseline')
+        return self.get_all_files_in(folder) if self.__archive.is_folder(folder) else []
+
+    def hash_script(self, path):
+        return checksums.hash_bytes(self.__archive.read_bytes(path))
+
+    def read_bytes(self, path):
+        return self.__archive.read_bytes(path)
+
+    def read_script(self, path):
+        return self.__archive.read_text(path)
+
+    def open_binary(self, path):
+        return self.__archive.open_binary(path)
+
+
+#------------------------------------------------------------------------------
+# SharedSource
+#------------------------------------------------------------------------------
+# Wraps SourceOperations so a schema's folders are listed, and its scripts'
+# dependencies read, once however many targets are synced from them at the
+# same time. Calls are serialised as the manifest cache is not thread safe.
+#------------------------------------------------------------------------------
+class SharedSource(object):
+    def __init__(self, source):
+        self.__source = source
+        self.__lock = threading.Lock()
+        self.__results = {}
+
+    def get_all_version_folders(self):
+        return self.__once('get_all_version_folders')
+
+    def get_all_files_in(self, path):
+        return self.__once('get_all_files_in', path)
+
+    def get_file_info(self, path):
+        return self.__once('get_file_info', path)
+
+    def get_script_dependencies(self, path):
+        return self.__once('get_script_dependencies', path)
+
+    def get_folder_stamp(self, path):
+        return self.__once('get_folder_stamp', path)
+
+    def schema_folder_exists(self):
+        return self.__once('schema_folder_exists')
+
+    def save_manifest(self):
+        with self.__lock:
+            self.__source.save_manifest()
+
+    def __once(self, name, *args):
+        key = (name,) + args
+        with self.__lock:
+            if not key in self.__results:
+                self.__results[key] = getattr(self.__source, name)(*args)
+            return self.__results[key]
+
+
+#------------------------------------------------------------------------------
+# TrackingRecorder
+#------------------------------------------------------------------------------
+# Holds the scripts applied to a schema until they are flushed to
+# version_tracking in a single executemany and commit. The updater flushes at
+# the end of every version, whether it succeeded or not, and a flush happens
+# on its own once flushRows scripts are waiting.
+#------------------------------------------------------------------------------
+TRACKING_FLUSH_ROWS = 100
+
+
+class TrackingRecorder(object):
+    log = logging.getLogger('dbsync.TrackingRecorder')
+
+    def __init__(self, write, flushRows = TRACKING_FLUSH_ROWS):
+        self.__write = write
+        self.__flushRows = flushRows
+        self.__pending = []
+        self.__lock = threading.Lock()
+
+
+    def add(self, scriptPath, version, checksum, durationMs):
+        with self.__lock:
+            self.__pending.append((scriptPath, version, checksum, durationMs))
+            full = len(self.__pending) >= self.__flushRows
+        if full:
+            self.flush()
+
+
+    def flush(self):
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+            if pending:
+                TrackingRecorder.log.debug('recording {0} script(s) in version_tracking.'.format(len(pending)))
+                try:
+                    self.__write(pending)
+                except Exception:
+                    self.__pending = pending + self.__pending
+                    raise
+
+
+    @property
+    def pending(self):
+        with self.__lock:
+            return len(self.__pending)
+
+
+#------------------------------------------------------------------------------
+# ScriptCheckpoint
+#------------------------------------------------------------------------------
+# Where a checkpointed script got to, for the engine running it: the first
+# completed statements are skipped and record writes a row to
+# version_checkpoints, on the engine's cursor, for each one that completes.
+# A statement is known by its hash and a script by its checksum, so a script
+# is not carried on with once it, or a script it includes, has changed.
+#------------------------------------------------------------------------------
+class CheckpointException(Exception):
+    pass
+
+
+def statement_hash(statement):
+    return checksums.hash_bytes(statement.text.encode('utf-8'))
+
+
+class ScriptCheckpoint(object):
+    def __init__(self, script, checksum, completed, insertCheckpoint):
+        self.script = script
+        self.checksum = checksum
+        self.completed = completed
+        self.__insertCheckpoint = insertCheckpoint
+
+    def record(self, cursor, number, statement):
+        cursor.execute(self.__insertCheckpoint, {'script': self.script, 'statement_no': number, 'statement_hash': statement_hash(statement), 'script_checksum': self.checksum})
+
+
+#------------------------------------------------------------------------------
+# DbSnapshot
+#------------------------------------------------------------------------------
+# Where a schema was up to when the run started: whether the user exists, the
+# columns of its tracking table (none if there is no table), the cache size
+# of the tracking sequence (None if there is no sequence) and the (version,
+# script) of every applied script. Read once by Db.bootstrap and kept up to
+# date by Db as it changes the tracking table, so nothing else needs to ask
+# the database again.
+#------------------------------------------------------------------------------
+class DbSnapshot(namedtuple('DbSnapshot', ['schema_exists', 'tracking_columns', 'sequence_cache', 'applied_scripts'])):
+    @property
+    def tracking_table_exists(self):
+        return bool(self.tracking_columns)
+
+    @property
+    def sequence_exists(self):
+        return self.sequence_cache is not None
+
 
 class Db(object):
     log = logging.getLogger('dbsync.Db')
 
-    def __init__(self, schema, sqlRunner):
+    def __init__(self, schema, sqlRunner, appliedCache = None, scripts = None, checkpointBytes = None):
         self.__schema = schema
         self.__sqlRunner = sqlRunner
-        
-        self.__allRunScripsByVersion = self.get_executed_scripts() if self._schema_exists_in_db() else {}
+        # where script bodies are read from and run as text, None to run them from disk.
+        self.__scripts = scripts
+        # scripts this size or larger are run with checkpoints, None to run none with them.
+        self.__checkpointBytes = checkpointBytes
+        self.__checkpointLock = threading.Lock()
+        self.__checkpointTableExists = False
+        self.__checkpointed = []
+        self.__sql = dialect_of(sqlRunner)
+        self.__appliedCache = appliedCache
+        self.__recorder = TrackingRecorder(self.record_scripts_as_run)
+        self.__snapshot = None
+
+
+    @property
+    def snapshot(self):
+        if self.__snapshot is None:
+            self.__snapshot = self.bootstrap()
+        return self.__snapshot
+
+
+    def bootstrap(self):
+        """Reads the state of the schema, with one more query for the applied
+            scripts if it has a tracking table"""
+
+        schemaExists, columns, sequenceCache = False, set(), None
+        for kind, name, value in self.__sqlRunner.get_all_data_for(self.__sql.schema_state, args = {'owner': self.__schema}):
+            if kind == 'user':
+                schemaExists = True
+            elif kind == 'column':
+                columns.add(name)
+            elif kind == 'sequence':
+                sequenceCache = value or 0
+
+        applied = frozenset()
+        if columns:
+            applied = self.read_applied_scripts()
+        elif self.__appliedCache:
+            self.__appliedCache.rebuild([])
+        return DbSnapshot(schemaExists, frozenset(columns), sequenceCache, applied)
+
+
+    def read_applied_scripts(self):
+        """Returns (version, script) of every applied script, reading only the
+            rows added since the last run if there is a cache of them"""
+
+        cache = self.__appliedCache
+        if not cache:
+            return frozenset((version, script) for version, scripts in self.get_executed_scripts().items() for script in scripts)
+
+        if cache.watermark is not None:
+            rows = self.__sqlRunner.get_all_data_for(self.__sql.applied_scripts_since, self.__schema, {'watermark': cache.watermark})
+            count, maxId = [(int(r[1]), int(r[2] or 0)) for r in rows if r[0] == WATERMARK_ROW_ID][0]
+            if cache.matches(count, maxId):
+                cache.add([(id, str(parse_version(v)), s) for id, v, s in rows if id != WATERMARK_ROW_ID])
+                return cache.scripts
+            Db.log.info('cached applied scripts of "{0}" are out of date, reading them all again.'.format(self.__schema))
+
+        cache.rebuild([(id, str(parse_version(v)), s) for id, v, s in self.__sqlRunner.get_all_data_for(self.__sql.applied_scripts_with_ids, self.__schema)])
+        return cache.scripts
+
+
+    @property
+    def complete_folders(self):
+        """Version folders known to be fully applied, with their modification times"""
+        return self.__appliedCache.complete_folders if self.__appliedCache and self.snapshot.tracking_table_exists else {}
+
+
+    def set_complete_folders(self, folders):
+        if self.__appliedCache:
+            self.__appliedCache.set_complete_folders(folders)
+
+
+    def save_applied_cache(self):
+        if self.__appliedCache:
+            self.__appliedCache.save()
+
 
     def get_executed_scripts(self):
         """Returns a dictionary where:
             key = version and value = a list of all run scripts"""
 
-        scriptData = self.__sqlRunner.get_all_data_for('select version, script from version_tracking', self.__schema)
+        scriptData = self.__sqlRunner.get_all_data_for(self.__sql.applied_scripts, self.__schema)
         return self.__table_to_dict(scriptData)
 
 
+    def get_applied_scripts(self):
+        """Returns a set of (version, script) for every script already run"""
+        return self.snapshot.applied_scripts
+
+
+    def get_tracked_checksums(self):
+        """Returns (version, script, checksum) for every applied script, checksum
+            is None for scripts applied before checksums were recorded. A schema
+            never synced, without a user or tracking table, has none."""
+
+        if not self.snapshot.tracking_table_exists:
+            return []
+        if not 'CHECKSUM' in self.snapshot.tracking_columns:
+            return [(str(parse_version(v)), s, None) for v, s in self.__sqlRunner.get_all_data_for(self.__sql.applied_scripts, self.__schema)]
+        return [(str(parse_version(v)), s, c) for v, s, c in self.__sqlRunner.get_all_data_for(self.__sql.tracked_checksums, self.__schema)]
+
+
     def make_sure_tacking_table_exists(self):
-        self.__sqlRunner.run_sql_command((CREATE_TRACKING_TABLE_SQL, CREATE_TRACKING_TABLE_SEQ), self.__schema)
+        self.__sqlRunner.run_sql_command(self.__sql.create_tracking_table, self.__schema)
+        columns = frozenset(['ID', 'VERSION', 'SCRIPT', 'APPLIED_ON'] + [name for name, definition in self.__sql.tracking_table_columns])
+        self.__snapshot = DbSnapshot(True, columns, TRACKING_SEQUENCE_CACHE, frozenset())
+
+
+    def make_sure_tracking_columns_exist(self):
+        columns = self.snapshot.tracking_columns
+        for name, definition in self.__sql.tracking_table_columns:
+            if not name in columns:
+                Db.log.info('adding column "{0}" to version_tracking.'.format(name.lower()))
+                self.__sqlRunner.run_sql_command(self.__sql.add_tracking_column.format(name.lower(), definition), self.__schema)
+                columns = columns | {name}
+        self.__snapshot = self.snapshot._replace(tracking_columns = columns)
+
+
+    def make_sure_tracking_sequence_is_cached(self):
+        if self.snapshot.sequence_exists and self.snapshot.sequence_cache < TRACKING_SEQUENCE_CACHE:
+            Db.log.info('caching {0} ids of version_tracking_id_seq.'.format(TRACKING_SEQUENCE_CACHE))
+            self.__sqlRunner.run_sql_command(self.__sql.alter_sequence_cache, self.__schema)
+            self.__snapshot = self.snapshot._replace(sequence_cache = TRACKING_SEQUENCE_CACHE)
+
+
+    def make_sure_tracking_is_up_to_date(self):
+        if not self.snapshot.tracking_table_exists:
+            self.make_sure_tacking_table_exists()
+        else:
+            self.make_sure_tracking_columns_exist()
+            self.make_sure_tracking_sequence_is_cached()
 
 
     def apply_schema_to_db(self):
-        if not self._schema_exists_in_db():
+        if not self.snapshot.schema_exists:
             if self.create_schema():
                 self.apply_base_line_scripts()
-
-            self.make_sure_tacking_table_exists()
         else:
             Db.log.info('schema "{0}" already exists.'.format(self.__schema))
 
+        self.make_sure_tracking_is_up_to_date()
+
 
     def create_schema(self):
         Db.log.info('Running schema creation scripts for schema: "{0}".'.format(self.__schema))
-        scriptSucceeded = self.__sqlRunner.run_sql_script(os.path.join('.', self.__schema, 'create.user.sql'))
+        scriptSucceeded = self.__run_file(os.path.join('.', self.__schema, 'create.user.sql'))
         if scriptSucceeded:
             Db.log.info('schema ({0}) created.'.format(self.__schema))
 
@@ -239,54 +1204,156 @@ class Db(object):
 
     def get_all_files_in(self, path):
         Db.log.debug('get_all_files_in: {0}'.format(path))
-        return sorted([os.path.join(path, p) for p in os.listdir(path) if not p.startswith('_') and os.path.isfile(os.path.join(path, p))])
+        if self.__scripts:
+            return self.__scripts.get_all_files_in(path)
+        return get_all_scripts_in(path)
 
 
     def run_all_scripts_in(self, root, version = None):    
         for scriptPath in self.get_all_files_in(root):
             Db.log.debug('considering "{0}"'.format(scriptPath))
             if version:
-                if str(version) in self.__allRunScripsByVersion:
-                    if not scriptPath in self.__allRunScripsByVersion[str(version)]:
-                        if not self.apply_script(scriptPath, version): break
-                    else:
-                        Db.log.info('"{0}" - [{1}] aleady applied.'.format(scriptPath, version))
-                else:
-                    if not self.apply_script(scriptPath, version): break
+                if (str(version), scriptPath) in self.get_applied_scripts():
+                    Db.log.info('"{0}" - [{1}] aleady applied.'.format(scriptPath, version))
+                elif not self.apply_script(scriptPath, version):
+                    break
             else:
                 if not self.run_script(scriptPath):
                     Db.log.info('script: {0} failed!'.format(scriptPath))
 
 
     def apply_script(self, scriptPath, version):
-        scriptDidRun = self.run_script(scriptPath)
+        with self.__sqlRunner.metrics.script(self.__schema, version, scriptPath) as scriptMetrics:
+            scriptDidRun = self.run_script(scriptPath)
+            scriptMetrics.succeeded = bool(scriptDidRun)
+
         if scriptDidRun:
-            self.record_script_as_run(scriptPath, version)
+            self.record_script_as_run(scriptPath, version, scriptMetrics.milliseconds)
             return True
         else:
             Db.log.info('failure running script: "{0}". stopping run!'.format(scriptPath))
             return False
 
 
-    def record_script_as_run(self, scriptPath, version):
-        self.__sqlRunner.run_sql_command(INSERT_SCRIPT_INFO, self.__schema, {"version": str(version), "script": scriptPath})
+    def record_script_as_run(self, scriptPath, version, durationMs = None, checksum = None):
+        """Buffers the script to be written to version_tracking by the next flush_tracking"""
+        self.__recorder.add(scriptPath, version, checksum or self.hash_script(scriptPath), durationMs)
+        if self.__snapshot is not None:
+            self.__snapshot = self.__snapshot._replace(applied_scripts = self.__snapshot.applied_scripts | {(str(version), scriptPath)})
+
+
+    def hash_script(self, scriptPath):
+        return self.__scripts.hash_script(scriptPath) if self.__scripts else checksums.hash_file(scriptPath)
+
+
+    def flush_tracking(self):
+        self.__recorder.flush()
+        self.clear_checkpoints()
+
+
+    def record_scripts_as_run(self, scripts):
+        """Records (script path, version, checksum, duration ms) for each script in one write"""
+        rows = [{"version": str(version), "script": scriptPath, "checksum": checksum, "duration_ms": durationMs} for scriptPath, version, checksum, durationMs in scripts]
+        self.__sqlRunner.run_sql_many(self.__sql.insert_script_info, self.__schema, rows)
 
 
     def run_script(self, filename):
-        return self.__sqlRunner.run_sql_script(filename, self.__schema)
+        if csvloader.is_csv_load(filename):
+            return self.load_csv(filename)
+        if self.should_checkpoint(filename):
+            return self.run_checkpointed(filename)
+        return self.__run_file(filename, self.__schema)
+
+
+    def should_checkpoint(self, filename):
+        if self.__checkpointBytes is None:
+            return False
+        size = self.__scripts.get_file_info(filename)[0] if self.__scripts else os.path.getsize(filename)
+        return size >= self.__checkpointBytes
+
+
+    def run_checkpointed(self, filename):
+        """Runs a script statement by statement, carrying on after the last
+            statement that completed if it failed part way before"""
+
+        readScript = self.__scripts.read_script if self.__scripts else sqlplusengine.read_script
+        statements = sqlplusengine.parse_script(readScript(filename), filename, readScript)
+        hashes = [statement_hash(s) for s in statements if s.kind in (sqlplusengine.SQL, sqlplusengine.PLSQL)]
+        checksum = self.hash_script(filename)
+
+        completed = self.read_checkpoints(filename)
+        for i, (number, statementHash, scriptChecksum) in enumerate(completed):
+            if number != i + 1 or scriptChecksum != checksum or number > len(hashes) or hashes[number - 1] != statementHash:
+                raise CheckpointException('"{0}" has changed since {1} of its statements completed so it cannot be carried on with. Put the script back as it was or, once the schema has been put right by hand, delete its rows from version_checkpoints.'.format(filename, len(completed)))
+        if completed:
+            Db.log.info('"{0}" failed part way before, carrying on after statement {1} of {2}.'.format(filename, len(completed), len(hashes)))
+
+        checkpoint = ScriptCheckpoint(filename, checksum, len(completed), self.__sql.insert_checkpoint.format(self.__schema))
+        if not self.__sqlRunner.run_sql_statements(filename, statements, self.__schema, checkpoint):
+            return False
+        with self.__checkpointLock:
+            self.__checkpointed.append(filename)
+        return True
+
+
+    def read_checkpoints(self, filename):
+        """Returns (statement number, statement hash, script checksum) of each
+            statement of a script that completed, creating version_checkpoints
+            if the schema does not have one"""
+
+        with self.__checkpointLock:
+            if not self.__checkpointTableExists:
+                self.__checkpointTableExists = True
+                if not self.__sqlRunner.get_all_data_for(self.__sql.checkpoint_table, args = {'owner': self.__schema}):
+                    Db.log.info('creating version_checkpoints in "{0}".'.format(self.__schema))
+                    self.__sqlRunner.run_sql_command(self.__sql.create_checkpoint_table, self.__schema)
+                    return []
+        return [(int(n), h, c) for n, h, c in self.__sqlRunner.get_all_data_for(self.__sql.checkpoints, self.__schema, {'script': filename})]
+
+
+    def clear_checkpoints(self):
+        """Forgets the statements of checkpointed scripts that completed, once they are in version_tracking"""
+
+        with self.__checkpointLock:
+            scripts, self.__checkpointed = self.__checkpointed, []
+        if scripts:
+            self.__sqlRunner.run_sql_many(self.__sql.delete_checkpoints, self.__schema, [{'script': s} for s in scripts])
+
+
+    def __run_file(self, filename, schema = None):
+        if self.__scripts:
+            return self.__sqlRunner.run_sql_text(filename, self.__scripts.read_script(filename), schema, self.__scripts.read_script)
+        if schema:
+            return self.__sqlRunner.run_sql_script(filename, schema)
+        return self.__sqlRunner.run_sql_script(filename)
+
+
+    def load_csv(self, filename):
+        readText = self.__scripts.read_script if self.__scripts else None
+        openBinary = self.__scripts.open_binary if self.__scripts else None
+        with csvloader.CsvReader(csvloader.read_load(filename, readText), openBinary) as reader:
+            rows = self.__sqlRunner.run_sql_batches(filename, reader.statement, self.__schema, reader.batches(), reader.direct_path)
+        Db.log.info('loaded {0} row(s) from "{1}".'.format(rows, filename))
+        return True
+
+
+    def open_session(self):
+        self.__sqlRunner.open_session()
+
+
+    def close_session(self):
+        self.__sqlRunner.close_session()
 
 
     def _schema_exists_in_db(self):
-        userData = self.__sqlRunner.get_all_data_for(GET_ALL_USERS)
-        schemas = [s[0].casefold() for s in userData]
-        return self.__schema in schemas
+        return self.snapshot.schema_exists
 
 
     def __table_to_dict(self, table):
         result = {}
 
         for i in table:
-            version = str(StrictVersion(i[0]))
+            version = str(parse_version(i[0]))
             if not version in result:
                 result[version] = []
             result[version].append(i[1])
@@ -295,47 +1362,461 @@ class Db(object):
 
 
 
+#------------------------------------------------------------------------------
+# SyncPlanner
+#------------------------------------------------------------------------------
+# Works out, in one pass over the source, which scripts still need to be run
+# to reach the target version. Already applied scripts are looked up in a set
+# keyed by (version, script) and version folders above the target are never
+# listed. Folders known to be fully applied, and unchanged since, are not
+# listed either. After planning complete_folders holds every folder found to
+# be fully applied.
+#------------------------------------------------------------------------------
+PlannedScript = namedtuple('PlannedScript', ['version', 'path'])
+
+
+class SyncPlan(object):
+    def __init__(self, steps):
+        self.__steps = tuple(steps)
+
+    @property
+    def steps(self):
+        return self.__steps
+
+    def __iter__(self):
+        return iter(self.__steps)
+
+    def __len__(self):
+        return len(self.__steps)
+
+    def describe(self):
+        if not self.__steps:
+            return 'nothing to apply.'
+        lines = ['{0} script(s) to apply:'.format(len(self.__steps))]
+        lines.extend('    [{0}] {1}'.format(step.version, step.path) for step in self.__steps)
+        return '\n'.join(lines)
+
+
+class SyncPlanner(object):
+    log = logging.getLogger('dbsync.SyncPlanner')
+
+    def __init__(self, sourceProvider, appliedScripts, completeFolders = {}):
+        self.__sourceProvider = sourceProvider
+        self.__appliedScripts = appliedScripts
+        self.__completeFolders = completeFolders
+        self.complete_folders = {}
+
+
+    def plan(self, targetVersion = None):
+        steps = []
+        self.complete_folders = {}
+        for folder, version in self.__sourceProvider.get_all_version_folders():
+            if targetVersion and version > targetVersion:
+                SyncPlanner.log.debug('folder version "{0}" is greater than target version "{1}" so stopping.'.format(version, targetVersion))
+                break
+
+            stamp = self.__sourceProvider.get_folder_stamp(folder)
+            if folder in self.__completeFolders and self.__completeFolders[folder] == stamp:
+                SyncPlanner.log.debug('every script in "{0}" already applied.'.format(folder))
+                self.complete_folders[folder] = stamp
+                continue
+
+            key = str(version)
+            pending = len(steps)
+            for scriptPath in self.__sourceProvider.get_all_files_in(folder):
+                if (key, scriptPath) in self.__appliedScripts:
+                    SyncPlanner.log.debug('"{0}" - [{1}] aleady applied.'.format(scriptPath, version))
+                else:
+                    steps.append(PlannedScript(version, scriptPath))
+
+            if len(steps) == pending and stamp is not None:
+                self.complete_folders[folder] = stamp
+
+        return SyncPlan(steps)
+
+
+
 log = logging.getLogger(__name__)
 
 class DbUpdater(object):
     log = logging.getLogger('dbsync.DbUpdater')
 
-    def __init__(self, db, sourceProvider):
+    def __init__(self, db, sourceProvider, maxParallel = scheduler.DEFAULT_MAX_PARALLEL, retry = None):
         self.__db = db
         self.__sourceProvider = sourceProvider
+        self.__scheduler = scheduler.ScriptScheduler(db.apply_script, sourceProvider.get_script_dependencies, maxParallel, retry)
 
 
     def bring_to_verion(self, targetVersion):
         
         if self.__sourceProvider.schema_folder_exists():
-            self.__db.apply_schema_to_db()
-
-            for folder, version in self.__sourceProvider.get_all_version_folders():
-                DbUpdater.log.debug('considering folder: "{0}" for version: "{1}".'.format(folder, version))
-                if targetVersion:
-                    if targetVersion >= version:
-                        self.__db.run_all_scripts_in(folder, version)
-                    else:
-                        DbUpdater.log.debug('folder version "{0}" is greater than target version "{1}" so skipping.'.format(version, targetVersion))
-                else:
-                    DbUpdater.log.debug('No version provided to going to always apply scripts in folder.')
-                    self.__db.run_all_scripts_in(folder, version)
+            # one sqlplus session is shared by every script run during the sync.
+            self.__db.open_session()
+            try:
+                self.__db.apply_schema_to_db()
+                return self.apply_pending(targetVersion)
+            finally:
+                self.__db.close_session()
+
+        return False
+
+
+    def apply_pending(self, targetVersion):
+        """Applies every script not yet applied to a schema that is already in place"""
+        return self.run_plan(self.plan(targetVersion))
+
+
+    def plan(self, targetVersion):
+        planner = SyncPlanner(self.__sourceProvider, self.__db.get_applied_scripts(), self.__db.complete_folders)
+        plan = planner.plan(targetVersion)
+        self.__db.set_complete_folders(planner.complete_folders)
+        return plan
+
+
+    def run_plan(self, plan):
+        for version, steps in itertools.groupby(plan, key = lambda step: step.version):
+            DbUpdater.log.debug('applying scripts for version "{0}".'.format(version))
+            try:
+                succeeded = self.__scheduler.run(list(steps))
+            except Exception:
+                # the scripts that did complete are still recorded, without a
+                # failure to do so hiding why the script failed.
+                try:
+                    self.__db.flush_tracking()
+                except Exception as ex:
+                    DbUpdater.log.error('recording the scripts applied to version "{0}" failed.'.format(version), exc_info = ex)
+                raise
+            self.__db.flush_tracking()
+            if not succeeded:
+                return False
+        return True
 
 
 
-def sync_db(argReader, sqlRunner):
-    db = Db(
-        argReader.get_schema(), 
-        sqlRunner)
+def source_for(argReader, schema):
+    if argReader.source:
+        return ArchiveSourceOperations(schema, archivesource.open_archive(argReader.source))
+    return SourceOperations(schema, ManifestCache.for_schema(schema, argReader.rescan))
+
+
+def db_for(argReader, schema, sqlRunner):
+    scripts = source_for(argReader, schema).script_reader if argReader.source else None
+    return Db(schema, sqlRunner, AppliedScriptsCache.for_target(schema, sqlRunner.target, argReader.rescan), scripts, argReader.checkpoint_bytes)
+
+
+def sync_schema(argReader, schema, sqlRunner, source = None):
+    db = db_for(argReader, schema, sqlRunner)
     
-    updater = DbUpdater(db, SourceOperations(argReader.get_schema()))
-    updater.bring_to_verion(argReader.get_target_version())
+    source = source or source_for(argReader, schema)
+    updater = DbUpdater(db, source, argReader.max_parallel, argReader.lock_retry)
+    try:
+        return updater.bring_to_verion(argReader.get_target_version())
+    finally:
+        source.save_manifest()
+        db.save_applied_cache()
+
+
+#------------------------------------------------------------------------------
+# Multi schema sync
+#------------------------------------------------------------------------------
+# Schemas are independent of each other so each one is synced on its own
+# thread with its own runner (and so its own sqlplus session and connections).
+# A failure in one schema does not stop the others.
+#------------------------------------------------------------------------------
+SchemaSyncResult = namedtuple('SchemaSyncResult', ['schema', 'succeeded', 'seconds', 'error'])
+
+
+def timed_sync_schema(argReader, schema, sqlRunner, source = None):
+    started = time.perf_counter()
+    try:
+        succeeded, error = sync_schema(argReader, schema, sqlRunner, source), None
+    except Exception as ex:
+        log.error('sync of schema "{0}" failed.'.format(schema), exc_info=ex)
+        succeeded, error = False, ex
+    finally:
+        sqlRunner.close()
+    return SchemaSyncResult(schema, succeeded, time.perf_counter() - started, error)
+
+
+def sync_schemas(argReader, schemas, sqlRunner, sources = {}):
+    with ThreadPoolExecutor(max_workers = min(argReader.workers, len(schemas)) or 1) as executor:
+        futures = [executor.submit(timed_sync_schema, argReader, schema, sqlRunner.clone(), sources.get(schema)) for schema in schemas]
+        return [f.result() for f in futures]
+
+
+def format_sync_report(results):
+    width = max([len('schema')] + [len(r.schema) for r in results])
+    lines = ['{0:<{1}}  status  seconds'.format('schema', width)]
+    for r in results:
+        line = '{0:<{1}}  {2:<6}  {3:7.2f}'.format(r.schema, width, 'ok' if r.succeeded else 'FAILED', r.seconds)
+        if r.error:
+            line += '  {0}'.format(getattr(r.error, 'script_path', r.error))
+        lines.append(line)
+    lines.append('{0} of {1} schema(s) synced.'.format(len([r for r in results if r.succeeded]), len(results)))
+    return '\n'.join(lines)
+
+
+#------------------------------------------------------------------------------
+# Fan out sync
+#------------------------------------------------------------------------------
+# Syncs the same schemas on many databases at once. The schema folders are
+# read once and shared. Each target is planned against its own applied
+# scripts and synced on its own thread with its own runner, so its own
+# connections and sqlplus sessions; a failure on one target does not stop
+# the others.
+#------------------------------------------------------------------------------
+TargetSyncResult = namedtuple('TargetSyncResult', ['target', 'schema', 'succeeded', 'seconds', 'error'])
+
+
+def sync_target(argReader, schemas, sources, sqlRunner):
+    try:
+        return [TargetSyncResult(sqlRunner.target, *r) for r in sync_schemas(argReader, schemas, sqlRunner, sources)]
+    finally:
+        sqlRunner.close()
+
+
+def fan_out_sync(argReader, targets, sqlRunner):
+    schemas = argReader.get_schemas()
+    sources = dict((schema, SharedSource(source_for(argReader, schema))) for schema in schemas)
+    try:
+        with ThreadPoolExecutor(max_workers = min(argReader.target_workers, len(targets))) as executor:
+            futures = [executor.submit(sync_target, argReader, schemas, sources, sqlRunner.for_target(*target)) for target in targets]
+            return [r for f in futures for r in f.result()]
+    finally:
+        for source in sources.values():
+            source.save_manifest()
+
+
+def format_fan_out_report(results):
+    targetWidth = max([len('target')] + [len(r.target) for r in results])
+    schemaWidth = max([len('schema')] + [len(r.schema) for r in results])
+    lines = ['{0:<{1}}  {2:<{3}}  status  seconds'.format('target', targetWidth, 'schema', schemaWidth)]
+    for r in results:
+        line = '{0:<{1}}  {2:<{3}}  {4:<6}  {5:7.2f}'.format(r.target, targetWidth, r.schema, schemaWidth, 'ok' if r.succeeded else 'FAILED', r.seconds)
+        if r.error:
+            line += '  {0}'.format(getattr(r.error, 'script_path', r.error))
+        lines.append(line)
+    failedTargets = set(r.target for r in results if not r.succeeded)
+    targets = set(r.target for r in results)
+    lines.append('{0} of {1} target(s) synced.'.format(len(targets - failedTargets), len(targets)))
+    return '\n'.join(lines)
+
+
+def sync_db(argReader, sqlRunner):
+    targets = argReader.targets
+    if len(targets) > 1:
+        print(format_fan_out_report(fan_out_sync(argReader, targets, sqlRunner)))
+        return
+
+    schemas = argReader.get_schemas()
+    if len(schemas) == 1:
+        sync_schema(argReader, schemas[0], sqlRunner)
+    else:
+        print(format_sync_report(sync_schemas(argReader, schemas, sqlRunner)))
+
+
+def plan_sync(argReader, sqlRunner):
+    for schema in argReader.get_schemas():
+        db = db_for(argReader, schema, sqlRunner)
+
+        source = source_for(argReader, schema)
+        updater = DbUpdater(db, source)
+        print('{0}: {1}'.format(schema, updater.plan(argReader.get_target_version()).describe()))
+        source.save_manifest()
+        db.save_applied_cache()
+
+
+def verify_schema(argReader, schema, sqlRunner):
+    source = source_for(argReader, schema)
+    if not source.schema_folder_exists():
+        return checksums.VerifyResult([], [], [])
+
+    scripts = dict((path, str(version)) for folder, version in source.get_all_version_folders() for path in source.get_all_files_in(folder))
+
+    cache = checksums.ChecksumCache.for_schema(schema, CACHE_FOLDER)
+    hashes = checksums.hash_files(scripts, cache, source.get_file_info, hashFile = source.hash_script)
+    cache.save()
+    source.save_manifest()
+
+    sourceChecksums = dict(((version, path), hashes[path]) for path, version in scripts.items())
+    return checksums.compare(sourceChecksums, Db(schema, sqlRunner).get_tracked_checksums())
+
+
+def format_verify_report(schema, result):
+    lines = ['{0}: {1} drifted, {2} missing, {3} unknown.'.format(schema, len(result.drifted), len(result.missing), len(result.unknown))]
+    for label, scripts in (('drifted', result.drifted), ('missing', result.missing), ('unknown', result.unknown)):
+        lines.extend('    {0:<8} [{1}] {2}'.format(label, version, script) for version, script in scripts)
+    return '\n'.join(lines)
+
+
+def verify_db(argReader, sqlRunner):
+    for schema in argReader.get_schemas():
+        print(format_verify_report(schema, verify_schema(argReader, schema, sqlRunner)))
+
+
+def bundle_db(argReader, sqlRunner):
+    targetVersion = argReader.get_target_version()
+    schemaBundles = []
+    for schema in argReader.get_schemas():
+        source = source_for(argReader, schema)
+        if not source.schema_folder_exists():
+            log.error('no folder for schema "{0}" so it is not bundled.'.format(schema))
+            continue
+        ordering = scheduler.ScriptScheduler(None, source.get_script_dependencies)
+        steps = []
+        for version, versionSteps in itertools.groupby(SyncPlanner(source, frozenset()).plan(targetVersion), key = lambda step: step.version):
+            steps.extend(ordering.order(list(versionSteps)))
+
+        schemaBundles.append(bundle.build_schema_bundle(schema, source.get_create_user_script(), source.get_baseline_scripts(), steps, source.read_bytes))
+        source.save_manifest()
+        print('{0}: {1} script(s) bundled.'.format(schema, len(steps)))
+
+    bundle.write_bundle(argReader.bundle_path, schemaBundles, targetVersion)
+
+
+def timed_apply_bundle(schemaBundle, sqlRunner):
+    started = time.perf_counter()
+    try:
+        succeeded, error = bundle.BundleApplier(Db(schemaBundle.schema, sqlRunner), sqlRunner).apply(schemaBundle), None
+    except Exception as ex:
+        log.error('applying the bundle to schema "{0}" failed.'.format(schemaBundle.schema), exc_info=ex)
+        succeeded, error = False, ex
+    return SchemaSyncResult(schemaBundle.schema, succeeded, time.perf_counter() - started, error)
+
+
+def apply_bundle(argReader, sqlRunner):
+    schemaBundles = [b for b in bundle.read_bundle(argReader.bundle_path) if argReader.selects_schema(b.schema)]
+    print(format_sync_report([timed_apply_bundle(b, sqlRunner) for b in schemaBundles]))
+
+
+#------------------------------------------------------------------------------
+# Watch
+#------------------------------------------------------------------------------
+# Brings the schemas up to date then applies scripts as they are added. The
+# runner's session, the applied scripts of each schema and the listing of
+# its folders are kept between bursts of changes, so applying a new script
+# costs a stat of each version folder and the script itself. A script that
+# fails is tried again the next time its schema's folders change.
+#------------------------------------------------------------------------------
+def apply_pending_scripts(schema, updater, targetVersion):
+    try:
+        updater.apply_pending(targetVersion)
+    except Exception as ex:
+        log.error('applying new scripts to schema "{0}" failed.'.format(schema), exc_info=ex)
+
+
+def watch_db(argReader, sqlRunner, watch = watcher.watch):
+    if argReader.source:
+        log.error('an archive does not change so cannot be watched, sync from it instead.')
+        return
+
+    watched = []
+    for schema in argReader.get_schemas():
+        source = source_for(argReader, schema)
+        if not os.path.isdir(source.get_path_to_versions_folder()):
+            log.error('no versions folder for schema "{0}" so it is not watched.'.format(schema))
+            continue
+        db = db_for(argReader, schema, sqlRunner)
+        watched.append((schema, db, source, DbUpdater(db, source, argReader.max_parallel, argReader.lock_retry)))
+    if not watched:
+        return
+
+    targetVersion = argReader.get_target_version()
+    folderWatcher = watch([source.get_path_to_versions_folder() for schema, db, source, updater in watched])
+    sqlRunner.open_session()
+    try:
+        for schema, db, source, updater in watched:
+            db.apply_schema_to_db()
+            apply_pending_scripts(schema, updater, targetVersion)
+
+        log.info('watching {0} schema(s) for new scripts, press Ctrl+C to stop.'.format(len(watched)))
+        for changed in folderWatcher.changes():
+            for schema, db, source, updater in watched:
+                root = os.path.normpath(source.get_path_to_versions_folder())
+                if any(os.path.normpath(path).startswith(root + os.sep) for path in changed):
+                    apply_pending_scripts(schema, updater, targetVersion)
+                    source.save_manifest()
+                    db.save_applied_cache()
+    except KeyboardInterrupt:
+        log.info('stopped watching.')
+    finally:
+        folderWatcher.close()
+        sqlRunner.close_session()
+        for schema, db, source, updater in watched:
+            source.save_manifest()
+            db.save_applied_cache()
+
+
+#------------------------------------------------------------------------------
+# Reset
+#------------------------------------------------------------------------------
+# Drops a schema and brings it up to the target version again. If a snapshot
+# of the same scripts, up to the target version or an earlier one, is cached
+# it is restored once create.user.sql has run and only the scripts after it
+# are applied. The state reached is then saved for the next reset. See
+# snapshotcache for how snapshots are keyed and kept.
+#------------------------------------------------------------------------------
+def reset_schema(argReader, schema, sqlRunner, snapshots, exporter):
+    source = source_for(argReader, schema)
+    if not source.schema_folder_exists():
+        return False
+
+    if Db(schema, sqlRunner).snapshot.schema_exists:
+        sqlRunner.drop_schema(schema)
+
+    targetVersion = argReader.get_target_version()
+    createUser = source.get_create_user_script()
+    baseScripts = ([createUser] if createUser else []) + source.get_baseline_scripts()
+    keys = snapshotcache.snapshot_keys(exporter.name, schema, baseScripts, SyncPlanner(source, frozenset()).plan(targetVersion), source.hash_script)
+
+    # the applied scripts are read again as the restored tracking table may
+    # look like the one cached.
+    db = Db(schema, sqlRunner, AppliedScriptsCache.for_target(schema, sqlRunner.target, True), source.script_reader, argReader.checkpoint_bytes)
+    cached = [key for version, key in keys if snapshots.contains(key)]
+    if cached and db.create_schema():
+        snapshots.restore(cached[-1], lambda folder: exporter.import_schema(schema, folder))
+
+    updater = DbUpdater(db, source, argReader.max_parallel, argReader.lock_retry)
+    try:
+        synced = updater.bring_to_verion(targetVersion)
+    finally:
+        source.save_manifest()
+        db.save_applied_cache()
+
+    if synced:
+        version, key = keys[-1]
+        snapshots.capture(key, lambda folder: exporter.export_schema(schema, folder), schema, str(version) if version else None)
+    return synced
+
+
+def reset_db(argReader, sqlRunner):
+    snapshots = snapshotcache.SnapshotCache(maxBytes = argReader.snapshot_max_bytes)
+    exporter = snapshotcache.exporter_for(argReader.driver, sqlRunner, argReader.target, argReader.snapshot_export, argReader.snapshot_import)
+    for schema in argReader.get_schemas():
+        if not reset_schema(argReader, schema, sqlRunner, snapshots, exporter):
+            log.error('schema "{0}" was not reset.'.format(schema))
 
 
 def drop_schema(argReader, sqlRunner):
-    sqlRunner.drop_schema(argReader.get_schema())
+    for schema in argReader.get_schemas():
+        sqlRunner.drop_schema(schema)
             
 
+def write_metrics(argReader, runMetrics):
+    summary = runMetrics.summary()
+    log.info('{scripts_applied} script(s) applied, {scripts_failed} failed, {queries} queries, {connections} connections, {spawn_seconds}s starting sqlplus.'.format(**summary))
+    if argReader.metrics_json:
+        runMetrics.write_json(argReader.metrics_json)
+    if argReader.metrics_prom:
+        runMetrics.write_prometheus(argReader.metrics_prom)
+
+
+def write_profile(argReader, profile):
+    print(profile.format_report(argReader.profile_top))
+    if argReader.profile_json:
+        profile.write_json(argReader.profile_json)
+
+
 def main(argv):
     try:
         logger = logging.basicConfig(level=logging.WARN)
@@ -347,10 +1828,28 @@ def main(argv):
     
         actions = {
             ArgumentsReader.SYNC: sync_db,
-            ArgumentsReader.DROP: drop_schema
+            ArgumentsReader.DROP: drop_schema,
+            ArgumentsReader.PLAN: plan_sync,
+            ArgumentsReader.VERIFY: verify_db,
+            ArgumentsReader.BUNDLE: bundle_db,
+            ArgumentsReader.APPLY: apply_bundle,
+            ArgumentsReader.WATCH: watch_db,
+            ArgumentsReader.RESET: reset_db
         }
     
-        argReader.process(actions, runner.OracleSqlRunner(username, password, server))
+        runMetrics = RunMetrics()
+        profile = StatementProfile() if argReader.profile else None
+        target = argReader.target
+        sqlRunner = drivers.runner_class(argReader.driver)(target.username, target.password, target.host, poolSize = argReader.pool_size, engine = argReader.engine, output = argReader.output, metrics = runMetrics, profile = profile, ddlLockTimeout = argReader.ddl_lock_timeout)
+        try:
+            argReader.process(actions, sqlRunner)
+        finally:
+            sqlRunner.close()
+            if sqlRunner.pool_stats:
+                log.info('connections created: {created}, reused: {reused}, schema switches: {schema_switches}, skipped: {schema_switches_skipped}.'.format(**sqlRunner.pool_stats))
+            write_metrics(argReader, runMetrics)
+            if profile:
+                write_profile(argReader, profile)
     except Exception as ex:
         log.error("Error during dbsyn.", exc_info=ex)
     
@@ -0,0 +1,83 @@
+import importlib
+import logging
+
+from collections import namedtuple
+
+#------------------------------------------------------------------------------
+# Drivers
+#------------------------------------------------------------------------------
+# A driver is a runner class: something that runs scripts and commands
+# against one kind of database for Db, the updaters and the commands. The
+# module of a driver is only imported when a runner is asked for, so
+# choosing one never loads the client libraries of the others.
+#
+# A runner that keeps track of scripts with sql other than Oracle's gives
+# that sql as its dialect.
+#------------------------------------------------------------------------------
+ORACLE = 'oracle'
+SQLITE = 'sqlite'
+
+DRIVERS = {
+    ORACLE: ('sqlplusscriptrunner', 'OracleSqlRunner'),
+    SQLITE: ('sqlitedriver', 'SqliteSqlRunner') }
+
+log = logging.getLogger('drivers')
+
+# schema_state: a row of ('user', name, null) if the schema given by the
+#     :owner bind exists, ('column', NAME, null) for each column of its
+#     version_tracking table and ('sequence', name, cache size) for the
+#     sequence ids come from, if there is one.
+# applied_scripts, applied_scripts_with_ids, applied_scripts_since and
+#     tracked_checksums: read version_tracking, see dbsync.
+# create_tracking_table: the statements that create version_tracking.
+# insert_script_info: records a script run, with :version, :script,
+#     :checksum and :duration_ms binds.
+# tracking_table_columns: (NAME, definition) of columns added to
+#     version_tracking since it was first created.
+# add_tracking_column: adds one of those columns, formatted with the name
+#     and definition.
+# alter_sequence_cache: caches ids of the tracking sequence.
+# checkpoint_table: a row if the schema given by the :owner bind has a
+#     version_checkpoints table.
+# create_checkpoint_table: the statements that create version_checkpoints.
+# checkpoints: (statement number, statement hash, script checksum) of each
+#     statement of the :script bind that completed, in order.
+# insert_checkpoint: records a statement that completed, with :script,
+#     :statement_no, :statement_hash and :script_checksum binds. It is
+#     formatted with the schema as it may run after a script has moved the
+#     session to another.
+# delete_checkpoints: forgets the statements of the :script bind.
+Dialect = namedtuple('Dialect', [
+    'schema_state',
+    'applied_scripts',
+    'applied_scripts_with_ids',
+    'applied_scripts_since',
+    'tracked_checksums',
+    'create_tracking_table',
+    'insert_script_info',
+    'tracking_table_columns',
+    'add_tracking_column',
+    'alter_sequence_cache',
+    'checkpoint_table',
+    'create_checkpoint_table',
+    'checkpoints',
+    'insert_checkpoint',
+    'delete_checkpoints'])
+
+
+class DriverException(Exception):
+    pass
+
+
+def register_driver(name, module, className):
+    DRIVERS[name] = (module, className)
+
+
+def runner_class(name):
+    """Returns the runner class of a driver, importing its module"""
+
+    if not name in DRIVERS:
+        raise DriverException('"{0}" is not one of the drivers: {1}'.format(name, sorted(DRIVERS)))
+    module, className = DRIVERS[name]
+    log.debug('loading driver "{0}" from {1}.{2}.'.format(name, module, className))
+    return getattr(importlib.import_module(module), className)
@@ -0,0 +1,166 @@
+"""An in-process stand in for cx_Oracle used by the benchmarks.
+
+It understands just enough of the SQL dbsync sends (the schema state query,
+the version_tracking table and its sequence) to let a whole sync run, treats
+every other statement as a successful no-op and counts connections and round
+trips. Each round trip can be slowed down to imitate a remote or busy
+listener.
+
+usage:
+    import fake_cx_oracle
+    database = fake_cx_oracle.install(latency = 0.002)
+    import dbsync
+"""
+import re
+import sys
+import time
+import threading
+
+TRACKING_COLUMNS = ('ID', 'VERSION', 'SCRIPT', 'APPLIED_ON', 'CHECKSUM', 'DURATION_MS')
+
+
+class DatabaseError(Exception):
+    pass
+
+
+class Warning(Exception):
+    pass
+
+
+class _Error(object):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class FakeDatabase(object):
+    def __init__(self, latency = 0.0, connectLatency = 0.0):
+        self.latency = latency
+        self.connect_latency = connectLatency
+        self.users = set(['SYSTEM'])
+        self.tracking = {}
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.connections = 0
+        self.round_trips = 0
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+database = FakeDatabase()
+
+
+def install(latency = 0.0, connectLatency = 0.0):
+    """Makes "import cx_Oracle" return this module, returning the fake database"""
+    database.latency = latency
+    database.connect_latency = connectLatency
+    sys.modules['cx_Oracle'] = sys.modules[__name__]
+    return database
+
+
+def connect(user, password, dsn):
+    if database.connect_latency:
+        time.sleep(database.connect_latency)
+    with database.lock:
+        database.connections += 1
+    return Connection(user)
+
+
+class Connection(object):
+    def __init__(self, user):
+        self.current_schema = user
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        database.round_trip()
+
+    def rollback(self):
+        database.round_trip()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Cursor(object):
+    def __init__(self, connection):
+        self.__connection = connection
+        self.__rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, args = {}):
+        database.round_trip()
+        self.__rows = run(' '.join(sql.lower().split()), args, (self.__connection.current_schema or '').upper())
+        self.rowcount = len(self.__rows)
+        return self
+
+    def executemany(self, sql, rows):
+        database.round_trip()
+        statement = ' '.join(sql.lower().split())
+        for args in rows:
+            run(statement, args, (self.__connection.current_schema or '').upper())
+        self.rowcount = len(rows)
+
+    def fetchall(self):
+        rows, self.__rows = self.__rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+def run(sql, args, schema):
+    with database.lock:
+        if sql.startswith("select 'user'"):
+            owner = str(args.get('owner', '')).upper()
+            rows = [('user', owner, None)] if owner in database.users else []
+            if owner in database.tracking:
+                rows += [('column', c, None) for c in TRACKING_COLUMNS] + [('sequence', 'VERSION_TRACKING_ID_SEQ', 20)]
+            return rows
+
+        if 'from dba_users' in sql:
+            return [(u,) for u in sorted(database.users)]
+
+        if sql.startswith('create table version_tracking'):
+            database.users.add(schema)
+            database.tracking.setdefault(schema, [])
+            return []
+
+        if sql.startswith('insert into version_tracking'):
+            rows = database.tracking.setdefault(schema, [])
+            rows.append(dict(id = len(rows) + 1, version = args['version'], script = args['script'], checksum = args.get('checksum'), duration_ms = args.get('duration_ms')))
+            return []
+
+        if sql.startswith('select') and 'from version_tracking' in sql:
+            if schema not in database.tracking:
+                raise DatabaseError(_Error(942, 'ORA-00942: table or view does not exist'))
+            columns = [c.strip() for c in re.match('select (.*?) from', sql).group(1).split(',')]
+            rows = database.tracking[schema]
+            if 'where id > :watermark' in sql:
+                below = [r for r in rows if r['id'] <= args['watermark']]
+                summary = (-1, str(len(below)), str(max(r['id'] for r in below)) if below else None)
+                return [tuple(row.get(c) for c in columns) for row in rows if row['id'] > args['watermark']] + [summary]
+            return [tuple(row.get(c) for c in columns) for row in rows]
+
+        match = re.match(r'drop user (\w+)', sql)
+        if match:
+            database.users.discard(match.group(1).upper())
+            database.tracking.pop(match.group(1).upper(), None)
+
+        return []
@@ -0,0 +1,96 @@
+"""A stand in for sqlplus that understands just enough of its input to test
+dbsync without an Oracle client.
+
+usage: python fake_sqlplus.py -S <connection string>
+
+Supported input:
+    WHENEVER SQLERROR EXIT <code>
+    WHENEVER SQLERROR CONTINUE
+    SET TIMING ON|OFF
+    PROMPT <text>
+    @"<script path>"
+    exit
+
+A line starting with "-- fake: error" fails, in a script run with @ or
+streamed in on stdin, and the process exits unless WHENEVER SQLERROR CONTINUE
+was given (in the script or before it). If the
+FAKE_SQLPLUS_LOG environment variable is set one line is appended to that file
+for every process started. With timing on an "Elapsed:" line is written for
+every statement of a script. FAKE_SQLPLUS_STARTUP_SECONDS adds a delay to every
+process start to imitate client start up and login.
+"""
+import os
+import re
+import sys
+import time
+
+from sqlplusengine import parse_file, SQL, PLSQL
+
+
+def log_process_start():
+    logPath = os.environ.get('FAKE_SQLPLUS_LOG')
+    if logPath:
+        with open(logPath, 'a') as f:
+            f.write('{0}\n'.format(os.getpid()))
+
+
+def print_timings(path):
+    for statement in parse_file(path):
+        if statement.kind in (SQL, PLSQL):
+            print('Elapsed: 00:00:00.01')
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.exitCode = None
+        self.timing = False
+
+    def run(self, line):
+        """Returns the exit code if the line ends the process, otherwise None"""
+
+        line = line.strip()
+        command = line.upper()
+
+        if command.startswith('WHENEVER SQLERROR EXIT'):
+            self.exitCode = int(re.sub('[^0-9]', '', command) or '1')
+        elif command.startswith('WHENEVER SQLERROR CONTINUE'):
+            self.exitCode = None
+        elif command.startswith('SET TIMING'):
+            self.timing = command.endswith('ON')
+        elif command.startswith('PROMPT'):
+            print(line[len('PROMPT'):].strip())
+        elif line.startswith('@'):
+            path = line[1:].strip().strip('"')
+            with open(path) as f:
+                for scriptLine in f:
+                    exitCode = self.run(scriptLine)
+                    if exitCode is not None:
+                        return exitCode
+            if self.timing:
+                print_timings(path)
+        elif line.startswith('-- fake: error'):
+            print('ORA-00942: table or view does not exist')
+            if self.exitCode is not None:
+                sys.stdout.flush()
+                return self.exitCode
+        elif command in ('EXIT', 'EXIT;', 'QUIT', 'QUIT;'):
+            return 0
+        return None
+
+
+def main():
+    log_process_start()
+    time.sleep(float(os.environ.get('FAKE_SQLPLUS_STARTUP_SECONDS', '0')))
+    session = FakeSession()
+
+    for line in sys.stdin:
+        exitCode = session.run(line)
+        if exitCode is not None:
+            return exitCode
+        sys.stdout.flush()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
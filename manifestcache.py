@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import logging
+
+#------------------------------------------------------------------------------
+# ManifestCache
+#------------------------------------------------------------------------------
+# Remembers the listing of every folder it is asked about (names, whether
+# each entry is a folder, file sizes and modification times) in a json file
+# between runs. A folder's modification time changes whenever an entry is
+# added, removed or renamed so a cached listing is used for as long as the
+# folder's modification time is unchanged, costing one stat call per folder
+# instead of a listing and a stat per file.
+#
+# Folders changed in the last couple of seconds are not cached as a file
+# added within the same clock tick would not change the modification time.
+#
+# Only the listings are kept in the file. The version folder names read from
+# them are parsed again each run, once per name (see dbsync.parse_version),
+# which costs far less than the listing the cache saves.
+#------------------------------------------------------------------------------
+CACHE_FOLDER = '.dbsynccache'
+CACHE_FORMAT = 1
+RACY_SECONDS = 2
+
+
+class ManifestCache(object):
+    log = logging.getLogger('manifestcache.ManifestCache')
+
+    def __init__(self, path, rescan = False):
+        self.__path = path
+        self.__folders = {} if rescan else self.__load()
+        self.__dirty = rescan
+        self.__hits = 0
+        self.__scans = 0
+
+
+    @staticmethod
+    def for_schema(schema, rescan = False, cacheFolder = CACHE_FOLDER):
+        return ManifestCache(os.path.join(cacheFolder, '{0}.manifest.json'.format(schema)), rescan)
+
+
+    def get_folders_in(self, path):
+        return [name for name, isFolder, size, mtime in self.list_folder(path) if isFolder]
+
+
+    def get_files_in(self, path):
+        return [name for name, isFolder, size, mtime in self.list_folder(path) if not isFolder]
+
+
+    def get_file_info(self, path):
+        """Returns the (size, mtime) recorded for a file when its folder was listed"""
+        folder, name = os.path.split(path)
+        for entryName, isFolder, size, mtime in self.list_folder(folder):
+            if entryName == name and not isFolder:
+                return size, mtime
+        return None
+
+
+    def list_folder(self, path):
+        """Returns [name, is folder, size, mtime] for every entry in path not starting with an underscore"""
+
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.__folders.get(path)
+        if cached and cached['mtime'] == mtime:
+            self.__hits += 1
+            return cached['entries']
+
+        self.__scans += 1
+        entries = []
+        with os.scandir(path) as folder:
+            for entry in folder:
+                if entry.name.startswith('_'):
+                    continue
+                stat = entry.stat()
+                entries.append([entry.name, entry.is_dir(), stat.st_size, stat.st_mtime_ns])
+        entries.sort()
+
+        if time.time() - mtime / 1e9 > RACY_SECONDS:
+            self.__folders[path] = {'mtime': mtime, 'entries': entries}
+            self.__dirty = True
+        return entries
+
+
+    def save(self):
+        if not self.__dirty:
+            return
+
+        folder = os.path.dirname(self.__path)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        temp = '{0}.{1}.tmp'.format(self.__path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump({'format': CACHE_FORMAT, 'folders': self.__folders}, f)
+        os.replace(temp, self.__path)
+        self.__dirty = False
+        ManifestCache.log.debug('manifest cache saved to "{0}" ({1} cached, {2} scanned).'.format(self.__path, self.__hits, self.__scans))
+
+
+    @property
+    def stats(self):
+        return {'hits': self.__hits, 'scans': self.__scans}
+
+
+    def __load(self):
+        try:
+            with open(self.__path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            ManifestCache.log.warning('ignoring unreadable manifest cache "{0}".'.format(self.__path))
+            return {}
+
+        if data.get('format') != CACHE_FORMAT:
+            return {}
+        return data.get('folders', {})
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import datetime
+import threading
+import logging
+
+from contextlib import contextmanager
+
+#------------------------------------------------------------------------------
+# RunMetrics
+#------------------------------------------------------------------------------
+# Collects timings and counts for a run. While a script is being applied the
+# thread applying it has that script as its current script and everything
+# counted on the thread (queries, connections opened, time spent starting
+# sqlplus) is put against the script. Anything counted outside of a script
+# is the tool's own overhead: reading the tracking table, recording applied
+# scripts and so on.
+#
+# The summary can be written as json or as a Prometheus textfile for the
+# node exporter's textfile collector.
+#------------------------------------------------------------------------------
+class ScriptMetrics(object):
+    def __init__(self, schema, version, script):
+        self.schema = schema
+        self.version = str(version)
+        self.script = script
+        self.started = datetime.datetime.now().isoformat()
+        self.seconds = 0.0
+        self.spawn_seconds = 0.0
+        self.queries = 0
+        self.connections = 0
+        self.succeeded = False
+
+    @property
+    def milliseconds(self):
+        return int(round(self.seconds * 1000))
+
+    @property
+    def execution_seconds(self):
+        return max(0.0, self.seconds - self.spawn_seconds)
+
+    def to_dict(self):
+        return {
+            'schema': self.schema,
+            'version': self.version,
+            'script': self.script,
+            'started': self.started,
+            'seconds': round(self.seconds, 4),
+            'spawn_seconds': round(self.spawn_seconds, 4),
+            'execution_seconds': round(self.execution_seconds, 4),
+            'queries': self.queries,
+            'connections': self.connections,
+            'succeeded': self.succeeded }
+
+
+class RunMetrics(object):
+    log = logging.getLogger('metrics.RunMetrics')
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__scripts = []
+        self.__overhead = ScriptMetrics(None, '', None)
+        self.__started = time.perf_counter()
+
+
+    @contextmanager
+    def script(self, schema, version, script):
+        record = ScriptMetrics(schema, version, script)
+        self.__local.current = record
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - started
+            self.__local.current = None
+            with self.__lock:
+                self.__scripts.append(record)
+
+
+    def count_query(self, count = 1):
+        with self.__lock:
+            self.__current().queries += count
+
+
+    def count_connection(self):
+        with self.__lock:
+            self.__current().connections += 1
+
+
+    def add_spawn_time(self, seconds):
+        with self.__lock:
+            self.__current().spawn_seconds += seconds
+
+
+    @property
+    def scripts(self):
+        with self.__lock:
+            return list(self.__scripts)
+
+
+    def summary(self):
+        scripts = self.scripts
+        with self.__lock:
+            overhead = self.__overhead.to_dict()
+        return {
+            'seconds': round(time.perf_counter() - self.__started, 4),
+            'scripts_applied': len([s for s in scripts if s.succeeded]),
+            'scripts_failed': len([s for s in scripts if not s.succeeded]),
+            'script_seconds': round(sum(s.seconds for s in scripts), 4),
+            'spawn_seconds': round(sum(s.spawn_seconds for s in scripts) + overhead['spawn_seconds'], 4),
+            'queries': sum(s.queries for s in scripts) + overhead['queries'],
+            'connections': sum(s.connections for s in scripts) + overhead['connections'],
+            'overhead': {'queries': overhead['queries'], 'connections': overhead['connections'], 'spawn_seconds': overhead['spawn_seconds']},
+            'scripts': [s.to_dict() for s in sorted(scripts, key = lambda s: s.seconds, reverse = True)] }
+
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.summary(), indent = 2))
+
+
+    def write_prometheus(self, path):
+        write_atomically(path, format_prometheus(self.summary()))
+
+
+    def __current(self):
+        return getattr(self.__local, 'current', None) or self.__overhead
+
+
+def write_atomically(path, text):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok = True)
+    temp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp, 'w') as f:
+        f.write(text)
+    os.replace(temp, path)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+PROMETHEUS_SCRIPT_METRICS = (
+    ('dbsync_script_duration_seconds', 'Wall time of each script run.', 'seconds'),
+    ('dbsync_script_spawn_seconds', 'Time spent starting sqlplus and logging in for each script.', 'spawn_seconds'),
+    ('dbsync_script_execution_seconds', 'Time spent running each script once sqlplus was ready.', 'execution_seconds'),
+    ('dbsync_script_queries', 'Queries sent to the database for each script.', 'queries'),
+    ('dbsync_script_connections', 'Connections opened for each script.', 'connections'),
+    ('dbsync_script_succeeded', '1 if the script was applied, 0 if it failed.', 'succeeded'))
+
+PROMETHEUS_RUN_METRICS = (
+    ('dbsync_run_duration_seconds', 'Wall time of the whole run.', 'seconds'),
+    ('dbsync_run_scripts_applied', 'Scripts applied by the run.', 'scripts_applied'),
+    ('dbsync_run_scripts_failed', 'Scripts that failed during the run.', 'scripts_failed'),
+    ('dbsync_run_spawn_seconds', 'Time spent starting sqlplus during the run.', 'spawn_seconds'),
+    ('dbsync_run_queries', 'Queries sent to the database during the run.', 'queries'),
+    ('dbsync_run_connections', 'Connections opened during the run.', 'connections'))
+
+
+def format_prometheus(summary):
+    lines = []
+    for name, help, key in PROMETHEUS_RUN_METRICS:
+        lines += ['# HELP {0} {1}'.format(name, help), '# TYPE {0} gauge'.format(name), '{0} {1}'.format(name, float(summary[key]))]
+
+    for name, help, key in (('dbsync_run_overhead_queries', 'Queries sent outside of any script.', 'queries'), ('dbsync_run_overhead_connections', 'Connections opened outside of any script.', 'connections')):
+        lines += ['# HELP {0} {1}'.format(name, help), '# TYPE {0} gauge'.format(name), '{0} {1}'.format(name, float(summary['overhead'][key]))]
+
+    for name, help, key in PROMETHEUS_SCRIPT_METRICS:
+        lines += ['# HELP {0} {1}'.format(name, help), '# TYPE {0} gauge'.format(name)]
+        for script in summary['scripts']:
+            labels = ','.join('{0}="{1}"'.format(label, escape_label(script[label])) for label in ('schema', 'version', 'script'))
+            lines.append('{0}{{{1}}} {2}'.format(name, labels, float(script[key])))
+
+    return '\n'.join(lines) + '\n'
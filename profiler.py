@@ -0,0 +1,103 @@
+import re
+import json
+import threading
+import logging
+
+from collections import namedtuple
+
+from sqlplusengine import SQL, PLSQL
+from metrics import write_atomically
+
+#------------------------------------------------------------------------------
+# StatementProfile
+#------------------------------------------------------------------------------
+# Collects the time taken by every statement run while profiling, with the
+# file and line the statement starts on and the rows it processed when that
+# is known. The native engine times each statement itself. Scripts run
+# through sqlplus are run with SET TIMING ON and the "Elapsed:" lines sqlplus
+# writes are matched, in order, to the statements the parser finds in the
+# script.
+#------------------------------------------------------------------------------
+DEFAULT_TOP = 20
+REPORT_TEXT_WIDTH = 60
+
+StatementTiming = namedtuple('StatementTiming', ['source', 'line', 'text', 'seconds', 'rows'])
+
+
+class StatementProfile(object):
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__timings = []
+
+
+    def record(self, statement, seconds, rows = None):
+        timing = StatementTiming(statement.source, statement.line, statement.text, seconds, rows)
+        with self.__lock:
+            self.__timings.append(timing)
+
+
+    @property
+    def timings(self):
+        with self.__lock:
+            return list(self.__timings)
+
+
+    def slowest(self, top = DEFAULT_TOP):
+        return sorted(self.timings, key = lambda t: t.seconds, reverse = True)[:top]
+
+
+    def format_report(self, top = DEFAULT_TOP):
+        timings = self.timings
+        slowest = self.slowest(top)
+        lines = ['slowest {0} of {1} statement(s), {2:.2f} seconds in all:'.format(len(slowest), len(timings), sum(t.seconds for t in timings))]
+        for t in slowest:
+            rows = '' if t.rows is None else '{0} row(s)'.format(t.rows)
+            lines.append('{0:9.3f}s  {1:>12}  "{2}" line {3}: {4}'.format(t.seconds, rows, t.source, t.line, summarise(t.text)))
+        return '\n'.join(lines)
+
+
+    def write_json(self, path):
+        timings = [t._asdict() for t in sorted(self.timings, key = lambda t: t.seconds, reverse = True)]
+        write_atomically(path, json.dumps({'statements': timings}, indent = 2))
+
+
+def summarise(text):
+    text = ' '.join(text.split())
+    return text if len(text) <= REPORT_TEXT_WIDTH else text[:REPORT_TEXT_WIDTH - 3] + '...'
+
+
+#------------------------------------------------------------------------------
+# SqlPlusTimingReader
+#------------------------------------------------------------------------------
+# Reads sqlplus output a line at a time. "N rows created." style feedback is
+# remembered until the next "Elapsed: hh:mi:ss.cc" line, which is put against
+# the next statement of the script.
+#------------------------------------------------------------------------------
+ELAPSED = re.compile(r'^\s*Elapsed:\s+(\d+):(\d+):(\d+(?:\.\d+)?)\s*$')
+ROWS = re.compile(r'^\s*(\d+|no) rows? \w+\.\s*$', re.IGNORECASE)
+
+
+class SqlPlusTimingReader(object):
+    log = logging.getLogger('profiler.SqlPlusTimingReader')
+
+    def __init__(self, statements, profile):
+        self.__statements = iter([s for s in statements if s.kind in (SQL, PLSQL)])
+        self.__profile = profile
+        self.__rows = None
+
+
+    def __call__(self, line):
+        match = ROWS.match(line)
+        if match:
+            self.__rows = 0 if match.group(1).lower() == 'no' else int(match.group(1))
+            return
+
+        match = ELAPSED.match(line)
+        if match:
+            hours, minutes, seconds = match.groups()
+            statement = next(self.__statements, None)
+            if statement:
+                self.__profile.record(statement, int(hours) * 3600 + int(minutes) * 60 + float(seconds), self.__rows)
+            else:
+                SqlPlusTimingReader.log.debug('more timings than statements, ignoring: {0}'.format(line.strip()))
+            self.__rows = None
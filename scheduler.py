@@ -0,0 +1,272 @@
+import os.path
+import time
+import logging
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#------------------------------------------------------------------------------
+# ScriptScheduler
+#------------------------------------------------------------------------------
+# Runs the scripts of a version. If none of the scripts declare dependencies
+# they are run one at a time in the order given, as they always have been.
+# Otherwise the declared dependencies form a graph and scripts whose
+# dependencies have all been applied are run at the same time, up to
+# maxParallel at once.
+#
+# A dependency is declared in the leading comments of a script:
+#   -- depends on: create tables.sql, load data.sql
+# An empty declaration marks a script as having no dependencies. Scripts are
+# referred to by file name and any name that is not waiting to be applied is
+# taken to be satisfied.
+#
+# When only some scripts of a version declare dependencies, those that do
+# not still run in order: each waits on the script before it and on the
+# undeclared script before that, so no two undeclared scripts ever run at
+# once. The one exception is an earlier script that itself depends, through
+# its declarations, on the undeclared one; that script is not waited on.
+#
+# As with running in order, no new scripts are started after the first
+# failure. Scripts that are already running are allowed to finish.
+#
+# Given a RetryPolicy, a script that fails because an object it needs is
+# locked by another session (see TRANSIENT_ERRORS) is run again, from its
+# start, after a backoff that doubles with every attempt. Scripts run in
+# order wait for it. In a graph the other ready scripts carry on while it
+# waits and only its dependents are held back. A script that fails in any
+# other way, or is still blocked after the last retry, fails the run.
+#------------------------------------------------------------------------------
+DEPENDS_ON_HEADER = '-- depends on:'
+DEFAULT_MAX_PARALLEL = 4
+DEFAULT_RETRY_BACKOFF_SECONDS = 5
+DEFAULT_MAX_BACKOFF_SECONDS = 60
+
+# ORA-00054 resource busy, ORA-00060 deadlock, ORA-04021 / ORA-04022 waiting
+# to lock a (dictionary) object, ORA-30006 resource busy with a wait timeout
+# and SQLite's "database is locked".
+TRANSIENT_ERRORS = ('ORA-00054', 'ORA-00060', 'ORA-04021', 'ORA-04022', 'ORA-30006', 'database is locked', 'database table is locked')
+
+RetryPolicy = namedtuple('RetryPolicy', ['retries', 'backoff_seconds', 'max_backoff_seconds'])
+
+
+class DependencyCycleException(Exception):
+    def __init__(self, scriptPaths):
+        super().__init__('dependency cycle between: {0}'.format(', '.join(scriptPaths)))
+        self.script_paths = scriptPaths
+
+
+def read_script_dependencies(path):
+    """Returns the file names a script declares it depends on or None if it
+        declares nothing"""
+
+    with open(path, errors='replace') as f:
+        return script_dependencies(f)
+
+
+def script_dependencies(lines):
+    """Returns the file names declared in the leading comments of a script's lines, or None"""
+
+    dependencies = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('--'):
+            break
+        if line.casefold().startswith(DEPENDS_ON_HEADER):
+            dependencies = (dependencies or []) + [d.strip() for d in line[len(DEPENDS_ON_HEADER):].split(',') if d.strip()]
+    return dependencies
+
+
+def lock_retry_policy(retries):
+    return RetryPolicy(retries, DEFAULT_RETRY_BACKOFF_SECONDS, DEFAULT_MAX_BACKOFF_SECONDS)
+
+
+def transient_error(ex):
+    """Returns the line of a script failure that shows it was blocked by a lock,
+        or None if it failed for any other reason"""
+
+    for line in list(getattr(ex, 'output', None) or []) + [str(ex)]:
+        if any(code in line for code in TRANSIENT_ERRORS):
+            return line.strip()
+    return None
+
+
+def retry_delay(retry, attempt):
+    """The seconds to wait before the given attempt (1 being the first retry)"""
+    return min(retry.backoff_seconds * 2 ** (attempt - 1), retry.max_backoff_seconds)
+
+
+class ScriptScheduler(object):
+    log = logging.getLogger('scheduler.ScriptScheduler')
+
+    def __init__(self, applyScript, getDependencies, maxParallel = DEFAULT_MAX_PARALLEL, retry = None):
+        self.__applyScript = applyScript
+        self.__getDependencies = getDependencies
+        self.__maxParallel = maxParallel
+        self.__retry = retry
+
+
+    def run(self, steps):
+        """Applies every step, returning False if a script failed"""
+
+        dependencies = OrderedDict((step.path, self.__getDependencies(step.path)) for step in steps)
+        if all(d is None for d in dependencies.values()):
+            return self.run_in_order(steps)
+
+        return self.run_graph(steps, self.__build_graph(steps, dependencies))
+
+
+    def order(self, steps):
+        """Returns the steps in an order that has every script after the scripts
+            it depends on, keeping the given order where it can"""
+
+        dependencies = OrderedDict((step.path, self.__getDependencies(step.path)) for step in steps)
+        if all(d is None for d in dependencies.values()):
+            return list(steps)
+
+        remaining = self.__build_graph(steps, dependencies)
+        byPath = dict((step.path, step) for step in steps)
+        ordered = []
+        while remaining:
+            free = [path for path, paths in remaining.items() if not paths]
+            for path in free:
+                del remaining[path]
+                ordered.append(byPath[path])
+            for paths in remaining.values():
+                paths.difference_update(free)
+        return ordered
+
+
+    def run_in_order(self, steps):
+        for step in steps:
+            attempt = 0
+            while True:
+                try:
+                    succeeded = self.__applyScript(step.path, step.version)
+                    break
+                except Exception as ex:
+                    if not self.__should_retry(step, ex, attempt):
+                        raise
+                    attempt += 1
+                    time.sleep(retry_delay(self.__retry, attempt))
+
+            if not succeeded:
+                return False
+        return True
+
+
+    def run_graph(self, steps, waitingOn):
+        dependents = dict((step.path, []) for step in steps)
+        for path, paths in waitingOn.items():
+            for p in paths:
+                dependents[p].append(path)
+
+        byPath = dict((step.path, step) for step in steps)
+        ready = [step for step in steps if not waitingOn[step.path]]
+        running = {}
+        delayed = []
+        attempts = {}
+        failed = False
+        error = None
+
+        with ThreadPoolExecutor(max_workers = self.__maxParallel) as executor:
+            while running or ((ready or delayed) and not failed):
+                due = [entry for entry in delayed if entry[0] <= time.monotonic()]
+                for entry in due:
+                    delayed.remove(entry)
+                    ready.append(entry[1])
+
+                while ready and not failed and len(running) < self.__maxParallel:
+                    step = ready.pop(0)
+                    ScriptScheduler.log.debug('starting "{0}" ({1} running).'.format(step.path, len(running)))
+                    running[executor.submit(self.__applyScript, step.path, step.version)] = step
+
+                timeout = max(0, min(entry[0] for entry in delayed) - time.monotonic()) if delayed and not failed else None
+                if not running:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(running, timeout = timeout, return_when = FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        succeeded = future.result()
+                    except Exception as ex:
+                        attempt = attempts.get(step.path, 0)
+                        if not failed and self.__should_retry(step, ex, attempt):
+                            attempts[step.path] = attempt + 1
+                            delayed.append((time.monotonic() + retry_delay(self.__retry, attempt + 1), step))
+                            continue
+                        succeeded = False
+                        error = error or ex
+
+                    if not succeeded:
+                        failed = True
+                        continue
+
+                    for path in dependents[step.path]:
+                        waitingOn[path].discard(step.path)
+                        if not waitingOn[path]:
+                            ready.append(byPath[path])
+
+        if error:
+            raise error
+        return not failed
+
+
+    def __should_retry(self, step, ex, attempt):
+        if not self.__retry or attempt >= self.__retry.retries:
+            return False
+        blockedBy = transient_error(ex)
+        if not blockedBy:
+            return False
+        ScriptScheduler.log.warning('"{0}" was blocked ({1}), it will be run again in {2}s (retry {3} of {4}).'.format(step.path, blockedBy, retry_delay(self.__retry, attempt + 1), attempt + 1, self.__retry.retries))
+        return True
+
+
+    def __build_graph(self, steps, dependencies):
+        """Returns, for each script, the set of pending scripts it is waiting on"""
+
+        pathsByName = dict((os.path.basename(step.path), step.path) for step in steps)
+        waitingOn = OrderedDict()
+        for path, names in dependencies.items():
+            waitingOn[path] = set(pathsByName[n] for n in names or [] if n in pathsByName and pathsByName[n] != path)
+
+        previous, previousUndeclared = None, None
+        for path, names in dependencies.items():
+            if names is None:
+                for earlier in set([previous, previousUndeclared]) - {None}:
+                    if not self.__waits_on(waitingOn, earlier, path):
+                        waitingOn[path].add(earlier)
+                previousUndeclared = path
+            previous = path
+
+        self.__check_for_cycles(waitingOn)
+        return waitingOn
+
+
+    def __waits_on(self, waitingOn, path, other):
+        """Whether path waits on other, directly or through the scripts it waits on"""
+
+        seen, pending = set(), [path]
+        while pending:
+            current = pending.pop()
+            if current == other:
+                return True
+            if not current in seen:
+                seen.add(current)
+                pending.extend(waitingOn.get(current, ()))
+        return False
+
+
+    def __check_for_cycles(self, waitingOn):
+        remaining = dict((path, set(paths)) for path, paths in waitingOn.items())
+        while remaining:
+            free = [path for path, paths in remaining.items() if not paths]
+            if not free:
+                raise DependencyCycleException(sorted(remaining))
+            for path in free:
+                del remaining[path]
+            for paths in remaining.values():
+                paths.difference_update(free)
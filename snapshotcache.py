@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import shlex
+import shutil
+import hashlib
+import importlib
+import subprocess
+import logging
+
+import drivers
+import checksums
+
+from manifestcache import CACHE_FOLDER
+
+#------------------------------------------------------------------------------
+# Schema snapshots
+#------------------------------------------------------------------------------
+# A snapshot is the state of a schema after a sync, saved by an exporter so
+# a later reset can restore it instead of running every script again. It is
+# keyed by a hash of everything that made that state: the exporter, the
+# schema, create.user.sql, the baseline scripts and each applied script of
+# every version up to the version synced to, with their checksums. Changing
+# any of those scripts changes the key, so an out of date snapshot is never
+# restored.
+#
+# Snapshots are kept in a folder each under the cache folder, with a
+# snapshot.json describing it. Once the snapshots take up more than the most
+# bytes allowed the least recently used are removed.
+#
+# An exporter saves a schema to files in a folder and loads them back into
+# a schema that create.user.sql has just created. Each driver has a default
+# one, and any driver can be given an export and import command instead.
+#------------------------------------------------------------------------------
+SNAPSHOT_FOLDER = os.path.join(CACHE_FOLDER, 'snapshots')
+SNAPSHOT_FILE = 'snapshot.json'
+SNAPSHOT_FORMAT = 1
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+EXPORTERS = {
+    drivers.ORACLE: ('snapshotcache', 'OracleExporter'),
+    drivers.SQLITE: ('sqlitedriver', 'SqliteExporter') }
+
+
+class SnapshotException(Exception):
+    pass
+
+
+def register_exporter(driver, module, className):
+    EXPORTERS[driver] = (module, className)
+
+
+def exporter_for(driver, sqlRunner, target, exportCommand = None, importCommand = None):
+    """Returns the exporter of a driver, or one running the commands given"""
+
+    if exportCommand or importCommand:
+        if not (exportCommand and importCommand):
+            raise SnapshotException('both an export and an import command are needed.')
+        return CommandExporter(sqlRunner, target, exportCommand, importCommand)
+
+    if not driver in EXPORTERS:
+        raise SnapshotException('there is no snapshot exporter for driver "{0}".'.format(driver))
+    module, className = EXPORTERS[driver]
+    return getattr(importlib.import_module(module), className)(sqlRunner, target)
+
+
+def snapshot_keys(exporterName, schema, baseScripts, steps, hashScript = checksums.hash_file):
+    """Returns (version, key) of the state after create.user.sql and the
+        baseline (version None) and after each version of the planned steps"""
+
+    digest = hashlib.sha1('{0}\n{1}\n'.format(exporterName, schema.lower()).encode('utf-8'))
+    for path in baseScripts:
+        digest.update('{0} {1}\n'.format(os.path.basename(path), hashScript(path)).encode('utf-8'))
+
+    keys = [(None, digest.hexdigest())]
+    for step in steps:
+        digest.update('[{0}] {1} {2}\n'.format(step.version, os.path.basename(step.path), hashScript(step.path)).encode('utf-8'))
+        if keys[-1][0] == step.version:
+            keys[-1] = (step.version, digest.hexdigest())
+        else:
+            keys.append((step.version, digest.hexdigest()))
+    return keys
+
+
+#------------------------------------------------------------------------------
+# SnapshotCache
+#------------------------------------------------------------------------------
+class SnapshotCache(object):
+    log = logging.getLogger('snapshotcache.SnapshotCache')
+
+    def __init__(self, folder = SNAPSHOT_FOLDER, maxBytes = DEFAULT_MAX_BYTES):
+        self.__folder = folder
+        self.__maxBytes = maxBytes
+
+
+    def contains(self, key):
+        return os.path.isfile(os.path.join(self.__folder, key, SNAPSHOT_FILE))
+
+
+    def restore(self, key, importSchema):
+        """Calls importSchema with the folder of a snapshot"""
+
+        folder = os.path.join(self.__folder, key)
+        info = self.__read_info(folder)
+        SnapshotCache.log.info('restoring snapshot of "{0}" at version {1}.'.format(info.get('schema'), info.get('version')))
+        importSchema(folder)
+        info['last_used'] = time.time()
+        self.__write_info(folder, info)
+
+
+    def capture(self, key, exportSchema, schema, version):
+        """Calls exportSchema with a new folder and keeps it as the snapshot key"""
+
+        if self.contains(key):
+            return
+        os.makedirs(self.__folder, exist_ok = True)
+        temp = os.path.join(self.__folder, '{0}.{1}.tmp'.format(key, os.getpid()))
+        os.makedirs(temp)
+        try:
+            exportSchema(temp)
+            now = time.time()
+            self.__write_info(temp, {'format': SNAPSHOT_FORMAT, 'schema': schema, 'version': version, 'created': now, 'last_used': now})
+            os.replace(temp, os.path.join(self.__folder, key))
+        except Exception:
+            shutil.rmtree(temp, ignore_errors = True)
+            raise
+        SnapshotCache.log.info('saved snapshot of "{0}" at version {1}.'.format(schema, version))
+        self.evict()
+
+
+    def evict(self):
+        """Removes the least recently used snapshots until the rest fit in the most bytes allowed"""
+
+        snapshots = sorted(self.list(), key = lambda s: s['last_used'])
+        total = sum(s['bytes'] for s in snapshots)
+        while snapshots and total > self.__maxBytes:
+            oldest = snapshots.pop(0)
+            SnapshotCache.log.info('removing snapshot of "{0}" at version {1} ({2} bytes) to stay under {3} bytes.'.format(oldest['schema'], oldest['version'], oldest['bytes'], self.__maxBytes))
+            shutil.rmtree(os.path.join(self.__folder, oldest['key']), ignore_errors = True)
+            total -= oldest['bytes']
+
+
+    def list(self):
+        """Returns a dict of key, schema, version, last_used and bytes for every snapshot"""
+
+        if not os.path.isdir(self.__folder):
+            return []
+        snapshots = []
+        for key in os.listdir(self.__folder):
+            folder = os.path.join(self.__folder, key)
+            if not self.contains(key):
+                continue
+            info = self.__read_info(folder)
+            size = sum(os.path.getsize(os.path.join(path, f)) for path, folders, files in os.walk(folder) for f in files)
+            snapshots.append({'key': key, 'schema': info.get('schema'), 'version': info.get('version'), 'last_used': info.get('last_used', 0), 'bytes': size})
+        return snapshots
+
+
+    def clear(self):
+        for snapshot in self.list():
+            shutil.rmtree(os.path.join(self.__folder, snapshot['key']), ignore_errors = True)
+
+
+    def __read_info(self, folder):
+        try:
+            with open(os.path.join(folder, SNAPSHOT_FILE)) as f:
+                return json.load(f)
+        except ValueError:
+            SnapshotCache.log.warning('unreadable snapshot "{0}".'.format(folder))
+            return {}
+
+
+    def __write_info(self, folder, info):
+        temp = os.path.join(folder, '{0}.{1}.tmp'.format(SNAPSHOT_FILE, os.getpid()))
+        with open(temp, 'w') as f:
+            json.dump(info, f)
+        os.replace(temp, os.path.join(folder, SNAPSHOT_FILE))
+
+
+#------------------------------------------------------------------------------
+# CommandExporter
+#------------------------------------------------------------------------------
+# Exports and imports a schema by running a command for each. The commands
+# are split as a shell would split them and each part formatted with:
+#   {connect}  user/password@host of the target
+#   {user}, {password}, {host}
+#   {schema}   the schema
+#   {file}     <schema>.dmp in the snapshot's folder
+#   {folder}   the snapshot's folder
+# OracleExporter uses the exp and imp clients that come with Oracle.
+#------------------------------------------------------------------------------
+class CommandExporter(object):
+    log = logging.getLogger('snapshotcache.CommandExporter')
+
+    def __init__(self, sqlRunner, target, exportCommand, importCommand):
+        self.__target = target
+        self.__exportCommand = exportCommand
+        self.__importCommand = importCommand
+        self.name = 'command:{0}|{1}'.format(exportCommand, importCommand)
+
+
+    def export_schema(self, schema, folder):
+        self.__run(self.__exportCommand, schema, folder)
+
+
+    def import_schema(self, schema, folder):
+        self.__run(self.__importCommand, schema, folder)
+
+
+    def __run(self, command, schema, folder):
+        values = {
+            'connect': '{0}/{1}@{2}'.format(*self.__target),
+            'user': self.__target.username,
+            'password': self.__target.password,
+            'host': self.__target.host,
+            'schema': schema,
+            'file': os.path.join(folder, schema.lower() + '.dmp'),
+            'folder': folder }
+        args = [part.format(**values) for part in shlex.split(command, posix = os.name != 'nt')]
+        CommandExporter.log.debug('running: {0}'.format(shlex.split(command)[0]))
+
+        process = subprocess.run(args, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        if process.returncode != 0:
+            CommandExporter.log.info(process.stdout)
+            raise SnapshotException('"{0}" failed with exit code {1}.'.format(args[0], process.returncode))
+
+
+class OracleExporter(CommandExporter):
+    EXPORT_COMMAND = 'exp userid={connect} owner={schema} file={file} statistics=none'
+    IMPORT_COMMAND = 'imp userid={connect} fromuser={schema} touser={schema} file={file} ignore=y'
+
+    def __init__(self, sqlRunner, target):
+        super().__init__(sqlRunner, target, OracleExporter.EXPORT_COMMAND, OracleExporter.IMPORT_COMMAND)
+        self.name = 'oracle'
@@ -0,0 +1,505 @@
+import os
+import re
+import sqlite3
+import itertools
+import threading
+import logging
+import urllib.request
+
+from contextlib import contextmanager
+
+from drivers import Dialect
+from metrics import RunMetrics
+from sqlplusengine import NativeScriptEngine, parse_script, read_script
+from sqlplusscriptrunner import ScriptFailedException, PooledConnection, batch_location, DEFAULT_POOL_SIZE, SQLPLUS_ENGINE, DEFAULT_OUTPUT
+
+#------------------------------------------------------------------------------
+# SQLite driver
+#------------------------------------------------------------------------------
+# Runs syncs against SQLite, for checking a tree of scripts locally or in CI
+# without an Oracle database. The host of the target is a folder holding a
+# <schema>.sqlite file for each schema or ":memory:" to keep every schema in
+# memory for the life of the run.
+#
+# Each schema is a database of its own, so the tables a script creates go in
+# the schema it is run in. Scripts are parsed and run statement by statement
+# as the native engine runs them. The schema statements of create.user.sql
+# scripts are run by the driver: "create user" creates the schema, "drop
+# user" drops it and "alter session set current_schema" changes the schema
+# later statements run in. Grants and other user statements are ignored.
+#
+# Queries run outside of any schema (those asking after a schema by its
+# :owner bind) run with that schema attached under its own name.
+#------------------------------------------------------------------------------
+MEMORY = ':memory:'
+SCHEMA_FILE_EXTENSION = '.sqlite'
+DEFAULT_BUSY_TIMEOUT = 5.0
+
+SQLITE_DIALECT = Dialect(
+    schema_state = """
+        select 'user', upper(name), null
+        from pragma_database_list
+        where name = lower(:owner)
+        union all
+        select 'column', upper(name), null
+        from pragma_table_info('version_tracking', (select coalesce(max(name), 'temp') from pragma_database_list where name = lower(:owner)))
+    """,
+    applied_scripts = """
+        select version, script
+        from version_tracking
+    """,
+    applied_scripts_with_ids = """
+        select id, version, script
+        from version_tracking
+    """,
+    applied_scripts_since = """
+        select id, version, script
+        from version_tracking
+        where id > :watermark
+        union all
+        select -1, cast(count(*) as text), cast(max(id) as text)
+        from version_tracking
+        where id <= :watermark
+    """,
+    tracked_checksums = """
+        select version, script, checksum
+        from version_tracking
+    """,
+    create_tracking_table = ("""
+        create table version_tracking (
+            id          integer primary key autoincrement,
+            version     text    not null,
+            script      text    not null,
+            applied_on  text    default current_timestamp not null,
+            checksum    text,
+            duration_ms integer)
+    """,),
+    insert_script_info = """
+        insert into version_tracking (version, script, checksum, duration_ms)
+        values (:version, :script, :checksum, :duration_ms)
+    """,
+    tracking_table_columns = (
+        ('CHECKSUM', 'text'),
+        ('DURATION_MS', 'integer'),
+    ),
+    add_tracking_column = 'alter table version_tracking add column {0} {1}',
+    alter_sequence_cache = None,
+    checkpoint_table = """
+        select name
+        from pragma_table_info('version_checkpoints', (select coalesce(max(name), 'temp') from pragma_database_list where name = lower(:owner)))
+    """,
+    create_checkpoint_table = ("""
+        create table version_checkpoints (
+            script          text    not null,
+            statement_no    integer not null,
+            statement_hash  text    not null,
+            script_checksum text    not null,
+            completed_on    text    default current_timestamp not null,
+            primary key (script, statement_no))
+    """,),
+    checkpoints = """
+        select statement_no, statement_hash, script_checksum
+        from version_checkpoints
+        where script = :script
+        order by statement_no
+    """,
+    insert_checkpoint = """
+        insert into version_checkpoints (script, statement_no, statement_hash, script_checksum)
+        values (:script, :statement_no, :statement_hash, :script_checksum)
+    """,
+    delete_checkpoints = """
+        delete from version_checkpoints
+        where script = :script
+    """)
+
+CREATE_USER = re.compile(r'^create\s+user\s+"?(\w+)"?', re.IGNORECASE)
+DROP_USER = re.compile(r'^drop\s+user\s+"?(\w+)"?', re.IGNORECASE)
+SET_CURRENT_SCHEMA = re.compile(r'^alter\s+session\s+set\s+current_schema\s*=\s*"?(\w+)"?', re.IGNORECASE)
+IGNORED = re.compile(r'^(grant|revoke|alter\s+user)\b', re.IGNORECASE)
+
+memoryDatabaseIds = itertools.count(1)
+
+
+#------------------------------------------------------------------------------
+# SqliteDatabase
+#------------------------------------------------------------------------------
+# The schemas of one target, with a connection open to each. A runner and
+# its clones share it, taking its lock for each use, and it is closed with
+# the runner that created it. busyTimeout is how long a statement waits for
+# another process to let go of a schema it has locked.
+#------------------------------------------------------------------------------
+class SqliteDatabase(object):
+    log = logging.getLogger('sqlitedriver.SqliteDatabase')
+
+    def __init__(self, location = MEMORY, metrics = None, busyTimeout = None):
+        self.__location = location
+        self.__metrics = metrics
+        self.__busyTimeout = DEFAULT_BUSY_TIMEOUT if busyTimeout is None else busyTimeout
+        self.__memoryId = next(memoryDatabaseIds)
+        self.__connections = {}
+        self.__memorySchemas = set()
+        self.__hub = None
+        self.lock = threading.RLock()
+
+
+    @property
+    def location(self):
+        return self.__location
+
+
+    def schema_exists(self, schema):
+        if self.__location == MEMORY:
+            return schema.lower() in self.__memorySchemas
+        return os.path.isfile(self.__path_of(schema))
+
+
+    def connection(self, schema = None):
+        """The connection to a schema, or the connection used outside of any schema"""
+
+        if schema is None:
+            if not self.__hub:
+                self.__hub = self.__connect('file::memory:')
+            return self.__hub
+
+        key = schema.lower()
+        if not key in self.__connections:
+            if not self.schema_exists(key):
+                raise sqlite3.OperationalError('schema "{0}" does not exist.'.format(schema))
+            self.__connections[key] = self.__connect(self.__uri_of(key))
+        return self.__connections[key]
+
+
+    def create_schema(self, schema):
+        if self.schema_exists(schema):
+            raise sqlite3.OperationalError('schema "{0}" already exists.'.format(schema))
+        if self.__location != MEMORY:
+            os.makedirs(self.__location, exist_ok = True)
+        key = schema.lower()
+        self.__connections[key] = self.__connect(self.__uri_of(key))
+        self.__memorySchemas.add(key)
+        SqliteDatabase.log.info('schema "{0}" created in {1}.'.format(key, self.__location))
+
+
+    def drop_schema(self, schema):
+        key = schema.lower()
+        if not self.schema_exists(key):
+            raise sqlite3.OperationalError('schema "{0}" does not exist.'.format(schema))
+        connection = self.__connections.pop(key, None)
+        if connection:
+            connection.close()
+        self.__memorySchemas.discard(key)
+        if self.__location != MEMORY:
+            os.remove(self.__path_of(key))
+        SqliteDatabase.log.info('schema "{0}" dropped.'.format(key))
+
+
+    @contextmanager
+    def attached(self, schema):
+        """Attaches schema, if it exists, to the connection used outside of any schema"""
+
+        if not schema or not self.schema_exists(schema):
+            yield
+            return
+
+        key = schema.lower()
+        self.connection().execute('attach database ? as "{0}"'.format(key), (self.__uri_of(key),))
+        try:
+            yield
+        finally:
+            self.connection().execute('detach database "{0}"'.format(key))
+
+
+    def backup(self, schema, path):
+        """Copies a schema to the database file at path"""
+        with self.lock:
+            copy = sqlite3.connect(path)
+            try:
+                self.connection(schema).backup(copy)
+            finally:
+                copy.close()
+
+
+    def restore(self, schema, path):
+        """Replaces the contents of a schema with the database file at path"""
+        with self.lock:
+            copy = sqlite3.connect(path)
+            try:
+                copy.backup(self.connection(schema))
+            finally:
+                copy.close()
+
+
+    def close(self):
+        with self.lock:
+            connections = list(self.__connections.values()) + ([self.__hub] if self.__hub else [])
+            self.__connections, self.__hub = {}, None
+            self.__memorySchemas = set()
+        for connection in connections:
+            connection.close()
+
+
+    def __connect(self, uri):
+        if self.__metrics:
+            self.__metrics.count_connection()
+        return sqlite3.connect(uri, uri = True, check_same_thread = False, timeout = self.__busyTimeout)
+
+
+    def __path_of(self, schema):
+        return os.path.join(self.__location, schema.lower() + SCHEMA_FILE_EXTENSION)
+
+
+    def __uri_of(self, schema):
+        if self.__location == MEMORY:
+            return 'file:dbsync{0}_{1}?mode=memory&cache=shared'.format(self.__memoryId, schema)
+        return 'file:' + urllib.request.pathname2url(os.path.abspath(self.__path_of(schema)))
+
+
+#------------------------------------------------------------------------------
+# SqliteConnection and SqliteCursor
+#------------------------------------------------------------------------------
+# Look enough like cx_Oracle's for the runner and the native engine. A
+# connection starts in the schema it was asked for and moves when a script
+# sets the current schema, committing or rolling back every schema it ran
+# statements in.
+#------------------------------------------------------------------------------
+class SqliteConnection(object):
+    def __init__(self, database, schema = None):
+        self.database = database
+        self.current_schema = schema
+        self.__used = []
+
+    def cursor(self):
+        return SqliteCursor(self)
+
+    def native(self):
+        connection = self.database.connection(self.current_schema)
+        if not connection in self.__used:
+            self.__used.append(connection)
+        return connection
+
+    def commit(self):
+        for connection in self.__used:
+            connection.commit()
+
+    def rollback(self):
+        for connection in self.__used:
+            connection.rollback()
+
+
+class SqliteCursor(object):
+    log = logging.getLogger('sqlitedriver.SqliteCursor')
+
+    def __init__(self, connection):
+        self.__connection = connection
+        self.__rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, args = {}):
+        self.__rows, self.rowcount = [], 0
+        if self.__run_schema_statement(' '.join(sql.split())):
+            return self
+
+        owner = args.get('owner') if self.__connection.current_schema is None and isinstance(args, dict) else None
+        native = self.__connection.native()
+        with self.__connection.database.attached(owner):
+            cursor = native.execute(sql, args)
+            self.__rows = cursor.fetchall() if cursor.description else []
+            self.rowcount = cursor.rowcount
+        return self
+
+    def executemany(self, sql, rows):
+        self.rowcount = self.__connection.native().executemany(sql, rows).rowcount
+
+    def fetchall(self):
+        rows, self.__rows = self.__rows, []
+        return rows
+
+    def close(self):
+        pass
+
+    def __run_schema_statement(self, statement):
+        match = CREATE_USER.match(statement)
+        if match:
+            self.__connection.database.create_schema(match.group(1))
+            return True
+
+        match = DROP_USER.match(statement)
+        if match:
+            self.__connection.database.drop_schema(match.group(1))
+            return True
+
+        match = SET_CURRENT_SCHEMA.match(statement)
+        if match:
+            self.__connection.current_schema = match.group(1)
+            return True
+
+        if IGNORED.match(statement):
+            SqliteCursor.log.debug('ignoring: {0}'.format(statement))
+            return True
+
+        return False
+
+
+#------------------------------------------------------------------------------
+# SqlitePool
+#------------------------------------------------------------------------------
+# Hands out connections of a database one at a time, as ConnectionPool does
+# for Oracle, so the native engine can run scripts on them.
+#------------------------------------------------------------------------------
+class SqlitePool(object):
+    def __init__(self, database):
+        self.__database = database
+
+    @contextmanager
+    def connection(self, schema = None):
+        pooled = self.acquire(schema)
+        try:
+            yield pooled.connection
+        except Exception:
+            self.release(pooled, rollback = True)
+            raise
+        else:
+            self.release(pooled)
+
+    def acquire(self, schema = None):
+        self.__database.lock.acquire()
+        return PooledConnection(SqliteConnection(self.__database, schema))
+
+    def release(self, pooled, rollback = False):
+        try:
+            if rollback:
+                pooled.connection.rollback()
+        finally:
+            self.__database.lock.release()
+
+
+#------------------------------------------------------------------------------
+# SqliteSqlRunner
+#------------------------------------------------------------------------------
+# Takes the same arguments as OracleSqlRunner, the host being where the
+# schemas are kept. The sqlplus command, pool size and engine are ignored and
+# the ddl lock timeout is used as SQLite's busy timeout.
+#------------------------------------------------------------------------------
+class SqliteSqlRunner(object):
+    log = logging.getLogger('sqlitedriver.SqliteSqlRunner')
+
+    dialect = SQLITE_DIALECT
+
+    def __init__(self, username, password, host = MEMORY, sqlplusCommand = None, poolSize = DEFAULT_POOL_SIZE, engine = SQLPLUS_ENGINE, output = DEFAULT_OUTPUT, metrics = None, profile = None, ddlLockTimeout = None, database = None):
+        self.__args = (username, password, host, sqlplusCommand, poolSize, engine, output)
+        self.__ddlLockTimeout = ddlLockTimeout
+        self.__metrics = metrics or RunMetrics()
+        self.__profile = profile
+        self.__ownsDatabase = database is None
+        self.__database = database or SqliteDatabase(host or MEMORY, self.__metrics, ddlLockTimeout)
+        self.__pool = SqlitePool(self.__database)
+        self.__engine = NativeScriptEngine(self.__pool, sqlite3.Error, ScriptFailedException, metrics = self.__metrics, profile = profile)
+
+    def clone(self):
+        """Returns a runner for the same database, sharing its schemas."""
+        return SqliteSqlRunner(*self.__args, metrics = self.__metrics, profile = self.__profile, ddlLockTimeout = self.__ddlLockTimeout, database = self.__database)
+
+    def for_target(self, username, password, host):
+        """Returns a runner like this one for another database, sharing its metrics and profile."""
+        return SqliteSqlRunner(username, password, host, *self.__args[3:], metrics = self.__metrics, profile = self.__profile, ddlLockTimeout = self.__ddlLockTimeout)
+
+    @property
+    def target(self):
+        return 'sqlite:{0}'.format(self.__database.location)
+
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    @property
+    def pool_stats(self):
+        """None, as each schema keeps one connection open rather than pooling them.
+            The connections opened are counted by the run's metrics."""
+        return None
+
+    def run_sql_script(self, filename, schema = None):
+        SqliteSqlRunner.log.info('executing file: "{0}".'.format(filename))
+        return self.__engine.run_sql_script(filename, schema)
+
+    def run_sql_text(self, name, text, schema = None, readScript = read_script):
+        SqliteSqlRunner.log.info('executing: "{0}".'.format(name))
+        return self.__engine.run_statements(name, parse_script(text, name, readScript), schema)
+
+    def run_sql_statements(self, name, statements, schema = None, checkpoint = None):
+        SqliteSqlRunner.log.info('executing: "{0}"{1}.'.format(name, ' from statement {0}'.format(checkpoint.completed + 1) if checkpoint and checkpoint.completed else ''))
+        return self.__engine.run_statements(name, statements, schema, checkpoint)
+
+    def open_session(self):
+        pass
+
+    def close_session(self):
+        pass
+
+    def run_sql_command(self, sql, schema = None, args = {}):
+        with self.__pool.connection(schema) as cnn:
+            cursor = cnn.cursor()
+            for cmd in ([sql] if isinstance(sql, str) else sql):
+                SqliteSqlRunner.log.debug('Running command on schema {0}: {1}'.format(schema, cmd))
+                self.__metrics.count_query()
+                cursor.execute(cmd, args)
+            cnn.commit()
+
+    def run_sql_many(self, sql, schema = None, rows = []):
+        with self.__pool.connection(schema) as cnn:
+            self.__metrics.count_query()
+            cnn.cursor().executemany(sql, rows)
+            cnn.commit()
+
+    def run_sql_batches(self, filename, sql, schema = None, batches = [], commitEachBatch = False):
+        rows, batch = 0, []
+        try:
+            with self.__pool.connection(schema) as cnn:
+                cursor = cnn.cursor()
+                for batch in batches:
+                    self.__metrics.count_query()
+                    cursor.executemany(sql, batch)
+                    rows += len(batch)
+                    if commitEachBatch:
+                        cnn.commit()
+                cnn.commit()
+        except sqlite3.Error as ex:
+            location = batch_location(filename, rows, batch)
+            SqliteSqlRunner.log.error('{0}: {1}'.format(location, ex))
+            raise ScriptFailedException(filename, 1, location, output = [str(ex)])
+        return rows
+
+    def get_all_data_for(self, sqlScript, schema = None, args = {}):
+        with self.__pool.connection(schema) as cnn:
+            self.__metrics.count_query()
+            return cnn.cursor().execute(sqlScript, args).fetchall()
+
+    def drop_schema(self, schema):
+        self.run_sql_command('drop user {0} cascade'.format(schema))
+
+    def export_schema(self, schema, path):
+        self.__database.backup(schema, path)
+
+    def import_schema(self, schema, path):
+        self.__database.restore(schema, path)
+
+    def close(self):
+        if self.__ownsDatabase:
+            self.__database.close()
+
+
+#------------------------------------------------------------------------------
+# SqliteExporter
+#------------------------------------------------------------------------------
+# Snapshots a schema with SQLite's backup api, as a copy of its database.
+#------------------------------------------------------------------------------
+class SqliteExporter(object):
+    name = 'sqlite'
+
+    def __init__(self, sqlRunner, target):
+        self.__sqlRunner = sqlRunner
+
+    def export_schema(self, schema, folder):
+        self.__sqlRunner.export_schema(schema, os.path.join(folder, schema.lower() + SCHEMA_FILE_EXTENSION))
+
+    def import_schema(self, schema, folder):
+        self.__sqlRunner.import_schema(schema, os.path.join(folder, schema.lower() + SCHEMA_FILE_EXTENSION))
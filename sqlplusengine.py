@@ -0,0 +1,389 @@
+import os.path
+import re
+import time
+import logging
+
+from collections import namedtuple
+
+#------------------------------------------------------------------------------
+# SQL*Plus script parser
+#------------------------------------------------------------------------------
+# Splits a SQL*Plus style script into the statements and commands sqlplus
+# would run, following the same rules sqlplus does:
+#   - a SQL statement ends with a ";" at the end of a line or a "/" on a line
+#     of its own. A blank line ends the statement without running it, a "/"
+#     after the blank line runs it.
+#   - a PL/SQL block (declare, begin, create function/procedure/package/
+#     trigger/type...) ends with a "/" on a line of its own.
+#   - a "/" with no statement being entered runs the last statement again.
+#   - @file and @@file (relative to the including script) are read in place.
+#   - PROMPT, SET, WHENEVER, EXEC and EXIT are understood, other sqlplus
+#     commands (SPOOL, DEFINE, COLUMN...) are ignored.
+#   - ";" inside quotes, q'[...]' literals, quoted identifiers and comments
+#     does not end a statement.
+# Every statement remembers the file and line it started on.
+#------------------------------------------------------------------------------
+SQL = 'sql'
+PLSQL = 'plsql'
+PROMPT = 'prompt'
+SET = 'set'
+WHENEVER = 'whenever'
+EXIT = 'exit'
+IGNORED = 'ignored'
+
+Statement = namedtuple('Statement', ['kind', 'text', 'source', 'line'])
+
+MAX_INCLUDE_DEPTH = 20
+
+PLSQL_START = re.compile(r'^(declare|begin|create\s+(or\s+replace\s+)?((editionable|noneditionable)\s+)?(function|procedure|package|trigger|type|library|java))\b', re.IGNORECASE)
+SQL_SET_COMMANDS = ('transaction', 'role', 'constraint', 'constraints')
+QUOTE_DELIMITERS = {'[': ']', '{': '}', '(': ')', '<': '>'}
+
+
+class ScriptParseException(Exception):
+    def __init__(self, message, source, line):
+        super().__init__('{0} ("{1}" line {2})'.format(message, source, line))
+        self.source = source
+        self.line = line
+
+
+def read_script(path):
+    with open(path, errors='replace') as f:
+        return f.read()
+
+
+def parse_file(path, readScript = read_script):
+    return parse_script(readScript(path), path, readScript)
+
+
+def parse_script(text, source = '<script>', readScript = read_script):
+    return list(ScriptParser(readScript).parse(text, source))
+
+
+def is_command(word, command, shortest):
+    """sqlplus accepts any abbreviation of a command down to its shortest form"""
+    return len(word) >= shortest and command.startswith(word)
+
+
+def scan_line(line, state):
+    """Scans a line of SQL for quotes and comments.
+
+        state is None outside of quotes or the text that closes the quote or
+        comment being scanned. Returns the state at the end of the line and the
+        index of the last character of the line that is not whitespace or
+        comment, or -1."""
+
+    lastCode = -1
+    i, n = 0, len(line)
+    while i < n:
+        if state:
+            end = line.find(state, i)
+            if end < 0:
+                if state != '*/':
+                    lastCode = n - 1
+                break
+            i = end + len(state)
+            if state != '*/':
+                lastCode = i - 1
+            state = None
+            continue
+
+        c = line[i]
+        if line.startswith('--', i):
+            break
+        if line.startswith('/*', i):
+            state, i = '*/', i + 2
+            continue
+        if c in 'qQ' and line[i + 1:i + 2] == "'" or c in 'nN' and line[i + 1:i + 3].lower() == "q'":
+            quote = line.index("'", i)
+            if quote + 1 < n and (i == 0 or not (line[i - 1].isalnum() or line[i - 1] == '_')):
+                delimiter = line[quote + 1]
+                state = QUOTE_DELIMITERS.get(delimiter, delimiter) + "'"
+                lastCode, i = quote + 1, quote + 2
+                continue
+        if c == "'":
+            state, i, lastCode = "'", i + 1, i
+            continue
+        if c == '"':
+            state, i, lastCode = '"', i + 1, i
+            continue
+        if not c.isspace():
+            lastCode = i
+        i += 1
+
+    return state, lastCode
+
+
+class ScriptParser(object):
+    log = logging.getLogger('sqlplusengine.ScriptParser')
+
+    def __init__(self, readScript = read_script):
+        self.__readScript = readScript
+        self.__lastStatement = None
+        self.__sqlBlankLines = False
+
+
+    def parse(self, text, source, depth = 0):
+        lines = text.splitlines()
+        buffer = []
+        bufferKind = None
+        bufferLine = 0
+        state = None
+        pending = None
+        i = 0
+
+        while i < len(lines):
+            line = lines[i]
+            stripped = line.strip()
+            i += 1
+
+            if bufferKind:
+                if state is None and stripped == '/':
+                    yield self.__statement(bufferKind, '\n'.join(buffer), source, bufferLine)
+                    buffer, bufferKind = [], None
+                elif state is None and stripped == '.':
+                    pending = Statement(bufferKind, '\n'.join(buffer), source, bufferLine)
+                    buffer, bufferKind = [], None
+                elif bufferKind == SQL and state is None and not stripped and not self.__sqlBlankLines:
+                    pending = Statement(bufferKind, '\n'.join(buffer), source, bufferLine)
+                    buffer, bufferKind = [], None
+                else:
+                    state, lastCode = scan_line(line, state)
+                    if bufferKind == SQL and state is None and lastCode >= 0 and line[lastCode] == ';':
+                        buffer.append(line[:lastCode])
+                        yield self.__statement(SQL, '\n'.join(buffer).rstrip(), source, bufferLine)
+                        buffer, bufferKind = [], None
+                    else:
+                        buffer.append(line)
+                continue
+
+            if not stripped:
+                continue
+
+            if state == '*/' or stripped.startswith('/*'):
+                state, lastCode = scan_line(line, state)
+                if state is None and lastCode >= 0:
+                    ScriptParser.log.debug('ignoring text after comment in "{0}" line {1}.'.format(source, i))
+                continue
+
+            if stripped == '/':
+                statement = pending or self.__lastStatement
+                pending = None
+                if statement:
+                    yield self.__statement(statement.kind, statement.text, statement.source, statement.line)
+                continue
+
+            if stripped.startswith('--'):
+                continue
+
+            if pending:
+                ScriptParser.log.warning('statement at "{0}" line {1} ended by a blank line and not run.'.format(pending.source, pending.line))
+                pending = None
+
+            if stripped.startswith('@'):
+                yield from self.__include(stripped, source, i, depth)
+                continue
+
+            words = stripped.split(None, 1)
+            command = words[0].lower().rstrip(';')
+            rest = words[1].strip() if len(words) > 1 else ''
+
+            if is_command(command, 'remark', 3):
+                continue
+            if is_command(command, 'prompt', 3):
+                yield Statement(PROMPT, rest, source, i)
+                continue
+            if command == 'set' and not (rest and rest.lower().split()[0] in SQL_SET_COMMANDS):
+                self.__set(rest)
+                yield Statement(SET, rest, source, i)
+                continue
+            if is_command(command, 'whenever', 4):
+                yield Statement(WHENEVER, rest.rstrip(';'), source, i)
+                continue
+            if is_command(command, 'execute', 4):
+                yield self.__statement(PLSQL, 'begin\n{0};\nend;'.format(rest.rstrip().rstrip(';')), source, i)
+                continue
+            if command in ('exit', 'quit'):
+                yield Statement(EXIT, rest.rstrip(';'), source, i)
+                return
+            if command == 'start' and rest:
+                yield from self.__include('@' + rest, source, i, depth)
+                continue
+            if command in SQLPLUS_COMMANDS:
+                yield Statement(IGNORED, stripped, source, i)
+                continue
+
+            bufferKind = PLSQL if PLSQL_START.match(stripped) else SQL
+            bufferLine = i
+            i -= 1
+
+        if bufferKind:
+            ScriptParser.log.warning('statement at "{0}" line {1} not terminated and not run.'.format(source, bufferLine))
+
+
+    def __statement(self, kind, text, source, line):
+        statement = Statement(kind, text, source, line)
+        self.__lastStatement = statement
+        return statement
+
+
+    def __set(self, rest):
+        words = rest.lower().split()
+        if len(words) >= 2 and is_command(words[0], 'sqlblanklines', 5):
+            self.__sqlBlankLines = words[1] == 'on'
+
+
+    def __include(self, line, source, lineNumber, depth):
+        relative = line.startswith('@@')
+        name = line.lstrip('@').strip().rstrip(';').strip().strip('"').strip("'")
+        if not os.path.splitext(name)[1]:
+            name += '.sql'
+        if relative:
+            name = os.path.join(os.path.dirname(source), name)
+
+        if depth >= MAX_INCLUDE_DEPTH:
+            raise ScriptParseException('scripts included more than {0} deep'.format(MAX_INCLUDE_DEPTH), source, lineNumber)
+
+        try:
+            text = self.__readScript(name)
+        except OSError:
+            raise ScriptParseException('cannot read included script "{0}"'.format(name), source, lineNumber)
+
+        yield from self.parse(text, name, depth + 1)
+
+
+SQLPLUS_COMMANDS = (
+    'accept', 'append', 'archive', 'attribute', 'break', 'btitle', 'clear', 'col', 'column', 'compute', 'conn', 'connect',
+    'copy', 'def', 'define', 'del', 'desc', 'describe', 'disc', 'disconnect', 'host', 'passw', 'password', 'pause', 'print',
+    'recover', 'repheader', 'repfooter', 'sho', 'show', 'spo', 'spool', 'store', 'timing', 'ttitle', 'undef', 'undefine',
+    'var', 'variable')
+
+
+def parse_whenever(text):
+    """Returns (exit on error, exit code, rollback) for the text following WHENEVER"""
+
+    words = text.lower().split()
+    if len(words) < 2 or words[0] != 'sqlerror':
+        return None
+
+    if words[1] == 'continue':
+        return False, 0, 'rollback' in words[2:]
+
+    code = 1
+    for word in words[2:]:
+        if word.isdigit():
+            code = int(word)
+        elif word == 'success':
+            code = 0
+        elif word == 'warning':
+            code = 2
+    return True, code, 'rollback' in words[2:]
+
+
+#------------------------------------------------------------------------------
+# NativeScriptEngine
+#------------------------------------------------------------------------------
+# Runs parsed scripts directly on a pooled cx_Oracle connection instead of
+# through sqlplus. Scripts start as if "WHENEVER SQLERROR EXIT 1" had been
+# given, as they do when run through sqlplus by dbsync, and the work of a
+# script is committed at the end (or on exit) unless WHENEVER asked for a
+# rollback.
+#
+# A script can be run with a checkpoint, so a long script that fails part
+# way can carry on from where it got to. Its SQL and PL/SQL statements are
+# numbered from 1. The first checkpoint.completed of them are skipped, apart
+# from "alter session" statements which are run again to put the session
+# back as it was. After each statement runs checkpoint.record(cursor,
+# number, statement) is called and the statement is committed along with
+# whatever record wrote, so WHENEVER cannot roll back statements already run.
+#------------------------------------------------------------------------------
+COMPILED_WITH_ERRORS = 24344
+
+
+class NativeScriptEngine(object):
+    log = logging.getLogger('sqlplusengine.NativeScriptEngine')
+
+    def __init__(self, pool, databaseError, scriptFailed, readScript = read_script, metrics = None, profile = None):
+        self.__pool = pool
+        self.__databaseError = databaseError
+        self.__scriptFailed = scriptFailed
+        self.__readScript = readScript
+        self.__metrics = metrics
+        self.__profile = profile
+
+
+    def run_sql_script(self, filename, schema = None):
+        statements = parse_file(filename, self.__readScript)
+        return self.run_statements(filename, statements, schema)
+
+
+    def run_statements(self, filename, statements, schema = None, checkpoint = None):
+        exitOnError, exitCode, rollback = True, 1, False
+        number = 0
+
+        pooled = self.__pool.acquire(schema)
+        try:
+            cursor = pooled.connection.cursor()
+            for statement in statements:
+                if statement.kind in (SQL, PLSQL):
+                    number += 1
+                    alterSession = statement.text.lower().startswith('alter session')
+                    if checkpoint and number <= checkpoint.completed and not alterSession:
+                        NativeScriptEngine.log.debug('skipping statement {0} at "{1}" line {2}, it completed before.'.format(number, statement.source, statement.line))
+                        continue
+                    if alterSession:
+                        pooled.forget_schema()
+                    error = self.__execute(cursor, statement)
+                    if error and exitOnError:
+                        self.__end(pooled, rollback)
+                        raise self.__scriptFailed(filename, exitCode, '"{0}" line {1}'.format(statement.source, statement.line), output = [error])
+                    if checkpoint and number > checkpoint.completed:
+                        checkpoint.record(cursor, number, statement)
+                        pooled.connection.commit()
+                elif statement.kind == WHENEVER:
+                    exitOnError, exitCode, rollback = parse_whenever(statement.text) or (exitOnError, exitCode, rollback)
+                elif statement.kind == PROMPT:
+                    NativeScriptEngine.log.info(statement.text)
+                elif statement.kind == EXIT:
+                    break
+                else:
+                    NativeScriptEngine.log.debug('ignoring "{0}" at "{1}" line {2}.'.format(statement.text, statement.source, statement.line))
+
+            cursor.close()
+            self.__end(pooled, False)
+        finally:
+            self.__pool.release(pooled)
+
+        return True
+
+
+    def execute(self, cursor, statement):
+        return self.__execute(cursor, statement) is None
+
+
+    def __execute(self, cursor, statement):
+        """Returns the error the statement failed with, or None"""
+
+        NativeScriptEngine.log.debug('executing statement at "{0}" line {1}.'.format(statement.source, statement.line))
+        if self.__metrics:
+            self.__metrics.count_query()
+        started = time.perf_counter()
+        try:
+            cursor.execute(statement.text)
+            if self.__profile:
+                self.__profile.record(statement, time.perf_counter() - started, getattr(cursor, 'rowcount', None))
+            return None
+        except self.__databaseError as ex:
+            error = ex.args[0] if ex.args else ex
+            if getattr(error, 'code', None) == COMPILED_WITH_ERRORS:
+                NativeScriptEngine.log.warning('"{0}" line {1}: created with compilation errors.'.format(statement.source, statement.line))
+                return None
+            NativeScriptEngine.log.error('"{0}" line {1}: {2}'.format(statement.source, statement.line, str(error).strip()))
+            return str(error).strip()
+
+
+    def __end(self, pooled, rollback):
+        if rollback:
+            pooled.connection.rollback()
+        else:
+            pooled.connection.commit()
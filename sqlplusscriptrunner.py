@@ -1,72 +1,425 @@
-from subprocess import  Popen, PIPE
+from subprocess import  Popen, PIPE, STDOUT
 from distutils.version import StrictVersion
+from contextlib import contextmanager
+from collections import deque, namedtuple
+import logging.handlers
 import os.path
-import cx_Oracle
+import re
+import threading
+import time
 import logging
 
+from sqlplusengine import NativeScriptEngine, ScriptParseException, parse_file, parse_script, read_script
+from metrics import RunMetrics
+from profiler import SqlPlusTimingReader
+
+
+SQLPLUS_COMMAND = ('sqlplus',)
+SCRIPT_DONE_MARKER = '__DBSYNC_SCRIPT_DONE__'
+SESSION_READY_MARKER = '__DBSYNC_SESSION_READY__'
+DEFAULT_POOL_SIZE = 4
+
+
+SQLPLUS_ENGINE = 'sqlplus'
+NATIVE_ENGINE = 'native'
+ENGINES = (SQLPLUS_ENGINE, NATIVE_ENGINE)
+
+
+# tail_lines: how many of the last lines of output to keep to log on failure.
+# log_folder: if set the whole output of each script is written to a
+#     rotating log file in this folder.
+# heartbeat_seconds: how often to log that a script is still running.
+OutputSettings = namedtuple('OutputSettings', ['tail_lines', 'log_folder', 'heartbeat_seconds'])
+DEFAULT_OUTPUT = OutputSettings(200, None, 60)
+SCRIPT_LOG_MAX_BYTES = 10 * 1024 * 1024
+SCRIPT_LOG_BACKUPS = 3
+
+
+def oracle():
+    """Returns the cx_Oracle module, importing it the first time it is needed
+        so nothing pays for loading the Oracle client until it connects"""
+    import cx_Oracle
+    return cx_Oracle
+
+
+def batch_location(filename, rowsBefore, batch):
+    """Where a failed batch of rows is, as "<file>" rows <first>-<last>"""
+    return '"{0}" rows {1}-{2}'.format(filename, rowsBefore + 1, rowsBefore + max(len(batch), 1))
+
 
 class ScriptFailedException(Exception):
-    def __init__(self, scriptPath):
+    def __init__(self, scriptPath, exitCode = None, location = None, output = None):
         self.script_path = scriptPath
+        self.exit_code = exitCode
+        self.location = location
+        self.output = output or []
 
 class OracleSqlRunner(object):
     log = logging.getLogger('sqlplusscriptrunner.OracleSqlRunner')
-    def __init__(self, username, password, host):
+    def __init__(self, username, password, host, sqlplusCommand = None, poolSize = DEFAULT_POOL_SIZE, engine = SQLPLUS_ENGINE, output = DEFAULT_OUTPUT, metrics = None, profile = None, ddlLockTimeout = None):
         self.__username = username
         self.__password = password
         self.__host = host
         self.__connectionString = '{0}/{1}@{2}'.format(username, password, host)
+        self.__sqlplusCommand = sqlplusCommand
+        self.__sessionsOpen = False
+        self.__idleSessions = []
+        self.__allSessions = []
+        self.__sessionLock = threading.Lock()
+        self.__poolSize = poolSize
+        self.__pool = ConnectionPool(self.__connect, poolSize, username)
+        self.__engine = engine
+        self.__output = output
+        self.__metrics = metrics or RunMetrics()
+        self.__profile = profile
+        self.__ddlLockTimeout = ddlLockTimeout
+        self.__nativeEngine = NativeScriptEngine(self.__pool, oracle().DatabaseError, ScriptFailedException, metrics = self.__metrics, profile = profile) if engine == NATIVE_ENGINE else None
+
+    def __connect(self):
+        self.__metrics.count_connection()
+        connection = oracle().connect(self.__username, self.__password, self.__host)
+        if self.__ddlLockTimeout:
+            cursor = connection.cursor()
+            cursor.execute('alter session set ddl_lock_timeout = {0}'.format(int(self.__ddlLockTimeout)))
+            cursor.close()
+        return connection
+
+    def clone(self):
+        """Returns a runner for the same database with its own connections and session."""
+        return self.for_target(self.__username, self.__password, self.__host)
+
+    def for_target(self, username, password, host):
+        """Returns a runner like this one for another database, sharing its metrics and profile."""
+        return OracleSqlRunner(username, password, host, self.__sqlplusCommand, self.__poolSize, self.__engine, self.__output, self.__metrics, self.__profile, self.__ddlLockTimeout)
+
+    @property
+    def pool_stats(self):
+        return self.__pool.stats()
+
+    @property
+    def target(self):
+        """The database run against, as user@host"""
+        return '{0}@{1}'.format(self.__username, self.__host)
+
+    @property
+    def metrics(self):
+        return self.__metrics
     
     def run_sql_script(self, filename, schema = None):
-        return run_sql_script(self.__connectionString, filename, schema)
+        if self.__nativeEngine:
+            OracleSqlRunner.log.info('executing file: "{0}".'.format(filename))
+            return self.__nativeEngine.run_sql_script(filename, schema)
+
+        if not self.__sessionsOpen:
+            return run_sql_script(self.__connectionString, filename, schema, self.__sqlplusCommand, self.__output, self.__metrics, self.__profile, self.__ddlLockTimeout)
+
+        session = self.__acquire_session()
+        try:
+            return session.run_sql_script(filename, schema)
+        finally:
+            with self.__sessionLock:
+                self.__idleSessions.append(session)
+
+    def run_sql_text(self, name, text, schema = None, readScript = read_script):
+        """Runs the body of a script that is not on disk, name is used in logs and
+            errors as the script's path would be. The native engine reads the
+            scripts it includes with readScript, sqlplus reads them from disk."""
+
+        if self.__nativeEngine:
+            OracleSqlRunner.log.info('executing: "{0}".'.format(name))
+            return self.__nativeEngine.run_statements(name, parse_script(text, name, readScript), schema)
+
+        if not self.__sessionsOpen:
+            session = SqlPlusSession(self.__connectionString, self.__sqlplusCommand, self.__output, self.__metrics, ddlLockTimeout = self.__ddlLockTimeout)
+            try:
+                return session.run_text(name, text, schema)
+            finally:
+                session.close()
+
+        session = self.__acquire_session()
+        try:
+            return session.run_text(name, text, schema)
+        finally:
+            with self.__sessionLock:
+                self.__idleSessions.append(session)
+
+    def run_sql_statements(self, name, statements, schema = None, checkpoint = None):
+        """Runs parsed statements with the native engine, whichever engine runs
+            scripts, as sqlplus cannot say which statement a script got to."""
+
+        engine = self.__nativeEngine or NativeScriptEngine(self.__pool, oracle().DatabaseError, ScriptFailedException, metrics = self.__metrics, profile = self.__profile)
+        OracleSqlRunner.log.info('executing: "{0}"{1}.'.format(name, ' from statement {0}'.format(checkpoint.completed + 1) if checkpoint and checkpoint.completed else ''))
+        return engine.run_statements(name, statements, schema, checkpoint)
+
+    def open_session(self):
+        """Keeps sqlplus processes open for every script run until close_session is called.
+            Scripts run at the same time from different threads get a session each."""
+        OracleSqlRunner.log.debug('opening persistent sqlplus sessions.')
+        self.__sessionsOpen = True
+
+    def close_session(self):
+        with self.__sessionLock:
+            sessions, self.__allSessions, self.__idleSessions = self.__allSessions, [], []
+            self.__sessionsOpen = False
+        if sessions:
+            OracleSqlRunner.log.debug('closing {0} persistent sqlplus session(s).'.format(len(sessions)))
+        for session in sessions:
+            session.close()
+
+    def __acquire_session(self):
+        with self.__sessionLock:
+            if self.__idleSessions:
+                return self.__idleSessions.pop()
+            session = SqlPlusSession(self.__connectionString, self.__sqlplusCommand, self.__output, self.__metrics, self.__profile, self.__ddlLockTimeout)
+            self.__allSessions.append(session)
+            return session
 
     def run_sql_command(self, sql, schema = None, args = {}):
         
-        with cx_Oracle.connect(self.__username, self.__password, self.__host) as cnn:
-            if schema:
-                cnn.current_schema = schema
+        with self.__pool.connection(schema) as cnn:
             cursor = cnn.cursor()            
             if isinstance(sql, str):
                 OracleSqlRunner.log.debug('Running command on schema {0}: {1}'.format(schema, sql))
+                self.__metrics.count_query()
                 cursor.execute(sql, args)
             else:
                 for cmd in sql: 
                     OracleSqlRunner.log.debug('Running command on schema {0}: {1}'.format(schema, cmd))
+                    self.__metrics.count_query()
                     cursor.execute(cmd)
 
             cursor.close()
+            cnn.commit()
+
 
+    def run_sql_many(self, sql, schema = None, rows = []):
+        """Runs sql once for each set of binds in rows in a single round trip"""
 
-    def get_all_data_for(self, sqlScript, schema = None):
-        with cx_Oracle.connect(self.__username, self.__password, self.__host) as cnn:
-            if schema: cnn.current_schema = schema
+        with self.__pool.connection(schema) as cnn:
+            cursor = cnn.cursor()
+            OracleSqlRunner.log.debug('Running command on schema {0} for {1} row(s): {2}'.format(schema, len(rows), sql))
+            self.__metrics.count_query()
+            cursor.executemany(sql, rows)
+            cursor.close()
+            cnn.commit()
+
+
+    def run_sql_batches(self, filename, sql, schema = None, batches = [], commitEachBatch = False):
+        """Runs sql with executemany once for each batch of binds, committing at
+            the end or after every batch, and returns the number of rows run"""
+
+        rows, batch = 0, []
+        try:
+            with self.__pool.connection(schema) as cnn:
+                cursor = cnn.cursor()
+                for batch in batches:
+                    OracleSqlRunner.log.debug('Running command on schema {0} for {1} row(s): {2}'.format(schema, len(batch), sql))
+                    self.__metrics.count_query()
+                    cursor.executemany(sql, batch)
+                    rows += len(batch)
+                    if commitEachBatch:
+                        cnn.commit()
+                cursor.close()
+                cnn.commit()
+        except oracle().DatabaseError as ex:
+            error = str(ex.args[0] if ex.args else ex).strip()
+            location = batch_location(filename, rows, batch)
+            OracleSqlRunner.log.error('{0}: {1}'.format(location, error))
+            raise ScriptFailedException(filename, 1, location, output = [error])
+        return rows
+
+
+    def get_all_data_for(self, sqlScript, schema = None, args = {}):
+        with self.__pool.connection(schema) as cnn:
             cursor = cnn.cursor()
             
-            result = cursor.execute(sqlScript).fetchall()
+            self.__metrics.count_query()
+            result = cursor.execute(sqlScript, args).fetchall()
             cursor.close()
         return result
 
+    def close(self):
+        self.close_session()
+        self.__pool.close()
+
     def drop_schema(self, schema):
         self.run_sql_command('drop user {0} cascade'.format(schema))
 
 
 
+#------------------------------------------------------------------------------
+# ConnectionPool
+#------------------------------------------------------------------------------
+# Hands out at most "size" connections at a time and keeps released ones open
+# for reuse. The current schema of every connection is remembered so asking
+# for the schema a connection is already on costs nothing.
+#------------------------------------------------------------------------------
+UNKNOWN_SCHEMA = object()
+
+
+class PooledConnection(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.current_schema = None
+
+    def forget_schema(self):
+        """Called when the session's schema may have been changed behind the pool's back"""
+        self.current_schema = UNKNOWN_SCHEMA
+
+
+class ConnectionPool(object):
+    log = logging.getLogger('sqlplusscriptrunner.ConnectionPool')
+
+    def __init__(self, connect, size = DEFAULT_POOL_SIZE, defaultSchema = None):
+        self.__connect = connect
+        self.__size = size
+        self.__defaultSchema = defaultSchema
+        self.__idle = []
+        self.__slots = threading.BoundedSemaphore(size)
+        self.__lock = threading.Lock()
+        self.__created = 0
+        self.__reused = 0
+        self.__schemaSwitches = 0
+        self.__schemaSwitchesSkipped = 0
+
+
+    @contextmanager
+    def connection(self, schema = None):
+        pooled = self.acquire(schema)
+        try:
+            yield pooled.connection
+        except Exception:
+            self.release(pooled, rollback = True)
+            raise
+        else:
+            self.release(pooled)
+
+
+    def acquire(self, schema = None):
+        self.__slots.acquire()
+        with self.__lock:
+            pooled = self.__idle.pop() if self.__idle else None
+            if pooled:
+                self.__reused += 1
+
+        if not pooled:
+            try:
+                pooled = PooledConnection(self.__connect())
+            except Exception:
+                self.__slots.release()
+                raise
+            with self.__lock:
+                self.__created += 1
+            ConnectionPool.log.debug('opened connection {0} of {1}.'.format(self.__created, self.__size))
+
+        self.__switch_schema(pooled, schema)
+        return pooled
+
+
+    def release(self, pooled, rollback = False):
+        try:
+            if rollback:
+                pooled.connection.rollback()
+        except oracle().DatabaseError:
+            ConnectionPool.log.debug('discarding connection that could not be rolled back.')
+            self.__close_quietly(pooled)
+        else:
+            with self.__lock:
+                self.__idle.append(pooled)
+        finally:
+            self.__slots.release()
+
+
+    def close(self):
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for pooled in idle:
+            self.__close_quietly(pooled)
+
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'size': self.__size,
+                'created': self.__created,
+                'reused': self.__reused,
+                'schema_switches': self.__schemaSwitches,
+                'schema_switches_skipped': self.__schemaSwitchesSkipped }
+
+
+    def __switch_schema(self, pooled, schema):
+        wanted = schema or self.__defaultSchema
+        if not schema and not pooled.current_schema:
+            return
+
+        if pooled.current_schema == wanted:
+            with self.__lock:
+                self.__schemaSwitchesSkipped += 1
+            return
+
+        pooled.connection.current_schema = wanted
+        pooled.current_schema = schema
+        with self.__lock:
+            self.__schemaSwitches += 1
+
+
+    def __close_quietly(self, pooled):
+        try:
+            pooled.connection.close()
+        except oracle().DatabaseError:
+            pass
+
+
 log = logging.getLogger('sqlplusscriptrunner')
 
 def tell_sqlplus_to_exit_on_first_error_with_errorcode(stdin):
     stdin.write('WHENEVER SQLERROR EXIT 1;\n')
 
 
+def set_ddl_lock_timeout(stdin, seconds):
+    stdin.write('ALTER SESSION SET DDL_LOCK_TIMEOUT = {0};\n'.format(int(seconds)))
+
+
 def set_current_schema_to(stdin, schema):
-    log.info('setting current schema to: "{0}".'.format(schema))
+    log.debug('setting current schema to: "{0}".'.format(schema))
     stdin.write('ALTER SESSION SET CURRENT_SCHEMA = {0};\n'.format(schema))
 
 
-def execute_sql_script(stdin, filename):
+def reset_session(stdin, schema, ddlLockTimeout = None):
+    """Puts back every setting the runner depends on, as a script run before
+        in the same sqlplus process may have changed any of them"""
+    tell_sqlplus_to_exit_on_first_error_with_errorcode(stdin)
+    stdin.write('SET TERMOUT ON\nSET TIMING OFF\n')
+    if ddlLockTimeout:
+        set_ddl_lock_timeout(stdin, ddlLockTimeout)
+    set_current_schema_to(stdin, schema)
+
+
+def execute_sql_script(stdin, filename, timing = False):
     if not os.path.exists(filename):
         raise FileNotFoundError(filename)
     log.info('executing file: "{0}".'.format(filename))
+    if timing:
+        stdin.write('SET TIMING ON\n')
     stdin.write('@"{0}"'.format(filename))
+    if timing:
+        stdin.write('\nSET TIMING OFF')
+
+
+def timing_reader_for(filename, profile):
+    """Returns something to give every line of output to, to profile the statements of filename"""
+
+    if not profile:
+        return None
+    try:
+        return SqlPlusTimingReader(parse_file(filename), profile)
+    except (ScriptParseException, OSError) as ex:
+        log.warning('"{0}" will not be profiled: {1}'.format(filename, ex))
+        return None
+
+
+def write_script_done_marker(stdin, marker):
+    stdin.write('\nPROMPT {0}\n'.format(marker))
 
 
 def drop_schema(connstr, schema):
@@ -78,29 +431,40 @@ def drop_schema(connstr, schema):
     return False
 
 
-def run_sql_script(connstr, filename, schema = None):
-    sqlplus = start_sqlplus(connstr)
+def run_sql_script(connstr, filename, schema = None, command = None, output = None, metrics = None, profile = None, ddlLockTimeout = None):
+    started = time.perf_counter()
+    sqlplus = start_sqlplus(connstr, command)
+    if metrics:
+        metrics.add_spawn_time(time.perf_counter() - started)
 
     tell_sqlplus_to_exit_on_first_error_with_errorcode(sqlplus.stdin)
+    if ddlLockTimeout:
+        set_ddl_lock_timeout(sqlplus.stdin, ddlLockTimeout)
 
     if schema:
         set_current_schema_to(sqlplus.stdin, schema)
         
-    execute_sql_script(sqlplus.stdin, filename)
-    output = sqlplus.communicate()[0]
-    exitcode = sqlplus.wait()
+    timingReader = timing_reader_for(filename, profile)
+    execute_sql_script(sqlplus.stdin, filename, timingReader is not None)
+    sqlplus.stdin.close()
+
+    pipeline = OutputPipeline(filename, output, timingReader)
+    try:
+        exitcode = pipeline.follow(sqlplus)
+    finally:
+        pipeline.close()
     
     if exitcode > 0:
         log.error('script failed with exit code: "{0}"'.format(exitcode))
-        log.info(output)
-        raise ScriptFailedException(filename)
+        log.info('\n'.join(pipeline.tail))
+        raise ScriptFailedException(filename, exitcode, output = pipeline.tail)
         
     return True
 
 
-def start_sqlplus(connstr):
-    command = ['sqlplus', '-S', connstr]
-    return Popen(command, stdin=PIPE, stdout = PIPE, stderr=PIPE, universal_newlines = True)
+def start_sqlplus(connstr, command = None, mergeStderr = False):
+    command = list(command or SQLPLUS_COMMAND) + ['-S', connstr]
+    return Popen(command, stdin=PIPE, stdout = PIPE, stderr = STDOUT if mergeStderr else PIPE, universal_newlines = True)
 
 
 def run_sql_command(connstr, script, schema = None):
@@ -122,3 +486,221 @@ def run_sql_command(connstr, script, schema = None):
         return False
         
     return True
+
+
+#------------------------------------------------------------------------------
+# SqlPlusSession
+#------------------------------------------------------------------------------
+# A single long lived sqlplus process that scripts are streamed into. After
+# each script a PROMPT with a numbered marker is written so the end of every
+# script can be found in the output. If sqlplus exits before the marker shows
+# up the script being run is the one that failed. When a process is started
+# a ready marker is waited for so the time taken to start sqlplus and log in
+# can be told apart from the time taken by the script.
+#
+# Before every script the session is put back as a new process starts:
+# exiting on the first error, with the ddl lock timeout and in the schema
+# asked for (the user logged in as if none is), so nothing a script changes
+# with WHENEVER, SET or ALTER SESSION carries on into the next.
+#------------------------------------------------------------------------------
+class SqlPlusSession(object):
+    log = logging.getLogger('sqlplusscriptrunner.SqlPlusSession')
+
+    def __init__(self, connstr, command = None, output = None, metrics = None, profile = None, ddlLockTimeout = None):
+        self.__connstr = connstr
+        self.__command = command
+        self.__output = output
+        self.__metrics = metrics
+        self.__profile = profile
+        self.__ddlLockTimeout = ddlLockTimeout
+        self.__username = connstr.split('/', 1)[0]
+        self.__sqlplus = None
+        self.__scriptCount = 0
+
+
+    def run_sql_script(self, filename, schema = None):
+        timingReader = timing_reader_for(filename, self.__profile)
+
+        def write(stdin, marker):
+            execute_sql_script(stdin, filename, timingReader is not None)
+            write_script_done_marker(stdin, marker)
+            stdin.flush()
+
+        return self.__run(filename, schema, write, timingReader)
+
+
+    def run_text(self, name, text, schema = None):
+        """Streams the body of a script into sqlplus as if it were the script name"""
+
+        log.info('executing: "{0}".'.format(name))
+
+        def write(stdin, marker):
+            # written from another thread so a long script cannot fill the pipe
+            # while sqlplus is waiting for its output to be read.
+            def stream():
+                try:
+                    stdin.write(text)
+                    write_script_done_marker(stdin, marker)
+                    stdin.flush()
+                except (BrokenPipeError, ValueError):
+                    SqlPlusSession.log.debug('sqlplus stopped reading during "{0}".'.format(name))
+            threading.Thread(target = stream, daemon = True).start()
+
+        return self.__run(name, schema, write)
+
+
+    def __run(self, filename, schema, write, observer = None):
+        sqlplus = self.__start_if_needed(filename)
+        reset_session(sqlplus.stdin, schema or self.__username, self.__ddlLockTimeout)
+
+        self.__scriptCount += 1
+        marker = '{0} {1}'.format(SCRIPT_DONE_MARKER, self.__scriptCount)
+        write(sqlplus.stdin, marker)
+
+        pipeline = OutputPipeline(filename, self.__output, observer)
+        try:
+            for line in sqlplus.stdout:
+                if line.rstrip() == marker:
+                    return True
+                pipeline.write(line)
+        finally:
+            pipeline.close()
+
+        exitcode = self.__finish()
+        if exitcode > 0:
+            log.error('script failed with exit code: "{0}"'.format(exitcode))
+            log.info('\n'.join(pipeline.tail))
+            raise ScriptFailedException(filename, exitcode, output = pipeline.tail)
+
+        SqlPlusSession.log.info('sqlplus exited during "{0}", a new process will be started for the next script.'.format(filename))
+        return True
+
+
+    def close(self):
+        if self.__sqlplus:
+            try:
+                self.__sqlplus.stdin.write('exit\n')
+                self.__sqlplus.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                pass
+            self.__finish()
+
+
+    def __start_if_needed(self, filename):
+        if not self.__sqlplus:
+            SqlPlusSession.log.debug('starting sqlplus.')
+            started = time.perf_counter()
+            self.__sqlplus = start_sqlplus(self.__connstr, self.__command, mergeStderr = True)
+            tell_sqlplus_to_exit_on_first_error_with_errorcode(self.__sqlplus.stdin)
+            self.__wait_until_ready(filename)
+            if self.__metrics:
+                self.__metrics.add_spawn_time(time.perf_counter() - started)
+        return self.__sqlplus
+
+
+    def __wait_until_ready(self, filename):
+        write_script_done_marker(self.__sqlplus.stdin, SESSION_READY_MARKER)
+        self.__sqlplus.stdin.flush()
+
+        pipeline = OutputPipeline(filename, self.__output)
+        try:
+            for line in self.__sqlplus.stdout:
+                if line.rstrip() == SESSION_READY_MARKER:
+                    return
+                pipeline.write(line)
+        finally:
+            pipeline.close()
+
+        exitcode = self.__finish()
+        log.error('sqlplus exited with exit code "{0}" before it was ready.'.format(exitcode))
+        log.info('\n'.join(pipeline.tail))
+        raise ScriptFailedException(filename, exitcode, output = pipeline.tail)
+
+
+    def __finish(self):
+        sqlplus = self.__sqlplus
+        self.__sqlplus = None
+        sqlplus.communicate()
+        return sqlplus.wait()
+
+
+#------------------------------------------------------------------------------
+# OutputPipeline
+#------------------------------------------------------------------------------
+# Takes the output of a script line by line as sqlplus writes it rather than
+# holding all of it in memory. Each line is logged at debug level, written to
+# the script's rotating log file if a log folder is set and kept in a bounded
+# tail that is logged if the script fails. A heartbeat is logged while a
+# script runs longer than heartbeat_seconds. If an observer is given every
+# line is passed to it as well.
+#------------------------------------------------------------------------------
+class OutputPipeline(object):
+    log = logging.getLogger('sqlplusscriptrunner.output')
+
+    def __init__(self, scriptPath, settings = None, observer = None):
+        settings = settings or DEFAULT_OUTPUT
+        self.__scriptPath = scriptPath
+        self.__observer = observer
+        self.__tail = deque(maxlen = settings.tail_lines)
+        self.__lock = threading.Lock()
+        self.__file = self.__open_log_file(settings.log_folder)
+        self.__started = time.perf_counter()
+        self.__stopped = threading.Event()
+        self.__heartbeat = None
+        if settings.heartbeat_seconds:
+            self.__heartbeat = threading.Thread(target = self.__beat, args = (settings.heartbeat_seconds,), daemon = True)
+            self.__heartbeat.start()
+
+
+    @property
+    def tail(self):
+        with self.__lock:
+            return list(self.__tail)
+
+
+    def write(self, line):
+        line = line.rstrip('\n')
+        with self.__lock:
+            self.__tail.append(line)
+        OutputPipeline.log.debug('{0}: {1}'.format(self.__scriptPath, line))
+        if self.__file:
+            self.__file.handle(logging.makeLogRecord({'msg': line, 'levelno': logging.INFO, 'levelname': 'INFO'}))
+        if self.__observer:
+            self.__observer(line)
+
+
+    def follow(self, process):
+        """Reads stdout and stderr of process until it exits, returning its exit code"""
+
+        errors = threading.Thread(target = self.__read, args = (process.stderr,), daemon = True)
+        errors.start()
+        self.__read(process.stdout)
+        errors.join()
+        return process.wait()
+
+
+    def close(self):
+        self.__stopped.set()
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+
+    def __read(self, stream):
+        for line in stream or []:
+            self.write(line)
+
+
+    def __beat(self, seconds):
+        while not self.__stopped.wait(seconds):
+            OutputPipeline.log.info('"{0}" still running after {1:.0f} seconds.'.format(self.__scriptPath, time.perf_counter() - self.__started))
+
+
+    def __open_log_file(self, folder):
+        if not folder:
+            return None
+        os.makedirs(folder, exist_ok = True)
+        name = re.sub(r'[^\w.-]+', '_', os.path.normpath(self.__scriptPath)).strip('_.') + '.log'
+        handler = logging.handlers.RotatingFileHandler(os.path.join(folder, name), maxBytes = SCRIPT_LOG_MAX_BYTES, backupCount = SCRIPT_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
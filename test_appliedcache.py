@@ -0,0 +1,70 @@
+import unittest
+
+import os
+import os.path
+import tempfile
+
+from appliedcache import *
+
+
+class TestAppliedScriptsCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cacheFolder = os.path.join(self.folder.name, 'cache')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def saved_cache(self, rows, target = 'scott@db1'):
+        sut = AppliedScriptsCache.for_target('foo', target, cacheFolder = self.cacheFolder)
+        sut.rebuild(rows)
+        sut.save()
+        return AppliedScriptsCache.for_target('foo', target, cacheFolder = self.cacheFolder)
+
+    def test_new_cache_has_no_watermark(self):
+        sut = AppliedScriptsCache.for_target('foo', 'scott@db1', cacheFolder = self.cacheFolder)
+
+        self.assertIsNone(sut.watermark)
+        self.assertEqual(sut.scripts, frozenset())
+
+    def test_saved_cache_is_read_back_with_its_watermark(self):
+        sut = self.saved_cache([(1, '0.1', 'a.sql'), (4, '0.1', 'b.sql')])
+
+        self.assertEqual(sut.watermark, 4)
+        self.assertEqual(sut.scripts, {('0.1', 'a.sql'), ('0.1', 'b.sql')})
+        self.assertTrue(sut.matches(2, 4))
+        self.assertFalse(sut.matches(1, 4))
+
+    def test_each_target_has_its_own_cache(self):
+        self.saved_cache([(1, '0.1', 'a.sql')])
+
+        sut = AppliedScriptsCache.for_target('foo', 'scott@db2', cacheFolder = self.cacheFolder)
+
+        self.assertIsNone(sut.watermark)
+
+    def test_add_moves_the_watermark_up(self):
+        sut = self.saved_cache([(1, '0.1', 'a.sql')])
+
+        sut.add([(2, '0.2', 'c.sql'), (3, '0.2', 'd.sql')])
+
+        self.assertEqual(sut.watermark, 3)
+        self.assertTrue(sut.matches(3, 3))
+
+    def test_rebuild_forgets_complete_folders(self):
+        sut = self.saved_cache([(1, '0.1', 'a.sql')])
+        sut.set_complete_folders({'versions/0.1': 123})
+
+        sut.rebuild([])
+
+        self.assertEqual((sut.watermark, sut.complete_folders), (0, {}))
+
+    def test_rescan_ignores_the_saved_cache(self):
+        self.saved_cache([(1, '0.1', 'a.sql')])
+
+        sut = AppliedScriptsCache.for_target('foo', 'scott@db1', True, self.cacheFolder)
+
+        self.assertIsNone(sut.watermark)
+
+
+if __name__ == '__main__':
+    unittest.main()
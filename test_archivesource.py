@@ -0,0 +1,104 @@
+import unittest
+
+import io
+import os
+import os.path
+import tarfile
+import zipfile
+import tempfile
+
+from archivesource import *
+from dbsync import ArchiveSourceOperations, Db, DbUpdater, find_schema_folders
+from sqlitedriver import SqliteSqlRunner, MEMORY
+from csvloader import CsvReader, CsvLoad
+
+FILES = {
+    'foo/create.user.sql': 'create user foo identified by foo;\n',
+    'foo/baseline/tables.sql': 'create table t (id integer);\n',
+    'foo/versions/0.1/a.sql': 'insert into t values (1);\n',
+    'foo/versions/0.1/b.sql': '-- depends on: a.sql\ninsert into t values (3);\n',
+    'foo/versions/0.2/c.sql': 'insert into t values (2);\n',
+    'foo/versions/_ignored/d.sql': 'boom;\n' }
+
+
+class TestReleaseArchive(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def zip(self, name, files):
+        path = os.path.join(self.folder.name, name)
+        with zipfile.ZipFile(path, 'w') as z:
+            for member, text in files.items():
+                z.writestr(member, text)
+        return path
+
+    def tar(self, name, mode, files):
+        path = os.path.join(self.folder.name, name)
+        with tarfile.open(path, mode) as t:
+            for member, text in files.items():
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                t.addfile(info, io.BytesIO(data))
+        return path
+
+    def test_zip_and_tar_archives_list_and_read_the_same(self):
+        paths = [self.zip('r.zip', FILES), self.tar('r.tar', 'w', FILES), self.tar('r.tgz', 'w:gz', FILES)]
+
+        for path in paths:
+            with self.subTest(path = os.path.basename(path)):
+                sut = ReleaseArchive(path)
+                self.assertEqual(sut.get_folders_in('./foo/versions'), ['0.1', '0.2'])
+                self.assertEqual(sut.get_files_in(os.path.join('.', 'foo', 'versions', '0.1')), ['a.sql', 'b.sql'])
+                self.assertEqual(sut.read_text('./foo/versions/0.2/c.sql'), FILES['foo/versions/0.2/c.sql'])
+                self.assertEqual(sut.get_file_info('./foo/versions/0.1/a.sql')[0], len(FILES['foo/versions/0.1/a.sql']))
+                sut.close()
+
+    def test_single_top_folder_that_is_not_a_schema_is_skipped(self):
+        sut = ReleaseArchive(self.zip('r.zip', dict(('release-1.2/' + k, v) for k, v in FILES.items())))
+
+        self.assertTrue(sut.is_file('./foo/create.user.sql'))
+        self.assertEqual(find_schema_folders('.', sut), ['foo'])
+
+    def test_csv_is_streamed_from_a_member_of_zip_and_tar_archives(self):
+        files = {'foo/versions/0.1/c.csv': '\ufeffcode,name\n' + ''.join('c{0},n{0}\n'.format(i) for i in range(2500))}
+        paths = [self.zip('r.zip', files), self.tar('r.tar', 'w', files)]
+
+        for path in paths:
+            with self.subTest(path = os.path.basename(path)):
+                sut = ReleaseArchive(path)
+                load = CsvLoad('./foo/versions/0.1/c.csv', 'c', None, True, 1000, False)
+                with CsvReader(load, sut.open_binary) as reader:
+                    batches = list(reader.batches())
+                self.assertEqual(reader.columns, ['code', 'name'])
+                self.assertEqual([len(b) for b in batches], [1000, 1000, 500])
+                self.assertEqual(batches[2][-1], ('c2499', 'n2499'))
+                sut.close()
+
+    def test_missing_member_throws_FileNotFoundError(self):
+        sut = ReleaseArchive(self.zip('r.zip', FILES))
+
+        self.assertRaises(FileNotFoundError, sut.read_bytes, './foo/versions/0.3/x.sql')
+        self.assertRaises(FileNotFoundError, sut.list_folder, './bar')
+
+    def test_schema_is_synced_from_the_archive(self):
+        archive = ReleaseArchive(self.tar('r.tar', 'w', FILES))
+        source = ArchiveSourceOperations('foo', archive)
+        runner = SqliteSqlRunner('dbsync', '', MEMORY)
+        try:
+            self.assertTrue(DbUpdater(Db('foo', runner, scripts = source), source).bring_to_verion(None))
+
+            db = Db('foo', runner)
+            self.assertEqual(runner.get_all_data_for('select id from t order by id', 'foo'), [(1,), (2,), (3,)])
+            self.assertEqual(sorted(name for version, name in db.get_applied_scripts()),
+                [os.path.join('.', 'foo', 'versions', '0.1', 'a.sql'), os.path.join('.', 'foo', 'versions', '0.1', 'b.sql'), os.path.join('.', 'foo', 'versions', '0.2', 'c.sql')])
+        finally:
+            runner.close()
+            archive.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
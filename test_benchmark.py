@@ -0,0 +1,29 @@
+import unittest
+
+import os.path
+import sys
+import json
+import subprocess
+import tempfile
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.py')
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmark_writes_json_results_for_cold_warm_and_bundle_syncs(self):
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, 'results.json')
+            subprocess.check_call([sys.executable, BENCHMARK, '--versions=2', '--scripts=2', '--latency=0', '--connect-latency=0', '--startup=0', '--output=' + output])
+
+            with open(output) as f:
+                results = json.load(f)['results']
+
+        cold = [r for r in results if r['scenario'] == 'cold']
+        self.assertEqual([r['scripts_applied'] for r in cold], [4, 4])
+        self.assertEqual([r['process_spawns'] for r in cold if r['engine'] == 'native'], [0])
+        self.assertTrue(all(r['scripts_applied'] == 0 for r in results if r['scenario'] == 'warm'))
+        self.assertEqual([r['scripts_applied'] for r in results if r['scenario'] == 'bundle'], [4, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
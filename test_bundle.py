@@ -0,0 +1,83 @@
+import unittest
+import unittest.mock as mock
+
+import os.path
+import json
+import tempfile
+
+from collections import namedtuple
+from bundle import *
+
+Step = namedtuple('Step', ['version', 'path'])
+
+
+class TestBundleFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_script(self, name, text):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_written_bundle_reads_back_with_scripts_grouped_by_version(self):
+        one, two, three = (self.write_script(n, 'select {0} from dual;\n'.format(n)) for n in ('one.sql', 'two.sql', 'three.sql'))
+        path = os.path.join(self.folder.name, 'release.json')
+
+        write_bundle(path, [build_schema_bundle('foo', None, [one], [Step('0.1', two), Step('0.1', three), Step('0.2', one)])])
+        result = read_bundle(path)[0]
+
+        self.assertEqual((result.schema, result.create_user, [s.path for s in result.baseline]), ('foo', None, [one]))
+        self.assertEqual([(v.version, [s.path for s in v.scripts]) for v in result.versions], [('0.1', [two, three]), ('0.2', [one])])
+
+    def test_damaged_script_body_throws_BundleException(self):
+        path = os.path.join(self.folder.name, 'release.json')
+        write_bundle(path, [build_schema_bundle('foo', None, [], [Step('0.1', self.write_script('one.sql', 'select 1 from dual;\n'))])])
+        with open(path) as f:
+            document = json.load(f)
+        document['schemas'][0]['versions'][0]['scripts'][0]['body'] = 'drop table a;\n'
+        with open(path, 'w') as f:
+            json.dump(document, f)
+
+        self.assertRaises(BundleException, read_bundle, path)
+
+    def test_scripts_that_include_other_scripts_cannot_be_bundled(self):
+        self.assertRaises(BundleException, bundle_script, self.write_script('one.sql', 'select 1 from dual;\n@@two.sql\n'))
+
+
+class TestBundleApplier(unittest.TestCase):
+    def setUp(self):
+        self.db = mock.Mock()
+        self.db.snapshot.schema_exists = True
+        self.db.get_applied_scripts.return_value = frozenset([('0.1', 'a.sql')])
+        self.sqlRunner = mock.MagicMock()
+        self.sut = BundleApplier(self.db, self.sqlRunner)
+        self.bundle = SchemaBundle('foo', None, [], [
+            BundledVersion('0.1', [BundledScript('a.sql', 'ca', 'a'), BundledScript('b.sql', 'cb', 'b')]),
+            BundledVersion('0.2', [BundledScript('c.sql', 'cc', 'c'), BundledScript('d.sql', 'cd', 'd')])])
+
+    def test_applies_pending_scripts_and_flushes_tracking_after_each_version(self):
+        self.assertTrue(self.sut.apply(self.bundle))
+
+        self.assertEqual([c[0][:2] for c in self.sqlRunner.run_sql_text.call_args_list], [('b.sql', 'b'), ('c.sql', 'c'), ('d.sql', 'd')])
+        self.assertEqual([(c[0][0], c[0][1], c[0][3]) for c in self.db.record_script_as_run.call_args_list], [('b.sql', '0.1', 'cb'), ('c.sql', '0.2', 'cc'), ('d.sql', '0.2', 'cd')])
+        self.assertEqual(self.db.flush_tracking.call_count, 2)
+        self.sqlRunner.open_session.assert_called_once_with()
+        self.sqlRunner.close_session.assert_called_once_with()
+
+    def test_on_failure_records_the_scripts_that_completed(self):
+        self.sqlRunner.run_sql_text.side_effect = [True, True, Exception('d.sql failed')]
+
+        self.assertRaises(Exception, self.sut.apply, self.bundle)
+
+        self.assertEqual([c[0][0] for c in self.db.record_script_as_run.call_args_list], ['b.sql', 'c.sql'])
+        self.assertEqual(self.db.flush_tracking.call_count, 2)
+        self.sqlRunner.close_session.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import unittest.mock as mock
+
+import hashlib
+import os.path
+import tempfile
+
+import checksums
+from checksums import *
+
+
+class TestHashFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'script.sql')
+        self.content = b'select 1 from dual;\n' * 1000
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_hash_is_sha256_of_file_content(self):
+        self.assertEqual(hash_file(self.path), hashlib.sha256(self.content).hexdigest())
+
+    @mock.patch('checksums.MMAP_THRESHOLD', 1)
+    def test_memory_mapped_hash_is_the_same_as_streamed_hash(self):
+        self.assertEqual(hash_file(self.path), hashlib.sha256(self.content).hexdigest())
+
+    def test_hash_files_does_not_read_files_with_cached_size_and_mtime(self):
+        cache = ChecksumCache(os.path.join(self.folder.name, 'cache.json'))
+        hash_files([self.path], cache)
+
+        with mock.patch('checksums.hash_file') as hashFile:
+            result = hash_files([self.path], cache)
+            hashFile.assert_not_called()
+        self.assertEqual(result, {self.path: hashlib.sha256(self.content).hexdigest()})
+
+
+class TestCompare(unittest.TestCase):
+    def test_compare_reports_drifted_missing_and_unknown_scripts(self):
+        source = {('0.1', 'same.sql'): 'aaa', ('0.1', 'changed.sql'): 'bbb', ('0.1', 'old.sql'): 'ccc', ('0.2', 'pending.sql'): 'ddd'}
+        tracked = [('0.1', 'same.sql', 'aaa'), ('0.1', 'changed.sql', 'xxx'), ('0.1', 'old.sql', None), ('0.1', 'deleted.sql', 'eee')]
+
+        result = compare(source, tracked)
+
+        self.assertEqual(result, VerifyResult([('0.1', 'changed.sql')], [('0.1', 'deleted.sql')], [('0.1', 'old.sql')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
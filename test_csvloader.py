@@ -0,0 +1,65 @@
+import unittest
+
+import os
+import os.path
+import tempfile
+
+from csvloader import *
+
+
+class TestCsvLoader(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w', newline = '') as f:
+            f.write(text)
+        return path
+
+    def test_settings_default_to_table_named_after_file_and_columns_from_header(self):
+        path = self.write('countries.csv', 'code,name\r\nGB,Britain\r\n')
+
+        load = read_load(path)
+        with CsvReader(load) as reader:
+            statement = reader.statement
+
+        self.assertEqual(load, CsvLoad(path, 'countries', None, True, DEFAULT_BATCH_SIZE, False))
+        self.assertEqual(statement, 'insert into countries (code, name) values (:1, :2)')
+
+    def test_settings_are_read_from_section_named_after_file(self):
+        self.write(LOAD_SETTINGS_FILE, '[DEFAULT]\nbatch_size = 2\n\n[countries.csv]\ntable = ref.country\ncolumns = code, name\nheader = no\ndirect_path = yes\n')
+        path = self.write('countries.csv', 'GB,Britain\r\n')
+
+        load = read_load(path)
+
+        self.assertEqual(load, CsvLoad(path, 'ref.country', ['code', 'name'], False, 2, True))
+        self.assertEqual(insert_statement(load, load.columns), 'insert /*+ APPEND_VALUES */ into ref.country (code, name) values (:1, :2)')
+
+    def test_batches_are_no_bigger_than_batch_size_with_empty_fields_as_null(self):
+        self.write(LOAD_SETTINGS_FILE, '[countries.csv]\nbatch_size = 2\n')
+        path = self.write('countries.csv', 'code,name\r\nGB,Britain\r\nFR,\r\n\r\nDE,"Germany, Federal Republic"\r\n')
+
+        with CsvReader(read_load(path)) as reader:
+            batches = list(reader.batches())
+
+        self.assertEqual(batches, [[('GB', 'Britain'), ('FR', None)], [('DE', 'Germany, Federal Republic')]])
+
+    def test_rows_with_the_wrong_number_of_fields_throw_CsvLoadException(self):
+        path = self.write('countries.csv', 'code,name\r\nGB\r\n')
+
+        with CsvReader(read_load(path)) as reader:
+            self.assertRaisesRegex(CsvLoadException, 'line 2', list, reader.batches())
+
+    def test_names_that_are_not_identifiers_throw_CsvLoadException(self):
+        self.write(LOAD_SETTINGS_FILE, '[countries.csv]\ntable = countries; drop table x\n')
+        path = self.write('countries.csv', 'code\r\n')
+
+        self.assertRaises(CsvLoadException, read_load, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
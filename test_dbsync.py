@@ -1,14 +1,22 @@
 import unittest
 import unittest.mock as mock
 
+import os
 import os.path
+import tempfile
 
 from dbsync import *
+from sqlitedriver import SqliteSqlRunner, MEMORY
 
 class TestDbUpdater(unittest.TestCase):
     def setUp(self):
         self.db = mock.Mock()
+        self.db.get_applied_scripts.return_value = frozenset()
+        self.db.complete_folders = {}
+        self.db.apply_script.return_value = True
         self.sp = mock.Mock()
+        self.sp.get_all_files_in.side_effect = lambda folder: [folder + '.sql']
+        self.sp.get_script_dependencies.return_value = None
         self.sut = DbUpdater(self.db, self.sp)
 
     def test_when_schema_folder_exists_should_tell_db_to_apply_schema(self):
@@ -19,38 +27,270 @@ class TestDbUpdater(unittest.TestCase):
         self.db.apply_schema_to_db.assert_called_with()  
 
 
+    def test_when_schema_folder_exists_should_open_and_close_one_session_around_the_sync(self):
+        self.sp.schema_folder_exists.return_value = True
+        self.sp.get_all_version_folders.return_value = [('first', '0.1')]
+        self.db.apply_script.side_effect = Exception('script failed')
+
+        self.assertRaises(Exception, self.sut.bring_to_verion, None)
+        self.db.open_session.assert_called_once_with()
+        self.db.close_session.assert_called_once_with()
+
+
     def test_when_schema_folder_does_not_exist_should_do_nothing(self):
         self.sp.schema_folder_exists.return_value = False
 
         self.sut.bring_to_verion('0.1')
 
 
-    def test_when_schema_folder_exists_should_tell_db_to_run_all_scripts_in_each_folder(self):
+    def test_when_schema_folder_exists_should_tell_db_to_apply_all_scripts_in_each_folder(self):
         self.sp.schema_folder_exists.return_value = True
         self.sp.get_all_version_folders.return_value = [('first', '0.1'), ('second', '0.2')]
 
         self.sut.bring_to_verion(None)
-        self.db.run_all_scripts_in.assert_has_calls([mock.call('first', '0.1'), mock.call('second', '0.2')])
+        self.db.apply_script.assert_has_calls([mock.call('first.sql', '0.1'), mock.call('second.sql', '0.2')])
 
 
-    def test_when_schema_folder_exists_and_told_to_brind_to_version_should_tell_db_to_run_all_scripts_in_each_folder_with_lower_or_equal_version(self):
+    def test_when_schema_folder_exists_and_told_to_brind_to_version_should_tell_db_to_apply_scripts_in_each_folder_with_lower_or_equal_version(self):
         versionFolders = [('zero', '0.0'), ('first', '0.1')]
 
         self.sp.schema_folder_exists.return_value = True
         self.sp.get_all_version_folders.return_value = versionFolders + [('second', '0.2')]
 
         self.sut.bring_to_verion('0.1')
-        self.assertEqual(self.db.run_all_scripts_in.call_args_list, [mock.call(*x) for x in versionFolders])
+        self.assertEqual(self.db.apply_script.call_args_list, [mock.call(f + '.sql', v) for f, v in versionFolders])
+        self.sp.get_all_files_in.assert_has_calls([mock.call('zero'), mock.call('first')])
+        self.assertEqual(self.sp.get_all_files_in.call_count, 2)
 
 
-    def test_when_schema_folder_exists_and_told_to_brind_to_version_None_should_tell_db_to_run_all_scripts_in_each_folder(self):
+    def test_when_schema_folder_exists_and_told_to_brind_to_version_None_should_tell_db_to_apply_scripts_in_each_folder(self):
         versionFolders = [('zero', '0.0'), ('first', '0.1'), ('first b', '0.1')]
 
         self.sp.schema_folder_exists.return_value = True
         self.sp.get_all_version_folders.return_value = versionFolders
 
         self.sut.bring_to_verion(None)
-        self.assertEqual(self.db.run_all_scripts_in.call_args_list, [mock.call(*x) for x in versionFolders])
+        self.assertEqual(self.db.apply_script.call_args_list, [mock.call(f + '.sql', v) for f, v in versionFolders])
+
+
+    def test_when_a_script_fails_should_stop_applying_scripts(self):
+        self.sp.schema_folder_exists.return_value = True
+        self.sp.get_all_version_folders.return_value = [('first', '0.1'), ('second', '0.2')]
+        self.db.apply_script.return_value = False
+
+        self.sut.bring_to_verion(None)
+        self.db.apply_script.assert_called_once_with('first.sql', '0.1')
+        self.db.flush_tracking.assert_called_once_with()
+
+
+    def test_when_a_script_throws_and_the_flush_fails_should_throw_the_scripts_error(self):
+        self.sp.schema_folder_exists.return_value = True
+        self.sp.get_all_version_folders.return_value = [('first', '0.1')]
+        self.db.apply_script.side_effect = Exception('script failed')
+        self.db.flush_tracking.side_effect = Exception('connection lost')
+
+        with self.assertRaises(Exception) as context:
+            self.sut.bring_to_verion(None)
+        self.assertEqual(str(context.exception), 'script failed')
+        self.db.flush_tracking.assert_called_once_with()
+
+
+    def test_should_flush_tracking_after_each_version(self):
+        self.sp.schema_folder_exists.return_value = True
+        self.sp.get_all_version_folders.return_value = [('first', '0.1'), ('first b', '0.1'), ('second', '0.2')]
+
+        self.sut.bring_to_verion(None)
+        self.assertEqual(self.db.flush_tracking.call_count, 2)
+
+
+class TestArgumentsReader(unittest.TestCase):
+    @mock.patch('dbsync.find_schema_folders', return_value=['bar', 'foo', 'tenant_1', 'tenant_2'])
+    def test_get_schemas_matches_wildcards_against_schema_folders(self, findSchemaFolders):
+        sut = ArgumentsReader(['--schema=tenant_*', '-s', 'foo', 'sync'])
+
+        self.assertEqual(sut.get_schemas(), ['tenant_1', 'tenant_2', 'foo'])
+
+
+    @mock.patch('dbsync.find_schema_folders', return_value=['bar', 'foo'])
+    def test_get_schemas_returns_every_schema_folder_when_all_schemas_asked_for(self, findSchemaFolders):
+        sut = ArgumentsReader(['--all-schemas', '--workers=8', 'sync'])
+
+        self.assertEqual(sut.get_schemas(), ['bar', 'foo'])
+        self.assertEqual(sut.workers, 8)
+
+
+    def test_targets_are_read_from_options_and_targets_file_without_duplicates(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'targets')
+            with open(path, 'w') as f:
+                f.write('# tenants\nscott/tiger@db1\n\nscott/p@ss@db2:1521/XE\n')
+
+            sut = ArgumentsReader(['-s', 'foo', '--target=scott/tiger@db1', '--targets-file={0}'.format(path), '--target-workers=2', 'sync'])
+
+        self.assertEqual(sut.targets, [Target('scott', 'tiger', 'db1'), Target('scott', 'p@ss', 'db2:1521/XE')])
+        self.assertEqual(sut.target_workers, 2)
+
+
+    def test_parse_target_throws_TargetException_without_password_or_host(self):
+        for text in ('scott@db1', 'scott/tiger', '/tiger@db1'):
+            with self.subTest(text = text):
+                self.assertRaises(TargetException, parse_target, text)
+
+
+class TestSyncSchemas(unittest.TestCase):
+    @mock.patch('dbsync.sync_schema')
+    def test_each_schema_is_synced_on_its_own_runner_and_failures_are_reported_per_schema(self, syncSchema):
+        syncSchema.side_effect = lambda argReader, schema, runner, source: schema != 'bad' or runner.fail()
+        sqlRunner = mock.Mock()
+        sqlRunner.clone.side_effect = lambda: mock.Mock(fail=mock.Mock(side_effect=Exception('boom')))
+
+        results = sync_schemas(mock.Mock(workers=2), ['good', 'bad'], sqlRunner)
+
+        self.assertEqual([(r.schema, r.succeeded) for r in results], [('good', True), ('bad', False)])
+        self.assertEqual(sqlRunner.clone.call_count, 2)
+
+
+class TestFanOutSync(unittest.TestCase):
+    @mock.patch('dbsync.source_for')
+    @mock.patch('dbsync.sync_schema')
+    def test_each_target_is_synced_on_its_own_runner_from_sources_read_once(self, syncSchema, sourceFor):
+        syncSchema.side_effect = lambda argReader, schema, runner, source: source.get_all_version_folders() and runner.target != 'scott@bad'
+        argReader = mock.Mock(workers = 1, target_workers = 2)
+        argReader.get_schemas.return_value = ['foo']
+        runners = {}
+        def for_target(username, password, host):
+            runners[host] = mock.Mock(target = '{0}@{1}'.format(username, host))
+            runners[host].clone.return_value = runners[host]
+            return runners[host]
+        sqlRunner = mock.Mock(for_target = mock.Mock(side_effect = for_target))
+
+        results = fan_out_sync(argReader, [Target('scott', 'tiger', 'good'), Target('scott', 'tiger', 'bad')], sqlRunner)
+
+        self.assertEqual([(r.target, r.schema, r.succeeded) for r in results], [('scott@good', 'foo', True), ('scott@bad', 'foo', False)])
+        sourceFor.return_value.get_all_version_folders.assert_called_once_with()
+        sourceFor.return_value.save_manifest.assert_called_once_with()
+        self.assertTrue(all(r.close.called for r in runners.values()))
+        self.assertIn('1 of 2 target(s) synced.', format_fan_out_report(results))
+
+
+class TestWatchDb(unittest.TestCase):
+    @mock.patch('os.path.isdir', return_value = True)
+    @mock.patch('dbsync.db_for')
+    @mock.patch('dbsync.DbUpdater')
+    def test_syncs_then_applies_pending_scripts_of_schemas_with_changes_in_one_session(self, dbUpdater, dbFor, isdir):
+        argReader = mock.Mock(max_parallel = 1, rescan = False, lock_retry = None, source = None)
+        argReader.get_schemas.return_value = ['foo', 'bar']
+        argReader.get_target_version.return_value = None
+        folderWatcher = mock.Mock()
+        folderWatcher.changes.return_value = iter([{os.path.join('.', 'bar', 'versions', '0.2', 'a.sql')}])
+        sqlRunner = mock.Mock()
+
+        watch_db(argReader, sqlRunner, lambda roots: folderWatcher)
+
+        self.assertEqual(dbUpdater.return_value.apply_pending.call_count, 3)
+        sqlRunner.open_session.assert_called_once_with()
+        sqlRunner.close_session.assert_called_once_with()
+        folderWatcher.close.assert_called_once_with()
+
+
+class TestVerifySchema(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder.name)
+        self.script = os.path.join('.', 'foo', 'versions', '0.1', 'a.sql')
+        os.makedirs(os.path.dirname(self.script))
+        self.write('create table a (id integer);\n')
+        self.sqlRunner = SqliteSqlRunner('dbsync', '', MEMORY)
+        self.sqlRunner.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+
+    def tearDown(self):
+        self.sqlRunner.close()
+        os.chdir(self.cwd)
+        self.folder.cleanup()
+
+    def write(self, text):
+        with open(self.script, 'w') as f:
+            f.write(text)
+        # old enough for the folder's listing to be cached, and the same after an edit.
+        os.utime(os.path.dirname(self.script), ns = (10 ** 18, 10 ** 18))
+
+    def test_script_edited_in_place_is_drifted_though_its_folder_listing_is_cached(self):
+        argReader = mock.Mock(rescan = False, source = None)
+        db = Db('foo', self.sqlRunner)
+        db.make_sure_tracking_is_up_to_date()
+        db.record_script_as_run(self.script, '0.1')
+        db.flush_tracking()
+        self.assertEqual(verify_schema(argReader, 'foo', self.sqlRunner).drifted, [])
+
+        self.write('create table a (id integer, name text);\n')
+
+        self.assertEqual(verify_schema(argReader, 'foo', self.sqlRunner).drifted, [('0.1', self.script)])
+
+    def test_schema_never_synced_has_nothing_applied_to_compare(self):
+        os.rename('foo', 'new')
+
+        self.assertEqual(verify_schema(mock.Mock(rescan = False, source = None), 'new', self.sqlRunner), checksums.VerifyResult([], [], []))
+        os.rename('new', 'foo')
+        self.assertEqual(verify_schema(mock.Mock(rescan = False, source = None), 'foo', self.sqlRunner), checksums.VerifyResult([], [], []))
+
+
+class TestSyncPlanner(unittest.TestCase):
+    def setUp(self):
+        self.sp = mock.Mock()
+        self.sp.get_all_version_folders.return_value = [('first', StrictVersion('0.1')), ('second', StrictVersion('0.2'))]
+        self.sp.get_all_files_in.side_effect = lambda folder: [folder + ' a.sql', folder + ' b.sql']
+
+    def test_plan_should_leave_out_scripts_already_applied(self):
+        sut = SyncPlanner(self.sp, frozenset([('0.1', 'first a.sql'), ('0.2', 'second b.sql')]))
+
+        result = sut.plan()
+
+        self.assertEqual([s.path for s in result], ['first b.sql', 'second a.sql'])
+
+
+    def test_plan_should_be_immutable_and_in_version_order(self):
+        sut = SyncPlanner(self.sp, frozenset())
+
+        result = sut.plan(StrictVersion('0.1'))
+
+        self.assertIsInstance(result.steps, tuple)
+        self.assertEqual(result.steps, (PlannedScript(StrictVersion('0.1'), 'first a.sql'), PlannedScript(StrictVersion('0.1'), 'first b.sql')))
+
+
+    def test_plan_should_skip_unchanged_complete_folders_without_listing_them_and_remember_complete_folders(self):
+        self.sp.get_folder_stamp.side_effect = lambda folder: {'first': 10, 'second': 20}[folder]
+        sut = SyncPlanner(self.sp, frozenset([('0.2', 'second a.sql'), ('0.2', 'second b.sql')]), {'first': 10})
+
+        result = sut.plan()
+
+        self.assertEqual(len(result), 0)
+        self.sp.get_all_files_in.assert_called_once_with('second')
+        self.assertEqual(sut.complete_folders, {'first': 10, 'second': 20})
+
+
+class TestTrackingRecorder(unittest.TestCase):
+    def test_flushes_once_enough_scripts_are_waiting(self):
+        write = mock.Mock()
+        sut = TrackingRecorder(write, flushRows = 2)
+
+        sut.add('one.sql', '0.1', 'a', 1)
+        write.assert_not_called()
+        sut.add('two.sql', '0.1', 'b', 2)
+
+        write.assert_called_once_with([('one.sql', '0.1', 'a', 1), ('two.sql', '0.1', 'b', 2)])
+        self.assertEqual(sut.pending, 0)
+
+    def test_when_write_fails_scripts_are_kept_for_the_next_flush(self):
+        write = mock.Mock(side_effect = [Exception('lost connection'), None])
+        sut = TrackingRecorder(write)
+        sut.add('one.sql', '0.1', 'a', 1)
+
+        self.assertRaises(Exception, sut.flush)
+        sut.flush()
+
+        self.assertEqual(write.call_args_list, [mock.call([('one.sql', '0.1', 'a', 1)])] * 2)
+
 
 class TestDb(unittest.TestCase):
     def test_get_executed_scripts_converts_data_table_to_dictionary(self):
@@ -73,14 +313,136 @@ class TestDb(unittest.TestCase):
         self.assertEqual(result, {'0.1': ['one zero.sql', 'one one.sql'], '0.2': ['two zero.sql']})
 
 
-    def test_schema_exists_in_db_is_case_insensetive_with_results_from_get_all_data_for(self):
+    def test_get_applied_scripts_returns_set_of_version_and_script(self):
+        sqlRunner = mock.MagicMock()
+        sqlRunner.get_all_data_for.side_effect = [[('user', 'TEST', None), ('column', 'ID', None)], [('0.1.0', 'one zero.sql'), ('0.2', 'two zero.sql')]]
+        sut = Db('test', sqlRunner)
+
+        result = sut.get_applied_scripts()
+
+        self.assertEqual(result, {('0.1', 'one zero.sql'), ('0.2', 'two zero.sql')})
+
+
+    def test_get_applied_scripts_reads_only_rows_above_the_cached_watermark(self):
+        sqlRunner = mock.MagicMock()
+        sqlRunner.get_all_data_for.side_effect = [[('user', 'TEST', None), ('column', 'ID', None)], [(3, '0.2.0', 'two zero.sql'), (WATERMARK_ROW_ID, '2', '2')]]
+        cache = mock.Mock(watermark = 2, scripts = frozenset([('0.1', 'one zero.sql')]))
+        cache.matches.return_value = True
+        sut = Db('test', sqlRunner, cache)
+
+        sut.get_applied_scripts()
+
+        sqlRunner.get_all_data_for.assert_called_with(GET_APPLIED_SCRIPTS_SINCE, 'test', {'watermark': 2})
+        cache.matches.assert_called_once_with(2, 2)
+        cache.add.assert_called_once_with([(3, '0.2', 'two zero.sql')])
+        cache.rebuild.assert_not_called()
+
+
+    def test_get_applied_scripts_rebuilds_the_cache_when_rows_at_or_below_the_watermark_changed(self):
+        sqlRunner = mock.MagicMock()
+        sqlRunner.get_all_data_for.side_effect = [[('user', 'TEST', None), ('column', 'ID', None)], [(WATERMARK_ROW_ID, '1', '2')], [(1, '0.1', 'one zero.sql')]]
+        cache = mock.Mock(watermark = 2)
+        cache.matches.return_value = False
+        sut = Db('test', sqlRunner, cache)
+
+        sut.get_applied_scripts()
+
+        sqlRunner.get_all_data_for.assert_called_with(GET_APPLIED_SCRIPTS_WITH_IDS, 'test')
+        cache.rebuild.assert_called_once_with([(1, '0.1', 'one zero.sql')])
+
+
+    def test_bootstrap_reads_schema_state_once_and_applied_scripts_only_when_tracked(self):
+        sqlRunner = mock.MagicMock()
+        sqlRunner.get_all_data_for.return_value = [('user', 'TEST', None), ('sequence', 'VERSION_TRACKING_ID_SEQ', 0)]
+        sut = Db('test', sqlRunner)
+
+        self.assertEqual(sut.snapshot, DbSnapshot(True, frozenset(), 0, frozenset()))
+        self.assertEqual((sut.snapshot.tracking_table_exists, sut.snapshot.sequence_exists), (False, True))
+        self.assertTrue(sut._schema_exists_in_db())
+        sqlRunner.get_all_data_for.assert_called_once_with(GET_SCHEMA_STATE, args = {'owner': 'test'})
+
+
+    @mock.patch('checksums.hash_file', return_value='abc')
+    def test_record_script_as_run_stores_checksum_of_script_when_flushed(self, hashFile):
+        sqlRunner = mock.MagicMock()
+        sut = Db('test', sqlRunner)
+
+        sut.record_script_as_run('one.sql', StrictVersion('0.1'), 42)
+        sut.record_script_as_run('two.sql', StrictVersion('0.1'), 7, 'def')
+        sqlRunner.run_sql_many.assert_not_called()
+        sut.flush_tracking()
+
+        sqlRunner.run_sql_many.assert_called_once_with(INSERT_SCRIPT_INFO, 'test', [
+            {'version': '0.1', 'script': 'one.sql', 'checksum': 'abc', 'duration_ms': 42},
+            {'version': '0.1', 'script': 'two.sql', 'checksum': 'def', 'duration_ms': 7}])
+
+
+    def test_record_scripts_as_run_writes_every_script_at_once(self):
+        sqlRunner = mock.MagicMock()
+        sut = Db('test', sqlRunner)
+
+        sut.record_scripts_as_run([('one.sql', StrictVersion('0.1'), 'abc', 5), ('two.sql', StrictVersion('0.1'), 'def', 6)])
+
+        sqlRunner.run_sql_many.assert_called_once_with(INSERT_SCRIPT_INFO, 'test', [
+            {'version': '0.1', 'script': 'one.sql', 'checksum': 'abc', 'duration_ms': 5},
+            {'version': '0.1', 'script': 'two.sql', 'checksum': 'def', 'duration_ms': 6}])
+
+
+    @mock.patch('csvloader.read_load')
+    @mock.patch('csvloader.CsvReader')
+    def test_run_script_loads_csv_files_in_batches(self, csvReader, readLoad):
+        sqlRunner = mock.MagicMock()
+        reader = csvReader.return_value.__enter__.return_value
+        sut = Db('test', sqlRunner)
+
+        self.assertTrue(sut.run_script('countries.csv'))
+
+        sqlRunner.run_sql_script.assert_not_called()
+        sqlRunner.run_sql_batches.assert_called_once_with('countries.csv', reader.statement, 'test', reader.batches.return_value, reader.direct_path)
+
+
+    def test_record_script_as_run_adds_script_to_applied_scripts(self):
+        sqlRunner = mock.MagicMock()
+        sqlRunner.get_all_data_for.side_effect = [[('user', 'TEST', None), ('column', 'ID', None)], []]
+        sut = Db('test', sqlRunner)
+        sut.get_applied_scripts()
+
+        sut.record_script_as_run('one.sql', StrictVersion('0.1'), 5, 'abc')
+
+        self.assertEqual(sut.get_applied_scripts(), {('0.1', 'one.sql')})
+
+
+    def test_make_sure_tracking_sequence_is_cached_alters_uncached_sequence(self):
+        sqlRunner = mock.MagicMock()
+        sut = Db('test', sqlRunner)
+        sqlRunner.get_all_data_for.side_effect = [[('user', 'TEST', None), ('column', 'ID', None), ('sequence', 'VERSION_TRACKING_ID_SEQ', 0)], []]
+
+        sut.make_sure_tracking_sequence_is_cached()
+
+        sqlRunner.run_sql_command.assert_called_once_with(ALTER_TRACKING_SEQUENCE_CACHE, 'test')
+
+
+    def test_make_sure_tracking_columns_exist_only_adds_missing_columns(self):
+        sqlRunner = mock.MagicMock()
+        sut = Db('test', sqlRunner)
+        sqlRunner.get_all_data_for.side_effect = [[('column', c, None) for c in ('ID', 'VERSION', 'SCRIPT', 'APPLIED_ON', 'DURATION_MS')], []]
+
+        sut.make_sure_tracking_columns_exist()
+
+        sqlRunner.run_sql_command.assert_called_once_with('alter table version_tracking add (checksum varchar2(64))', 'test')
+
+
+    def test_apply_schema_to_db_creates_tracking_table_for_new_schema_without_asking_the_db_again(self):
         sqlRunner = mock.MagicMock()
+        sqlRunner.get_all_data_for.return_value = []
         sut = Db('test', sqlRunner)
-        sqlRunner.get_all_data_for.return_value = [('UsEr1',), ('uSeR2',), ('TeSt',)]
 
-        result = sut._schema_exists_in_db()
+        with mock.patch.object(sut, 'create_schema', return_value = False):
+            sut.apply_schema_to_db()
 
-        self.assertTrue(result)
+        sqlRunner.run_sql_command.assert_called_once_with((CREATE_TRACKING_TABLE_SQL, CREATE_TRACKING_TABLE_SEQ), 'test')
+        self.assertEqual((sut.snapshot.schema_exists, sut.get_applied_scripts()), (True, frozenset()))
+        sqlRunner.get_all_data_for.assert_called_once_with(GET_SCHEMA_STATE, args = {'owner': 'test'})
 
     @mock.patch('dbsync.Db.get_all_files_in', return_value=['one.sql', 'two.sql'])
     def test_when_db_told_to_apply_base_line_script_will_call_get_all_scripts_for_baseline_folder(self, getAllFilesIn):
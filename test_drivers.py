@@ -0,0 +1,20 @@
+import unittest
+import unittest.mock as mock
+
+from drivers import *
+
+
+class TestDrivers(unittest.TestCase):
+    def test_runner_class_imports_the_module_of_the_driver(self):
+        with mock.patch('importlib.import_module') as importModule:
+            result = runner_class(SQLITE)
+
+        importModule.assert_called_once_with('sqlitedriver')
+        self.assertIs(result, importModule.return_value.SqliteSqlRunner)
+
+    def test_unknown_driver_throws_DriverException(self):
+        self.assertRaises(DriverException, runner_class, 'db2')
+
+
+if __name__ == '__main__':
+    unittest.main()
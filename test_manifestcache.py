@@ -0,0 +1,69 @@
+import unittest
+import unittest.mock as mock
+
+import os
+import os.path
+import tempfile
+
+from manifestcache import *
+
+
+class TestManifestCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.versions = os.path.join(self.folder.name, 'versions')
+        self.cachePath = os.path.join(self.folder.name, 'cache', 'foo.manifest.json')
+        os.makedirs(os.path.join(self.versions, '0.1'))
+        os.makedirs(os.path.join(self.versions, '_old'))
+        self.touch(os.path.join(self.versions, '0.1', 'a.sql'))
+        self.age(self.versions)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def touch(self, path):
+        with open(path, 'w') as f:
+            f.write('select 1 from dual;\n')
+
+    def age(self, path):
+        os.utime(path, (1000000000, 1000000000))
+
+    def saved_cache(self, rescan = False):
+        sut = ManifestCache(self.cachePath)
+        sut.get_folders_in(self.versions)
+        sut.save()
+        return ManifestCache(self.cachePath, rescan)
+
+    def test_unchanged_folder_is_listed_from_the_cache(self):
+        sut = self.saved_cache()
+
+        with mock.patch('os.scandir') as scandir:
+            self.assertEqual(sut.get_folders_in(self.versions), ['0.1'])
+            scandir.assert_not_called()
+        self.assertEqual(sut.stats, {'hits': 1, 'scans': 0})
+
+    def test_folder_is_listed_again_when_its_modification_time_changes(self):
+        sut = self.saved_cache()
+        os.makedirs(os.path.join(self.versions, '0.2'))
+        self.age(self.versions)
+        os.utime(self.versions, (1000000001, 1000000001))
+
+        self.assertEqual(sut.get_folders_in(self.versions), ['0.1', '0.2'])
+
+    def test_rescan_ignores_the_saved_cache(self):
+        sut = self.saved_cache(rescan = True)
+
+        sut.get_folders_in(self.versions)
+        self.assertEqual(sut.stats, {'hits': 0, 'scans': 1})
+
+    def test_recently_changed_folders_are_not_cached(self):
+        sut = ManifestCache(self.cachePath)
+        folder = os.path.join(self.versions, '0.1')
+
+        sut.get_files_in(folder)
+        sut.get_files_in(folder)
+        self.assertEqual(sut.stats, {'hits': 0, 'scans': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import unittest.mock as mock
+
+import json
+import os.path
+import tempfile
+import threading
+
+from metrics import *
+
+
+class TestRunMetrics(unittest.TestCase):
+    def test_counts_go_to_the_script_running_on_the_thread_and_the_rest_to_overhead(self):
+        sut = RunMetrics()
+        sut.count_query()
+
+        with sut.script('foo', '0.1', 'a.sql') as script:
+            sut.count_query(2)
+            sut.count_connection()
+            sut.add_spawn_time(0.5)
+            script.succeeded = True
+
+        summary = sut.summary()
+        self.assertEqual((summary['queries'], summary['connections'], summary['spawn_seconds']), (3, 1, 0.5))
+        self.assertEqual(summary['overhead']['queries'], 1)
+        self.assertEqual(summary['scripts'][0]['queries'], 2)
+        self.assertEqual(summary['scripts_applied'], 1)
+
+    def test_scripts_on_other_threads_do_not_share_counts(self):
+        sut = RunMetrics()
+
+        def apply(name, queries):
+            with sut.script('foo', '0.1', name):
+                sut.count_query(queries)
+
+        threads = [threading.Thread(target = apply, args = ('a.sql', 1)), threading.Thread(target = apply, args = ('b.sql', 5))]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(sorted((s.script, s.queries) for s in sut.scripts), [('a.sql', 1), ('b.sql', 5)])
+
+    def test_writes_json_and_prometheus_textfile(self):
+        sut = RunMetrics()
+        with sut.script('foo', '0.1', 'say "hi".sql'):
+            pass
+
+        with tempfile.TemporaryDirectory() as folder:
+            sut.write_json(os.path.join(folder, 'metrics.json'))
+            sut.write_prometheus(os.path.join(folder, 'dbsync.prom'))
+
+            with open(os.path.join(folder, 'metrics.json')) as f:
+                self.assertEqual(json.load(f)['scripts_failed'], 1)
+            with open(os.path.join(folder, 'dbsync.prom')) as f:
+                prom = f.read()
+            self.assertEqual(sorted(os.listdir(folder)), ['dbsync.prom', 'metrics.json'])
+
+        self.assertIn('# TYPE dbsync_script_duration_seconds gauge', prom)
+        self.assertIn('dbsync_script_succeeded{schema="foo",version="0.1",script="say \\"hi\\".sql"} 0.0', prom)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import unittest.mock as mock
+
+from profiler import *
+from sqlplusengine import parse_script
+
+
+class TestSqlPlusTimingReader(unittest.TestCase):
+    def test_timings_and_rows_are_put_against_statements_in_order(self):
+        profile = StatementProfile()
+        sut = SqlPlusTimingReader(parse_script('prompt loading\ninsert into a select * from b;\ncreate index a_ix on a (id);\n', 'a.sql'), profile)
+
+        for line in ['loading', '42 rows created.', '', 'Elapsed: 00:01:02.50', 'Index created.', 'Elapsed: 00:00:00.25']:
+            sut(line)
+
+        self.assertEqual([(t.line, t.seconds, t.rows) for t in profile.timings], [(2, 62.5, 42), (3, 0.25, None)])
+
+    def test_extra_timings_are_ignored(self):
+        profile = StatementProfile()
+        sut = SqlPlusTimingReader(parse_script('select 1 from dual;\n'), profile)
+
+        sut('Elapsed: 00:00:00.01')
+        sut('Elapsed: 00:00:00.02')
+
+        self.assertEqual(len(profile.timings), 1)
+
+
+class TestStatementProfile(unittest.TestCase):
+    def test_report_lists_the_slowest_statements_first(self):
+        sut = StatementProfile()
+        for line, seconds in ((1, 0.5), (2, 3.0), (3, 1.0)):
+            sut.record(mock.Mock(source = 'a.sql', line = line, text = 'select {0}\n  from dual'.format(line)), seconds)
+
+        report = sut.format_report(2).split('\n')
+
+        self.assertEqual(report[0], 'slowest 2 of 3 statement(s), 4.50 seconds in all:')
+        self.assertTrue(report[1].endswith('"a.sql" line 2: select 2 from dual'))
+        self.assertIn('"a.sql" line 3', report[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+import unittest.mock as mock
+
+import os.path
+import tempfile
+import time
+import threading
+
+from collections import namedtuple
+from scheduler import *
+
+Step = namedtuple('Step', ['version', 'path'])
+
+
+class TestReadScriptDependencies(unittest.TestCase):
+    def read(self, text):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'script.sql')
+            with open(path, 'w') as f:
+                f.write(text)
+            return read_script_dependencies(path)
+
+    def test_returns_none_when_nothing_declared(self):
+        self.assertIsNone(self.read('-- adds a column\nalter table a add (b number);\n'))
+
+    def test_returns_names_from_every_header_line(self):
+        self.assertEqual(self.read('-- Depends on: a.sql, b.sql\n-- depends on: c.sql\nselect 1 from dual;\n'), ['a.sql', 'b.sql', 'c.sql'])
+
+    def test_ignores_declarations_after_the_first_statement(self):
+        self.assertIsNone(self.read('select 1 from dual;\n-- depends on: a.sql\n'))
+
+
+class TestScriptScheduler(unittest.TestCase):
+    def setUp(self):
+        self.applied = []
+        self.dependencies = {}
+        self.lock = threading.Lock()
+
+    def apply(self, path, version):
+        with self.lock:
+            self.applied.append(path)
+        return not path.startswith('bad')
+
+    def schedule(self, paths, maxParallel = 4):
+        sut = ScriptScheduler(self.apply, lambda path: self.dependencies.get(path), maxParallel)
+        return sut.run([Step('0.1', p) for p in paths])
+
+    def test_when_nothing_declared_should_run_in_order_and_stop_at_first_failure(self):
+        self.assertFalse(self.schedule(['a.sql', 'bad.sql', 'c.sql']))
+        self.assertEqual(self.applied, ['a.sql', 'bad.sql'])
+
+    def test_should_only_run_scripts_once_their_dependencies_are_applied(self):
+        self.dependencies = {'a.sql': ['c.sql'], 'b.sql': [], 'c.sql': ['b.sql']}
+
+        self.assertTrue(self.schedule(['a.sql', 'b.sql', 'c.sql']))
+        self.assertEqual(self.applied, ['b.sql', 'c.sql', 'a.sql'])
+
+    def test_independent_scripts_run_at_the_same_time(self):
+        started = threading.Barrier(2, timeout = 5)
+        self.apply = lambda path, version: started.wait() is not None
+        self.dependencies = {'a.sql': [], 'b.sql': []}
+
+        self.assertTrue(self.schedule(['a.sql', 'b.sql'], 2))
+
+    def test_should_not_start_dependents_of_a_failed_script(self):
+        self.dependencies = {'bad.sql': [], 'b.sql': ['bad.sql']}
+
+        self.assertFalse(self.schedule(['bad.sql', 'b.sql']))
+        self.assertEqual(self.applied, ['bad.sql'])
+
+    def test_when_dependencies_form_a_cycle_should_throw_DependencyCycleException(self):
+        self.dependencies = {'a.sql': ['b.sql'], 'b.sql': ['a.sql']}
+
+        self.assertRaises(DependencyCycleException, self.schedule, ['a.sql', 'b.sql'])
+        self.assertEqual(self.applied, [])
+
+    def test_undeclared_scripts_run_in_order_alongside_declared_ones(self):
+        running, overlapped = set(), []
+        def apply(path, version):
+            with self.lock:
+                if path != 'c.sql' and running - {'c.sql'}:
+                    overlapped.append(path)
+                running.add(path)
+            time.sleep(0.05)
+            with self.lock:
+                running.discard(path)
+                self.applied.append(path)
+            return True
+        self.apply = apply
+        self.dependencies = {'a.sql': None, 'b.sql': None, 'c.sql': [], 'd.sql': None}
+
+        self.assertTrue(self.schedule(['a.sql', 'b.sql', 'c.sql', 'd.sql']))
+        self.assertEqual(overlapped, [])
+        self.assertEqual([p for p in self.applied if p != 'c.sql'], ['a.sql', 'b.sql', 'd.sql'])
+
+    def test_undeclared_script_does_not_wait_on_an_earlier_script_that_depends_on_it(self):
+        self.dependencies = {'a.sql': ['b.sql'], 'b.sql': None}
+
+        self.assertTrue(self.schedule(['a.sql', 'b.sql']))
+        self.assertEqual(self.applied, ['b.sql', 'a.sql'])
+
+    def test_order_puts_scripts_after_their_dependencies(self):
+        self.dependencies = {'a.sql': ['c.sql'], 'b.sql': [], 'c.sql': []}
+        sut = ScriptScheduler(self.apply, lambda path: self.dependencies.get(path))
+
+        self.assertEqual([s.path for s in sut.order([Step('0.1', p) for p in ('a.sql', 'b.sql', 'c.sql')])], ['b.sql', 'c.sql', 'a.sql'])
+
+
+class Blocked(Exception):
+    def __init__(self, output):
+        self.output = output
+
+
+class TestLockRetry(unittest.TestCase):
+    def setUp(self):
+        self.applied = []
+        self.blocked = {}
+        self.dependencies = {}
+        self.lock = threading.Lock()
+
+    def apply(self, path, version):
+        with self.lock:
+            self.applied.append(path)
+            if self.blocked.get(path):
+                self.blocked[path] -= 1
+                raise Blocked(['alter table a add (b number)', 'ORA-00054: resource busy and acquire with NOWAIT specified or timeout expired'])
+        return True
+
+    def schedule(self, paths, retries = 2):
+        sut = ScriptScheduler(self.apply, lambda path: self.dependencies.get(path), 4, RetryPolicy(retries, 0.01, 0.02))
+        return sut.run([Step('0.1', p) for p in paths])
+
+    def test_transient_error_finds_lock_errors_only(self):
+        self.assertEqual(transient_error(Blocked(['ORA-04021: timeout occurred while waiting to lock object '])), 'ORA-04021: timeout occurred while waiting to lock object')
+        self.assertIsNone(transient_error(Blocked(['ORA-00942: table or view does not exist'])))
+        self.assertIsNone(transient_error(ValueError('boom')))
+
+    def test_retry_delay_doubles_up_to_the_most(self):
+        self.assertEqual([retry_delay(RetryPolicy(5, 5, 60), a) for a in range(1, 6)], [5, 10, 20, 40, 60])
+
+    def test_in_order_blocked_script_is_run_again_before_the_next(self):
+        self.blocked = {'b.sql': 2}
+
+        self.assertTrue(self.schedule(['a.sql', 'b.sql', 'c.sql']))
+        self.assertEqual(self.applied, ['a.sql', 'b.sql', 'b.sql', 'b.sql', 'c.sql'])
+
+    def test_when_still_blocked_after_last_retry_should_throw(self):
+        self.blocked = {'a.sql': 3}
+
+        self.assertRaises(Blocked, self.schedule, ['a.sql', 'b.sql'])
+        self.assertEqual(self.applied, ['a.sql'] * 3)
+
+    def test_other_errors_are_not_retried(self):
+        def apply(path, version):
+            self.applied.append(path)
+            raise Blocked(['ORA-00942: table or view does not exist'])
+        self.apply = apply
+
+        self.assertRaises(Blocked, self.schedule, ['a.sql'])
+        self.assertEqual(self.applied, ['a.sql'])
+
+    def test_in_a_graph_other_scripts_run_while_a_blocked_one_waits(self):
+        self.blocked = {'a.sql': 1}
+        self.dependencies = {'a.sql': [], 'b.sql': ['a.sql'], 'c.sql': []}
+
+        self.assertTrue(self.schedule(['a.sql', 'b.sql', 'c.sql']))
+        self.assertEqual(sorted(self.applied[:2]), ['a.sql', 'c.sql'])
+        self.assertEqual(self.applied[2:], ['a.sql', 'b.sql'])
+
+
+if __name__ == '__main__':
+    unittest.main()
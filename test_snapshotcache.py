@@ -0,0 +1,112 @@
+import unittest
+import unittest.mock as mock
+
+import os
+import os.path
+import tempfile
+
+from collections import namedtuple
+from snapshotcache import *
+
+Step = namedtuple('Step', ['version', 'path'])
+Target = namedtuple('Target', ['username', 'password', 'host'])
+
+
+class TestSnapshotKeys(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def script(self, name, text):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_has_a_key_for_the_baseline_and_each_version(self):
+        base = [self.script('create.user.sql', 'create user foo;\n')]
+        steps = [Step('0.1', self.script('a.sql', 'a')), Step('0.1', self.script('b.sql', 'b')), Step('0.2', self.script('c.sql', 'c'))]
+
+        keys = snapshot_keys('sqlite', 'foo', base, steps)
+
+        self.assertEqual([version for version, key in keys], [None, '0.1', '0.2'])
+        self.assertEqual(len(set(key for version, key in keys)), 3)
+
+    def test_changing_a_script_changes_the_keys_from_its_version_on(self):
+        base = [self.script('create.user.sql', 'create user foo;\n')]
+        steps = [Step('0.1', self.script('a.sql', 'a')), Step('0.2', self.script('b.sql', 'b'))]
+        before = snapshot_keys('sqlite', 'foo', base, steps)
+
+        self.script('b.sql', 'b changed')
+        after = snapshot_keys('sqlite', 'foo', base, steps)
+
+        self.assertEqual(before[:2], after[:2])
+        self.assertNotEqual(before[2], after[2])
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.sut = SnapshotCache(self.folder.name, 1500)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def export(self, size):
+        def exportSchema(folder):
+            with open(os.path.join(folder, 'foo.dmp'), 'w') as f:
+                f.write('x' * size)
+        return exportSchema
+
+    def test_captured_snapshot_is_restored_from_its_folder(self):
+        self.sut.capture('abc', self.export(10), 'foo', '0.1')
+        importSchema = mock.Mock()
+
+        self.assertTrue(self.sut.contains('abc'))
+        self.sut.restore('abc', importSchema)
+
+        folder = importSchema.call_args[0][0]
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'foo.dmp')))
+
+    def test_failed_export_leaves_nothing_behind(self):
+        def exportSchema(folder):
+            raise SnapshotException('exp failed')
+
+        self.assertRaises(SnapshotException, self.sut.capture, 'abc', exportSchema, 'foo', '0.1')
+        self.assertFalse(self.sut.contains('abc'))
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+    def test_least_recently_used_snapshots_are_removed_to_stay_under_the_most_bytes(self):
+        self.sut.capture('one', self.export(500), 'foo', '0.1')
+        self.sut.capture('two', self.export(500), 'foo', '0.2')
+        self.sut.restore('one', mock.Mock())
+        self.sut.capture('three', self.export(500), 'foo', '0.3')
+
+        self.assertEqual(sorted(s['key'] for s in self.sut.list()), ['one', 'three'])
+
+
+class TestExporterFor(unittest.TestCase):
+    def test_commands_given_replace_the_drivers_exporter(self):
+        sut = exporter_for('oracle', None, Target('u', 'p', 'h'), 'exp {connect} {schema}', 'imp {connect} {file}')
+
+        with mock.patch('subprocess.run') as run:
+            run.return_value.returncode = 0
+            sut.export_schema('Foo', 'snap')
+
+        run.assert_called_once_with(['exp', 'u/p@h', 'Foo'], stdout = mock.ANY, stderr = mock.ANY, universal_newlines = True)
+
+    def test_needs_both_commands(self):
+        self.assertRaises(SnapshotException, exporter_for, 'oracle', None, Target('u', 'p', 'h'), 'exp', None)
+
+    def test_failing_command_throws_SnapshotException(self):
+        sut = OracleExporter(None, Target('u', 'p', 'h'))
+
+        with mock.patch('subprocess.run') as run:
+            run.return_value.returncode = 1
+            self.assertRaises(SnapshotException, sut.import_schema, 'foo', 'snap')
+
+
+if __name__ == '__main__':
+    unittest.main()
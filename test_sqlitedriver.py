@@ -0,0 +1,139 @@
+import unittest
+
+import os
+import os.path
+import tempfile
+
+from sqlitedriver import *
+from dbsync import Db, CheckpointException
+
+
+class TestSqliteSqlRunner(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.sut = SqliteSqlRunner('dbsync', '', MEMORY)
+
+    def tearDown(self):
+        self.sut.close()
+        self.folder.cleanup()
+
+    def script(self, name, text):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_create_user_creates_a_schema_that_scripts_run_in(self):
+        self.sut.run_sql_text('create.user.sql', 'create user foo identified by foo;\ngrant connect to foo;\n')
+        self.sut.run_sql_script(self.script('a.sql', 'create table t (id number);\ninsert into t values (1);\n'), 'foo')
+
+        self.assertEqual(self.sut.get_all_data_for('select id from t', 'foo'), [(1,)])
+        self.assertRaises(sqlite3.Error, self.sut.get_all_data_for, 'select id from t')
+
+    def test_failing_statement_throws_ScriptFailedException(self):
+        self.sut.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+
+        self.assertRaises(ScriptFailedException, self.sut.run_sql_text, 'bad.sql', 'create table;\n', 'foo')
+
+    def test_failing_batch_throws_with_the_rows_of_the_batch(self):
+        self.sut.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+        self.sut.run_sql_command('create table t (id integer primary key)', 'foo')
+
+        with self.assertRaises(ScriptFailedException) as context:
+            self.sut.run_sql_batches('t.csv', 'insert into t values (?)', 'foo', [[(1,), (2,)], [(3,), (1,)]])
+
+        self.assertEqual(context.exception.location, '"t.csv" rows 3-4')
+
+    def test_db_tracks_scripts_with_the_sqlite_dialect(self):
+        db = Db('foo', self.sut)
+        self.assertFalse(db.snapshot.schema_exists)
+        self.sut.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+
+        db = Db('foo', self.sut)
+        db.make_sure_tracking_is_up_to_date()
+        db.record_script_as_run('a.sql', '0.1', 5, 'abc')
+        db.flush_tracking()
+
+        again = Db('foo', self.sut.clone())
+        self.assertTrue(again.snapshot.schema_exists)
+        self.assertEqual(again.get_applied_scripts(), {('0.1', 'a.sql')})
+        self.assertEqual(again.get_tracked_checksums(), [('0.1', 'a.sql', 'abc')])
+
+    def test_schemas_in_a_folder_outlive_the_runner_until_dropped(self):
+        location = os.path.join(self.folder.name, 'db')
+        runner = SqliteSqlRunner('dbsync', '', location)
+        runner.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+        runner.run_sql_command('create table t (id integer)', 'foo')
+        runner.close()
+
+        runner = SqliteSqlRunner('dbsync', '', location)
+        self.assertEqual(runner.get_all_data_for('select count(*) from t', 'foo'), [(0,)])
+        runner.drop_schema('foo')
+        runner.close()
+
+        self.assertFalse(os.path.exists(os.path.join(location, 'foo.sqlite')))
+
+    def test_exporter_snapshots_and_restores_a_schema(self):
+        self.sut.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+        self.sut.run_sql_command('create table t (id integer)', 'foo')
+        self.sut.run_sql_command('insert into t values (1)', 'foo')
+        exporter = SqliteExporter(self.sut, None)
+        exporter.export_schema('foo', self.folder.name)
+
+        self.sut.drop_schema('foo')
+        self.sut.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+        exporter.import_schema('foo', self.folder.name)
+
+        self.assertEqual(self.sut.get_all_data_for('select id from t', 'foo'), [(1,)])
+
+
+class TestCheckpointedScripts(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.runner = SqliteSqlRunner('dbsync', '', MEMORY)
+        self.runner.run_sql_text('create.user.sql', 'create user foo identified by foo;\n')
+        self.runner.run_sql_command('create table t (id integer)', 'foo')
+        self.script = os.path.join(self.folder.name, 'backfill.sql')
+        self.write('insert into t values (1);\ninsert into t values (2);\ninsert into u values (3);\n')
+
+    def tearDown(self):
+        self.runner.close()
+        self.folder.cleanup()
+
+    def write(self, text):
+        with open(self.script, 'w') as f:
+            f.write(text)
+
+    def test_failed_script_carries_on_from_the_statement_that_failed(self):
+        db = Db('foo', self.runner, checkpointBytes = 1)
+        db.make_sure_tracking_is_up_to_date()
+        self.assertRaises(ScriptFailedException, db.apply_script, self.script, '0.1')
+        self.assertEqual([n for n, h, c in db.read_checkpoints(self.script)], [1, 2])
+
+        self.runner.run_sql_command('create table u (id integer)', 'foo')
+        self.assertTrue(db.apply_script(self.script, '0.1'))
+        db.flush_tracking()
+
+        self.assertEqual(self.runner.get_all_data_for('select id from t union all select id from u', 'foo'), [(1,), (2,), (3,)])
+        self.assertEqual(db.read_checkpoints(self.script), [])
+        self.assertEqual(Db('foo', self.runner).get_applied_scripts(), {('0.1', self.script)})
+
+    def test_script_changed_since_it_failed_is_not_carried_on_with(self):
+        db = Db('foo', self.runner, checkpointBytes = 1)
+        self.assertRaises(ScriptFailedException, db.run_script, self.script)
+
+        self.write('insert into t values (10);\ninsert into t values (2);\ninsert into u values (3);\n')
+
+        self.assertRaises(CheckpointException, db.run_script, self.script)
+        self.assertEqual(self.runner.get_all_data_for('select id from t', 'foo'), [(1,), (2,)])
+
+    def test_scripts_smaller_than_the_checkpoint_size_run_from_their_start(self):
+        db = Db('foo', self.runner, checkpointBytes = 1024)
+        self.assertRaises(ScriptFailedException, db.run_script, self.script)
+
+        self.assertFalse(db.should_checkpoint(self.script))
+        self.assertEqual(self.runner.get_all_data_for(SQLITE_DIALECT.checkpoint_table, args = {'owner': 'foo'}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
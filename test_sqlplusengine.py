@@ -0,0 +1,158 @@
+import unittest
+import unittest.mock as mock
+
+import os.path
+
+from sqlplusengine import *
+
+# (description, script, expected [(kind, text, line)])
+CORPUS = [
+    ('statements end with a semicolon at the end of a line',
+        'create table a (\n    id number);\nselect 1 from dual;\n',
+        [(SQL, 'create table a (\n    id number)', 1), (SQL, 'select 1 from dual', 3)]),
+
+    ('statement ends with a slash on its own line',
+        'select 1\nfrom dual\n/\n',
+        [(SQL, 'select 1\nfrom dual', 1)]),
+
+    ('semicolons in quotes, quoted identifiers and comments do not end a statement',
+        "insert into a values ('x;', \"b;\") -- not the end;\n  /* nor; */ ;\n",
+        [(SQL, "insert into a values ('x;', \"b;\") -- not the end;\n  /* nor; */", 1)]),
+
+    ('quoted strings may span lines and use q quotes',
+        "insert into a values ('one;\ntwo;', q'[it's;]');\n",
+        [(SQL, "insert into a values ('one;\ntwo;', q'[it's;]')", 1)]),
+
+    ('trailing comment after the semicolon',
+        'select 1 from dual; -- done\n',
+        [(SQL, 'select 1 from dual', 1)]),
+
+    ('pl/sql blocks end with a slash and keep their semicolons',
+        'begin\n  null;\nend;\n/\ncreate or replace procedure p as\nbegin\n  null;\nend;\n/\n',
+        [(PLSQL, 'begin\n  null;\nend;', 1), (PLSQL, 'create or replace procedure p as\nbegin\n  null;\nend;', 5)]),
+
+    ('sqlplus commands are recognised and abbreviated',
+        'WHENEVER SQLERROR EXIT 3 ROLLBACK;\nPRO hello world\nset serveroutput on\nREM a remark\nspool out.log\nexec p(1);\n',
+        [(WHENEVER, 'SQLERROR EXIT 3 ROLLBACK', 1), (PROMPT, 'hello world', 2), (SET, 'serveroutput on', 3), (IGNORED, 'spool out.log', 5), (PLSQL, 'begin\np(1);\nend;', 6)]),
+
+    ('set transaction is sql not a sqlplus set',
+        'set transaction read only;\n',
+        [(SQL, 'set transaction read only', 1)]),
+
+    ('blank line ends a statement without running it unless a slash follows',
+        'select 1\n\nselect 2\n\n/\n',
+        [(SQL, 'select 2', 3)]),
+
+    ('sqlblanklines on lets statements contain blank lines',
+        'set sqlblanklines on\nselect 1\n\nfrom dual;\n',
+        [(SET, 'sqlblanklines on', 1), (SQL, 'select 1\n\nfrom dual', 2)]),
+
+    ('a slash on its own runs the last statement again',
+        'select 1 from dual;\n/\n',
+        [(SQL, 'select 1 from dual', 1), (SQL, 'select 1 from dual', 1)]),
+
+    ('block comments and line comments between statements are skipped',
+        '/* header\n   comment; */\n-- note;\nselect 1 from dual;\n',
+        [(SQL, 'select 1 from dual', 4)]),
+
+    ('exit stops the script',
+        'select 1 from dual;\nexit\nselect 2 from dual;\n',
+        [(SQL, 'select 1 from dual', 1), (EXIT, '', 2)]),
+]
+
+
+class TestScriptParser(unittest.TestCase):
+    def test_corpus(self):
+        for description, script, expected in CORPUS:
+            with self.subTest(description):
+                result = [(s.kind, s.text, s.line) for s in parse_script(script)]
+                self.assertEqual(result, expected)
+
+    def test_includes_are_read_in_place_relative_to_the_including_script_for_double_at(self):
+        scripts = {
+            os.path.join('root', 'main.sql'): 'select 1 from dual;\n@@child\n@"other.sql"\n',
+            os.path.join('root', 'child.sql'): 'select 2 from dual;\n',
+            'other.sql': 'select 3 from dual;\n'}
+
+        result = parse_file(os.path.join('root', 'main.sql'), scripts.__getitem__)
+
+        self.assertEqual([(s.text, s.source, s.line) for s in result], [
+            ('select 1 from dual', os.path.join('root', 'main.sql'), 1),
+            ('select 2 from dual', os.path.join('root', 'child.sql'), 1),
+            ('select 3 from dual', 'other.sql', 1)])
+
+    def test_missing_include_throws_ScriptParseException_with_location(self):
+        with self.assertRaises(ScriptParseException) as context:
+            parse_script('select 1 from dual;\n@missing\n', 'main.sql', mock.Mock(side_effect=FileNotFoundError()))
+
+        self.assertEqual((context.exception.source, context.exception.line), ('main.sql', 2))
+
+    def test_parse_whenever(self):
+        self.assertEqual(parse_whenever('SQLERROR EXIT 3 ROLLBACK'), (True, 3, True))
+        self.assertEqual(parse_whenever('sqlerror exit failure'), (True, 1, False))
+        self.assertEqual(parse_whenever('sqlerror continue'), (False, 0, False))
+        self.assertIsNone(parse_whenever('oserror exit'))
+
+
+class DatabaseError(Exception):
+    pass
+
+
+class ScriptFailed(Exception):
+    def __init__(self, scriptPath, exitCode = None, location = None, output = None):
+        self.script_path = scriptPath
+        self.exit_code = exitCode
+        self.location = location
+        self.output = output or []
+
+
+class TestNativeScriptEngine(unittest.TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.cursor = self.pool.acquire.return_value.connection.cursor.return_value
+        self.sut = NativeScriptEngine(self.pool, DatabaseError, ScriptFailed)
+
+    def test_runs_each_statement_and_commits(self):
+        self.assertTrue(self.sut.run_statements('a.sql', parse_script('select 1 from dual;\nbegin\n  null;\nend;\n/\n'), 'foo'))
+
+        self.assertEqual(self.cursor.execute.call_args_list, [mock.call('select 1 from dual'), mock.call('begin\n  null;\nend;')])
+        self.pool.acquire.assert_called_once_with('foo')
+        self.pool.acquire.return_value.connection.commit.assert_called_once_with()
+
+    def test_failing_statement_throws_with_exit_code_and_line(self):
+        self.cursor.execute.side_effect = [None, DatabaseError('ORA-00942')]
+
+        with self.assertRaises(ScriptFailed) as context:
+            self.sut.run_statements('a.sql', parse_script('whenever sqlerror exit 5\nselect 1 from dual;\n\nselect 2 from x;\n', 'a.sql'))
+
+        self.assertEqual((context.exception.exit_code, context.exception.location, context.exception.output), (5, '"a.sql" line 4', ['ORA-00942']))
+        self.pool.release.assert_called_once_with(self.pool.acquire.return_value)
+
+    def test_whenever_continue_carries_on_after_errors(self):
+        self.cursor.execute.side_effect = [DatabaseError('ORA-00942'), None]
+
+        self.assertTrue(self.sut.run_statements('a.sql', parse_script('whenever sqlerror continue\nselect 1 from x;\nselect 2 from dual;\n')))
+        self.assertEqual(self.cursor.execute.call_count, 2)
+
+    def test_when_profiling_records_each_statement_with_rows_processed(self):
+        profile = mock.Mock()
+        self.cursor.rowcount = 3
+        sut = NativeScriptEngine(self.pool, DatabaseError, ScriptFailed, profile = profile)
+
+        sut.run_statements('a.sql', parse_script('prompt hi\ninsert into a select * from b;\n', 'a.sql'))
+
+        statement, seconds, rows = profile.record.call_args[0]
+        self.assertEqual((statement.line, rows), (2, 3))
+
+    def test_checkpoint_skips_completed_statements_but_alter_session_and_records_the_rest(self):
+        checkpoint = mock.Mock(completed = 2)
+
+        self.sut.run_statements('a.sql', parse_script('alter session set current_schema = foo;\ninsert into a values (1);\ninsert into a values (2);\n'), checkpoint = checkpoint)
+
+        self.assertEqual(self.cursor.execute.call_args_list, [mock.call('alter session set current_schema = foo'), mock.call('insert into a values (2)')])
+        checkpoint.record.assert_called_once_with(self.cursor, 3, mock.ANY)
+        self.assertEqual(self.pool.acquire.return_value.connection.commit.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,13 @@
 import unittest
 import unittest.mock as mock
+import os.path
+import sys
+import tempfile
+import time
 import sqlplusscriptrunner
+from profiler import StatementProfile
+
+FAKE_SQLPLUS = (sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_sqlplus.py'))
 
 
 class Test_ScriptFailedException_test(unittest.TestCase):
@@ -22,5 +29,188 @@ class Test_ScriptFailedException_test(unittest.TestCase):
         sqlplusProcess.wait.return_value = 1
         self.assertRaises(sqlplusscriptrunner.ScriptFailedException, sqlplusscriptrunner.run_sql_script, 'cnn', 'c:\test\path.sql', 'foo')
 
+
+class Test_ConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.connect = mock.Mock(side_effect=lambda: mock.Mock())
+        self.sut = sqlplusscriptrunner.ConnectionPool(self.connect, 2, 'system')
+
+    def test_when_connection_released_should_reuse_it_for_the_next_request(self):
+        with self.sut.connection('foo') as first: pass
+        with self.sut.connection('foo') as second: pass
+
+        self.assertIs(first, second)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(self.sut.stats()['created'], 1)
+        self.assertEqual(self.sut.stats()['reused'], 1)
+
+    def test_when_connection_already_on_schema_should_skip_switching_schema(self):
+        with self.sut.connection('foo'): pass
+        with self.sut.connection('foo'): pass
+        with self.sut.connection(): pass
+
+        self.assertEqual(self.sut.stats()['schema_switches'], 2)
+        self.assertEqual(self.sut.stats()['schema_switches_skipped'], 1)
+
+    def test_when_commands_fail_should_roll_back_and_keep_connection(self):
+        with self.assertRaises(ValueError):
+            with self.sut.connection('foo') as cnn:
+                raise ValueError()
+
+        cnn.rollback.assert_called_once_with()
+        with self.sut.connection('foo') as again: pass
+        self.assertIs(cnn, again)
+
+
+class Test_OracleSqlRunner(unittest.TestCase):
+    def test_run_sql_batches_commits_once_unless_told_to_commit_each_batch(self):
+        sut = sqlplusscriptrunner.OracleSqlRunner('u', 'p', 'h')
+        cnn = mock.Mock()
+        with mock.patch('sqlplusscriptrunner.oracle') as oracle:
+            oracle.return_value.connect.return_value = cnn
+            rows = sut.run_sql_batches('a.csv', 'insert', 'foo', [[(1,), (2,)], [(3,)]])
+            self.assertEqual(cnn.commit.call_count, 1)
+            sut.run_sql_batches('a.csv', 'insert', 'foo', [[(1,), (2,)], [(3,)]], True)
+
+        self.assertEqual(rows, 3)
+        self.assertEqual(cnn.cursor.return_value.executemany.call_count, 4)
+        self.assertEqual(cnn.commit.call_count, 4)
+
+    def test_ddl_lock_timeout_is_set_on_every_new_connection(self):
+        sut = sqlplusscriptrunner.OracleSqlRunner('u', 'p', 'h', ddlLockTimeout = 30)
+        with mock.patch('sqlplusscriptrunner.oracle') as oracle:
+            sut.for_target('u', 'p', 'other').run_sql_command('select 1 from dual')
+
+        oracle.return_value.connect.return_value.cursor.return_value.execute.assert_any_call('alter session set ddl_lock_timeout = 30')
+
+
+class Test_OutputPipeline(unittest.TestCase):
+    def test_only_the_last_lines_are_kept(self):
+        sut = sqlplusscriptrunner.OutputPipeline('a.sql', sqlplusscriptrunner.OutputSettings(2, None, None))
+        for line in ('one\n', 'two\n', 'three\n'):
+            sut.write(line)
+        sut.close()
+
+        self.assertEqual(sut.tail, ['two', 'three'])
+
+    def test_output_is_written_to_a_log_file_per_script(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sut = sqlplusscriptrunner.OutputPipeline(os.path.join('.', 'foo', 'versions', '0.1', 'add table.sql'), sqlplusscriptrunner.OutputSettings(2, folder, None))
+            sut.write('Table created.\n')
+            sut.close()
+
+            with open(os.path.join(folder, 'foo_versions_0.1_add_table.sql.log')) as f:
+                self.assertEqual(f.read(), 'Table created.\n')
+
+    def test_heartbeat_is_logged_while_script_runs(self):
+        with self.assertLogs('sqlplusscriptrunner.output', 'INFO') as logs:
+            sut = sqlplusscriptrunner.OutputPipeline('slow.sql', sqlplusscriptrunner.OutputSettings(2, None, 0.01))
+            time.sleep(0.1)
+            sut.close()
+
+        self.assertIn('"slow.sql" still running', logs.output[0])
+
+
+class Test_SqlPlusSession(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.processLog = os.path.join(self.folder.name, 'processes.log')
+        os.environ['FAKE_SQLPLUS_LOG'] = self.processLog
+        self.sut = sqlplusscriptrunner.SqlPlusSession('cnn', FAKE_SQLPLUS)
+
+    def tearDown(self):
+        self.sut.close()
+        del os.environ['FAKE_SQLPLUS_LOG']
+        self.folder.cleanup()
+
+    def write_script(self, name, text):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def processes_started(self):
+        with open(self.processLog) as f:
+            return len(f.readlines())
+
+    def test_when_running_several_scripts_should_only_start_sqlplus_once(self):
+        for name in ('one.sql', 'two.sql', 'three.sql'):
+            self.assertTrue(self.sut.run_sql_script(self.write_script(name, 'select 1 from dual;\n'), 'foo'))
+
+        self.assertEqual(self.processes_started(), 1)
+
+    def test_when_script_fails_should_throw_ScriptFailedException_for_that_script_with_exit_code(self):
+        self.sut.run_sql_script(self.write_script('one.sql', 'select 1 from dual;\n'), 'foo')
+        failing = self.write_script('two.sql', '-- fake: error\n')
+
+        with self.assertRaises(sqlplusscriptrunner.ScriptFailedException) as context:
+            self.sut.run_sql_script(failing, 'foo')
+
+        self.assertEqual(context.exception.script_path, failing)
+        self.assertEqual(context.exception.exit_code, 1)
+
+    def test_runner_with_session_open_should_reuse_one_process_for_scripts_run_one_after_another(self):
+        sqlRunner = sqlplusscriptrunner.OracleSqlRunner('user', 'password', 'host', FAKE_SQLPLUS)
+        sqlRunner.open_session()
+        try:
+            sqlRunner.run_sql_script(self.write_script('one.sql', 'select 1 from dual;\n'), 'foo')
+            sqlRunner.run_sql_script(self.write_script('two.sql', 'select 1 from dual;\n'), 'foo')
+        finally:
+            sqlRunner.close_session()
+
+        self.assertEqual(self.processes_started(), 1)
+
+    def test_whenever_continue_in_one_script_does_not_carry_on_into_the_next(self):
+        self.assertTrue(self.sut.run_sql_script(self.write_script('one.sql', 'whenever sqlerror continue\n-- fake: error\n'), 'foo'))
+        failing = self.write_script('two.sql', '-- fake: error\n')
+
+        with self.assertRaises(sqlplusscriptrunner.ScriptFailedException) as context:
+            self.sut.run_sql_script(failing, 'foo')
+
+        self.assertEqual(context.exception.script_path, failing)
+        self.assertEqual(self.processes_started(), 1)
+
+    def test_settings_and_schema_are_put_back_before_every_script(self):
+        stdin = mock.Mock()
+
+        sqlplusscriptrunner.reset_session(stdin, 'foo', 30)
+
+        written = ''.join(c[0][0] for c in stdin.write.call_args_list)
+        self.assertEqual(written, 'WHENEVER SQLERROR EXIT 1;\nSET TERMOUT ON\nSET TIMING OFF\nALTER SESSION SET DDL_LOCK_TIMEOUT = 30;\nALTER SESSION SET CURRENT_SCHEMA = foo;\n')
+
+    def test_one_shot_run_streams_output_and_keeps_tail_on_failure(self):
+        failing = self.write_script('one.sql', '-- fake: error\n')
+
+        with self.assertRaises(sqlplusscriptrunner.ScriptFailedException) as context:
+            sqlplusscriptrunner.run_sql_script('cnn', failing, 'foo', FAKE_SQLPLUS)
+
+        self.assertEqual(context.exception.output, ['ORA-00942: table or view does not exist'])
+
+    def test_after_a_failure_should_start_a_new_process_for_the_next_script(self):
+        self.assertRaises(sqlplusscriptrunner.ScriptFailedException, self.sut.run_sql_script, self.write_script('one.sql', '-- fake: error\n'))
+
+        self.assertTrue(self.sut.run_sql_script(self.write_script('two.sql', 'select 1 from dual;\n')))
+        self.assertEqual(self.processes_started(), 2)
+
+    def test_run_text_streams_script_bodies_into_the_session_and_fails_on_the_right_one(self):
+        self.assertTrue(self.sut.run_text('one.sql', 'select 1 from dual;\n' * 5000, 'foo'))
+
+        with self.assertRaises(sqlplusscriptrunner.ScriptFailedException) as context:
+            self.sut.run_text('two.sql', 'select 1 from dual;\n-- fake: error\n', 'foo')
+
+        self.assertEqual(context.exception.script_path, 'two.sql')
+        self.assertEqual(self.processes_started(), 1)
+
+    def test_when_profiling_should_time_each_statement_of_the_script(self):
+        profile = StatementProfile()
+        sut = sqlplusscriptrunner.SqlPlusSession('cnn', FAKE_SQLPLUS, profile = profile)
+        try:
+            script = self.write_script('one.sql', 'select 1 from dual;\n\nbegin\n  null;\nend;\n/\n')
+            sut.run_sql_script(script, 'foo')
+        finally:
+            sut.close()
+
+        self.assertEqual([(t.source, t.line, t.seconds) for t in profile.timings], [(script, 1, 0.01), (script, 3, 0.01)])
+
 if __name__ == '__main__':
     unittest.main()
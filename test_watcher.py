@@ -0,0 +1,68 @@
+import unittest
+
+import os
+import os.path
+import sys
+import tempfile
+
+from watcher import *
+
+
+class ScriptedWatcher(Watcher):
+    def __init__(self, waits):
+        self.waits = list(waits)
+
+    def wait(self, timeout = None):
+        return self.waits.pop(0)
+
+
+class TestWatcher(unittest.TestCase):
+    def test_changes_are_reported_once_a_burst_is_over_without_ignored_files(self):
+        sut = ScriptedWatcher([['v/a.sql'], ['v/.a.sql.swp', 'v/a.sql'], [], ['v/a.sql~'], [], ['v/b.sql'], []])
+
+        changes = sut.changes(0)
+
+        self.assertEqual(next(changes), {'v/a.sql'})
+        self.assertEqual(next(changes), {'v/b.sql'})
+
+
+class WatcherTests(object):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.folder.name, 'versions', '0.1'))
+        self.sut = self.create_watcher([os.path.join(self.folder.name, 'versions')])
+
+    def tearDown(self):
+        self.sut.close()
+        self.folder.cleanup()
+
+    def write(self, *path):
+        with open(os.path.join(self.folder.name, *path), 'w') as f:
+            f.write('select 1 from dual;\n')
+
+    def test_nothing_changed_returns_nothing_once_timed_out(self):
+        self.assertEqual(self.sut.wait(0.05), [])
+
+    def test_script_added_to_a_new_folder_is_reported(self):
+        os.makedirs(os.path.join(self.folder.name, 'versions', '0.2'))
+        self.sut.wait(0.2)
+        self.write('versions', '0.2', 'a.sql')
+
+        changed = set(self.sut.wait(2))
+
+        self.assertIn(os.path.join(self.folder.name, 'versions', '0.2', 'a.sql'), changed)
+
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    def create_watcher(self, roots):
+        return PollingWatcher(roots, 0.01)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is only on linux')
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+    def create_watcher(self, roots):
+        return InotifyWatcher(roots)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import sys
+import abc
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+#------------------------------------------------------------------------------
+# Folder watchers
+#------------------------------------------------------------------------------
+# Report the files added, changed or removed under a set of folders. On
+# Linux inotify is used, through ctypes, with a watch on every folder as
+# inotify does not watch sub folders itself. Elsewhere, or if inotify cannot
+# be set up (no watches left, say), the folders are polled.
+#
+# changes() yields the paths changed in bursts: a burst ends once nothing
+# has changed for the debounce time, so an editor saving a file in several
+# steps, or a copy of many files, is reported once. Hidden files and editor
+# backups (names starting with "." or ending with "~") are not reported.
+#------------------------------------------------------------------------------
+DEFAULT_DEBOUNCE_SECONDS = 0.25
+DEFAULT_POLL_SECONDS = 0.5
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')
+READ_BYTES = 64 * 1024
+
+
+def is_ignored(path):
+    name = os.path.basename(path)
+    return name.startswith('.') or name.endswith('~')
+
+
+def watch(roots, pollSeconds = DEFAULT_POLL_SECONDS):
+    """Returns a watcher of the folders under roots, using inotify if it can"""
+
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(roots)
+        except OSError as ex:
+            logging.getLogger('watcher').warning('cannot watch with inotify ({0}), polling instead.'.format(ex))
+    return PollingWatcher(roots, pollSeconds)
+
+
+class Watcher(abc.ABC):
+    def changes(self, debounceSeconds = DEFAULT_DEBOUNCE_SECONDS):
+        """Yields the set of paths changed in each burst of changes, forever"""
+
+        while True:
+            changed = set(self.wait())
+            more = changed
+            while more:
+                more = set(self.wait(debounceSeconds))
+                changed |= more
+            changed = set(p for p in changed if not is_ignored(p))
+            if changed:
+                yield changed
+
+
+    @abc.abstractmethod
+    def wait(self, timeout = None):
+        """Returns the paths changed, waiting up to timeout seconds (or for ever) for a change"""
+
+
+    def close(self):
+        pass
+
+
+#------------------------------------------------------------------------------
+# InotifyWatcher
+#------------------------------------------------------------------------------
+class InotifyWatcher(Watcher):
+    log = logging.getLogger('watcher.InotifyWatcher')
+
+    def __init__(self, roots):
+        self.__libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        self.__fd = self.__libc.inotify_init1(IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1: ' + os.strerror(ctypes.get_errno()))
+        self.__folders = {}
+        try:
+            for root in roots:
+                self.__add_tree(root)
+        except OSError:
+            self.close()
+            raise
+        InotifyWatcher.log.debug('watching {0} folder(s) with inotify.'.format(len(self.__folders)))
+
+
+    def wait(self, timeout = None):
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.__fd, READ_BYTES)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].split(b'\0', 1)[0].decode(errors = 'replace')
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                InotifyWatcher.log.warning('inotify queue overflowed, some changes may be reported late.')
+                changed.extend(self.__folders.values())
+                continue
+            folder = self.__folders.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.__add_tree(path)
+            changed.append(path)
+        return changed
+
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+
+    def __add_tree(self, root):
+        for folder, subFolders, files in os.walk(root):
+            wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch "{0}": {1}'.format(folder, os.strerror(ctypes.get_errno())))
+            self.__folders[wd] = folder
+
+
+#------------------------------------------------------------------------------
+# PollingWatcher
+#------------------------------------------------------------------------------
+class PollingWatcher(Watcher):
+    log = logging.getLogger('watcher.PollingWatcher')
+
+    def __init__(self, roots, pollSeconds = DEFAULT_POLL_SECONDS):
+        self.__roots = list(roots)
+        self.__pollSeconds = pollSeconds
+        self.__state = self.__scan()
+        PollingWatcher.log.debug('polling {0} path(s) every {1}s.'.format(len(self.__state), pollSeconds))
+
+
+    def wait(self, timeout = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self.__scan()
+            changed = [p for p in set(state) | set(self.__state) if state.get(p) != self.__state.get(p)]
+            self.__state = state
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            time.sleep(self.__pollSeconds if deadline is None else max(0, min(self.__pollSeconds, deadline - time.monotonic())))
+
+
+    def __scan(self):
+        state = {}
+        for root in self.__roots:
+            for folder, subFolders, files in os.walk(root):
+                for name in files:
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    state[path] = (stat.st_mtime_ns, stat.st_size)
+        return state